@@ -3,6 +3,9 @@
 #define DEVICE_ID "tracker_01"
 #define I2C_SDA 21
 #define I2C_SCL 22
+// 1 = enviar las lecturas en el formato binario compacto (binary_format.py del
+// servidor, ~27 bytes frente a ~170 en JSON); 0 = JSON
+#define BINARY_PAYLOAD 0
 
 
 #include <WiFi.h>
@@ -177,6 +180,32 @@ void loop() {
     bool posicionCambio = (abs(posH - lastPosH) > MIN_CHANGE_TO_SEND) || (abs(posV - lastPosV) > MIN_CHANGE_TO_SEND);
 
     if (tiempoTranscurrido || posicionCambio) {
+      bool limitH = (posH == limiteMinH || posH == limiteMaxH);
+      bool limitV = (posV == limiteMinV || posV == limiteMaxV);
+
+#if BINARY_PAYLOAD
+      // Registro v1 little-endian (el orden nativo del ESP32): versión, flags, longitud
+      // e id, 4 x uint16 LDR, 2 x uint8 servos, float32 voltaje [, 4 x float32 BME]
+      uint8_t payload[64];
+      size_t n = 0;
+      const size_t idLen = strlen(DEVICE_ID);
+      payload[n++] = 1;
+      payload[n++] = (limitH ? 0x01 : 0) | (limitV ? 0x02 : 0) | (bme_ok ? 0x04 : 0);
+      payload[n++] = (uint8_t)idLen;
+      memcpy(payload + n, DEVICE_ID, idLen); n += idLen;
+      const uint16_t ldrs[4] = {(uint16_t)tl, (uint16_t)tr, (uint16_t)bl, (uint16_t)br};
+      memcpy(payload + n, ldrs, sizeof(ldrs)); n += sizeof(ldrs);
+      payload[n++] = (uint8_t)posH;
+      payload[n++] = (uint8_t)posV;
+      memcpy(payload + n, &panelVoltage, sizeof(float)); n += sizeof(float);
+      if (bme_ok) {
+        const float bmeVals[4] = {bme_tempC, bme_hPa, bme_hum, bme_altm};
+        memcpy(payload + n, bmeVals, sizeof(bmeVals)); n += sizeof(bmeVals);
+      }
+      Serial.print("[" DEVICE_ID "] Enviando ");
+      Serial.print(n);
+      Serial.println(" bytes");
+#else
       StaticJsonDocument<384> doc;
       doc["device_id"] = DEVICE_ID;
       doc["ldr_tl"] = tl;
@@ -185,9 +214,7 @@ void loop() {
       doc["ldr_br"] = br;
       doc["servo_h"] = posH;
       doc["servo_v"] = posV;
-      
-      bool limitH = (posH == limiteMinH || posH == limiteMaxH);
-      bool limitV = (posV == limiteMinV || posV == limiteMaxV);
+
       doc["at_limit_h"] = limitH;
       doc["at_limit_v"] = limitV;
       doc["panel_voltage"] = panelVoltage;
@@ -204,14 +231,19 @@ void loop() {
       serializeJson(doc, json_string);
       Serial.print("[" DEVICE_ID "] Enviando: ");
       Serial.println(json_string);
+#endif
 
       HTTPClient http;
-      String url = String(SERVER_BASE_URL) + "/sensor_values";
+      String url = String(SERVER_BASE_URL) + "/sensor_values?format=compact";
       http.begin(wifi, url);
       http.setConnectTimeout(5000);
+#if BINARY_PAYLOAD
+      http.addHeader("Content-Type", "application/x-solar-tracker");
+      int httpResponseCode = http.POST(payload, n);
+#else
       http.addHeader("Content-Type", "application/json");
-
       int httpResponseCode = http.POST(json_string);
+#endif
       if (httpResponseCode > 0) {
         String response = http.getString();
         Serial.print("[" DEVICE_ID "] HTTP ");
@@ -219,48 +251,41 @@ void loop() {
         Serial.print(": ");
         Serial.println(response);
 
-        // respuesta del servidor con nuevos ángulos
+        // respuesta compacta: [ok, servo_h, servo_v, fast_interval_ms, fast_duration_ms]
+        // (el análisis completo queda en GET /devices/<id>/analysis)
         if (httpResponseCode == 200) {
-          StaticJsonDocument<256> responseDoc;
+          StaticJsonDocument<96> responseDoc;
           DeserializationError error = deserializeJson(responseDoc, response);
-          
-          if (!error && responseDoc.containsKey("command")) {
-            JsonObject cmd = responseDoc["command"];
-            
-            if (cmd.containsKey("servo_h") && cmd.containsKey("servo_v")) {
-              int newH = cmd["servo_h"];
-              int newV = cmd["servo_v"];
-              
-              
-              // 4. Validar límites
-              bool validH = (newH >= limiteMinH && newH <= limiteMaxH);
-              bool validV = (newV >= limiteMinV && newV <= limiteMaxV);
-              
-              if (validH && validV) {
-                posH = newH;
-                posV = newV;
-                servoH.write(posH);
-                servoV.write(posV);
-                Serial.print("[" DEVICE_ID "] Movido a H:");
-                Serial.print(posH);
-                Serial.print(" V:");
-                Serial.println(posV);
-              } else {
-                Serial.println("[" DEVICE_ID "] Ángulos fuera de límites");
-              }
+          JsonArray cmd = responseDoc.as<JsonArray>();
+
+          if (!error && cmd.size() >= 5) {
+            int newH = cmd[1];
+            int newV = cmd[2];
+
+            // 4. Validar límites
+            bool validH = (newH >= limiteMinH && newH <= limiteMaxH);
+            bool validV = (newV >= limiteMinV && newV <= limiteMaxV);
+
+            if (validH && validV) {
+              posH = newH;
+              posV = newV;
+              servoH.write(posH);
+              servoV.write(posV);
+              Serial.print("[" DEVICE_ID "] Movido a H:");
+              Serial.print(posH);
+              Serial.print(" V:");
+              Serial.println(posV);
+            } else {
+              Serial.println("[" DEVICE_ID "] Ángulos fuera de límites");
             }
-          }
 
-          // Activar modo rápido temporal si el servidor lo indica
-          if (!error && responseDoc.containsKey("fast")) {
-            JsonObject fast = responseDoc["fast"];
-            if (fast.containsKey("fast_interval_ms") && fast.containsKey("fast_duration_ms")) {
-              unsigned long fi = fast["fast_interval_ms"];
-              unsigned long fd = fast["fast_duration_ms"];
-              if (fi >= 200 && fi <= 2000 && fd <= 10000) {
-                httpInterval = fi;
-                fastModeUntil = millis() + fd;
-              }
+            // Intervalo de envío indicado por el servidor durante fd ms (0 = sin indicación);
+            // al vencer se vuelve a HTTP_SEND_INTERVAL
+            unsigned long fi = cmd[3];
+            unsigned long fd = cmd[4];
+            if (fi >= 200 && fi <= 60000 && fd > 0 && fd <= 600000) {
+              httpInterval = fi;
+              fastModeUntil = millis() + fd;
             }
           }
         }
@@ -0,0 +1,286 @@
+"""
+Agregados continuos (rollups) de las lecturas del tracker.
+
+Cada lectura procesada se suma a la ventana de 1 minuto y a la de 1 hora de
+su dispositivo. Al llegar una lectura de la ventana siguiente, o cuando la
+ventana lleva `gracia_s` cerrada sin lecturas (tracker parado), se emite un
+punto por ventana en las mediciones tracker_1m / tracker_1h
+(line_protocol.TRACKER_1M / TRACKER_1H) con timestamp = inicio de la ventana:
+
+    - muestras, luz media/mín/máx (media de los 4 LDR) y media de cada LDR
+    - voltaje del panel medio y máximo, integral de voltaje (V·s) y, si se
+      conoce la carga, energía estimada V²/R·dt en Wh
+    - segundos en cada estado ambiental
+    - anomalías y drifts detectados
+    - recorrido de los servos (suma de |Δ| entre lecturas consecutivas)
+
+Las integrales en el tiempo mantienen el valor de la lectura anterior hasta
+la siguiente; un hueco mayor que `max_hueco_s` (tracker apagado) no suma.
+
+Solo se guarda en memoria la ventana en curso de cada dispositivo y duración.
+Si una lectura atrasada (p. ej. un lote tras un corte WiFi) cae en una ventana
+que ya se emitió por inactividad, se reabre y se vuelve a emitir completa:
+InfluxDB sobrescribe el punto con el mismo timestamp. Las lecturas anteriores
+a la ventana en curso ya no se pueden corregir y solo se cuentan.
+"""
+
+import math
+import threading
+import time
+
+import line_protocol
+
+
+ESTADOS = ("SUNNY", "CLOUDY", "UNSTABLE", "HUMID_HAZY")
+_INDICE_ESTADO = {e: i for i, e in enumerate(ESTADOS)}
+
+
+class _Ventana:
+    """Acumuladores de una ventana de un dispositivo"""
+
+    __slots__ = ("inicio_ms", "emitida", "n", "luz_suma", "luz_min", "luz_max", "ldr_suma",
+                 "v_suma", "v_n", "v_max", "volt_s", "energia_j", "t_estado",
+                 "anomalias", "drifts", "recorrido_h", "recorrido_v")
+
+    def __init__(self, inicio_ms):
+        self.inicio_ms = inicio_ms
+        self.emitida = False
+        self.n = 0
+        self.luz_suma = 0.0
+        self.luz_min = math.inf
+        self.luz_max = -math.inf
+        self.ldr_suma = [0, 0, 0, 0]
+        self.v_suma = 0.0
+        self.v_n = 0
+        self.v_max = -math.inf
+        self.volt_s = 0.0
+        self.energia_j = 0.0
+        self.t_estado = [0.0, 0.0, 0.0, 0.0]
+        self.anomalias = 0
+        self.drifts = 0
+        self.recorrido_h = 0
+        self.recorrido_v = 0
+
+    def valores(self, con_energia):
+        """Tupla en el orden de line_protocol._CAMPOS_AGREGADO"""
+        n = self.n
+        con_voltaje = self.v_n > 0
+        return (
+            n,
+            self.luz_suma / n, self.luz_min, self.luz_max,
+            self.ldr_suma[0] / n, self.ldr_suma[1] / n, self.ldr_suma[2] / n, self.ldr_suma[3] / n,
+            self.v_suma / self.v_n if con_voltaje else None,
+            self.v_max if con_voltaje else None,
+            self.volt_s if con_voltaje else None,
+            self.energia_j / 3600.0 if con_voltaje and con_energia else None,
+            *self.t_estado,
+            self.anomalias, self.drifts,
+            self.recorrido_h, self.recorrido_v
+        )
+
+
+class _Dispositivo:
+    """Última lectura y ventanas (una por duración) de un dispositivo"""
+
+    __slots__ = ("ts_ms", "estado", "voltaje", "servo_h", "servo_v", "ventanas", "piso")
+
+    def __init__(self, n_ventanas, piso=None):
+        self.ts_ms = None
+        self.estado = None
+        self.voltaje = None
+        self.servo_h = None
+        self.servo_v = None
+        self.ventanas = [None] * n_ventanas
+        # Inicio de la última ventana emitida antes de olvidar el dispositivo:
+        # una lectura en esa ventana o antes la sobrescribiría incompleta
+        self.piso = piso
+
+
+class AgregadorTracker:
+    """
+    Rollups por dispositivo y ventana.
+
+    Args:
+        emitir: callable(list[str]) que recibe las líneas de las ventanas cerradas
+            (normalmente InfluxBatchWriter.put_many)
+        ventanas: ((segundos, Esquema), ...) a agregar
+        carga_ohm: resistencia de carga del panel para estimar energía; None = sin energía
+        max_hueco_s: separación máxima entre lecturas que cuenta en las integrales
+        gracia_s: tiempo tras el fin de una ventana antes de emitirla sin nuevas lecturas
+    """
+
+    MAX_OLVIDADOS = 65536
+
+    def __init__(self, emitir, ventanas=((60, line_protocol.TRACKER_1M), (3600, line_protocol.TRACKER_1H)),
+                 carga_ohm=None, max_hueco_s=300.0, gracia_s=30.0):
+        self.emitir = emitir
+        self.ventanas = tuple((int(segundos * 1000), esquema) for segundos, esquema in ventanas)
+        self.carga_ohm = float(carga_ohm) if carga_ohm else None
+        self.max_hueco_ms = int(max_hueco_s * 1000)
+        self.gracia_ms = int(gracia_s * 1000)
+
+        self._dispositivos = {}
+        self._olvidados = {}     # device_id -> piso de _Dispositivo
+        self._lock = threading.Lock()
+        self._ultima_purga_ms = int(time.time() * 1000)
+
+        # Métricas
+        self.lecturas = 0
+        self.puntos = 0
+        self.reemitidos = 0
+        self.tardias = 0
+
+    def observar(self, device_id, ts_ms, ldr_tl, ldr_tr, ldr_bl, ldr_br, panel_voltage,
+                 estado, anomalia, drift, servo_h, servo_v):
+        """Suma una lectura procesada a las ventanas de su dispositivo"""
+        cerradas = []
+        luz = (ldr_tl + ldr_tr + ldr_bl + ldr_br) / 4.0
+        voltaje = panel_voltage if panel_voltage == panel_voltage and math.isfinite(panel_voltage) else None
+        ahora_ms = int(time.time() * 1000)
+
+        with self._lock:
+            d = self._dispositivos.get(device_id)
+            if d is None:
+                d = self._dispositivos[device_id] = _Dispositivo(len(self.ventanas),
+                                                                 self._olvidados.pop(device_id, None))
+
+            # Intervalo desde la lectura anterior, con el estado y voltaje de esta
+            dt = 0.0
+            if d.ts_ms is not None and 0 < ts_ms - d.ts_ms <= self.max_hueco_ms:
+                dt = (ts_ms - d.ts_ms) / 1000.0
+            i_estado = _INDICE_ESTADO.get(d.estado)
+            v_ant = d.voltaje
+            delta_h = abs(servo_h - d.servo_h) if d.servo_h is not None else 0
+            delta_v = abs(servo_v - d.servo_v) if d.servo_v is not None else 0
+
+            for k, (duracion, esquema) in enumerate(self.ventanas):
+                inicio = ts_ms - ts_ms % duracion
+                v = d.ventanas[k]
+                if d.piso is not None and inicio <= d.piso[k]:
+                    self.tardias += 1
+                    continue
+                if v is None or inicio > v.inicio_ms:
+                    if v is not None and not v.emitida:
+                        cerradas.append((esquema, device_id, v))
+                    v = d.ventanas[k] = _Ventana(inicio)
+                elif inicio < v.inicio_ms:
+                    # Anterior a la última ventana conocida: ya no se puede corregir
+                    self.tardias += 1
+                    continue
+                elif v.emitida:
+                    v.emitida = False
+                    self.reemitidos += 1
+
+                v.n += 1
+                v.luz_suma += luz
+                if luz < v.luz_min:
+                    v.luz_min = luz
+                if luz > v.luz_max:
+                    v.luz_max = luz
+                s = v.ldr_suma
+                s[0] += ldr_tl
+                s[1] += ldr_tr
+                s[2] += ldr_bl
+                s[3] += ldr_br
+                if voltaje is not None:
+                    v.v_suma += voltaje
+                    v.v_n += 1
+                    if voltaje > v.v_max:
+                        v.v_max = voltaje
+                if dt:
+                    if v_ant is not None:
+                        v.volt_s += v_ant * dt
+                        if self.carga_ohm:
+                            v.energia_j += v_ant * v_ant / self.carga_ohm * dt
+                    if i_estado is not None:
+                        v.t_estado[i_estado] += dt
+                if anomalia:
+                    v.anomalias += 1
+                if drift:
+                    v.drifts += 1
+                v.recorrido_h += delta_h
+                v.recorrido_v += delta_v
+
+            if d.ts_ms is None or ts_ms >= d.ts_ms:
+                d.ts_ms = ts_ms
+                d.estado = estado
+                d.voltaje = voltaje
+                d.servo_h = servo_h
+                d.servo_v = servo_v
+            self.lecturas += 1
+
+            if ahora_ms - self._ultima_purga_ms >= self.gracia_ms:
+                self._vencidas(ahora_ms, cerradas)
+
+        self._emitir(cerradas)
+
+    def _vencidas(self, ahora_ms, cerradas):
+        """
+        Marca para emitir las ventanas terminadas hace más de `gracia_s` y olvida
+        los dispositivos sin lecturas desde la ventana más larga. Con self._lock tomado.
+        """
+        mas_larga = max(duracion for duracion, _ in self.ventanas)
+        olvidar = []
+        for device_id, d in self._dispositivos.items():
+            for k, (duracion, esquema) in enumerate(self.ventanas):
+                v = d.ventanas[k]
+                if v is not None and not v.emitida and v.inicio_ms + duracion + self.gracia_ms <= ahora_ms:
+                    cerradas.append((esquema, device_id, v))
+            if d.ts_ms is not None and ahora_ms - d.ts_ms > mas_larga + self.gracia_ms:
+                olvidar.append(device_id)
+        for device_id in olvidar:
+            d = self._dispositivos.pop(device_id)
+            self._olvidados[device_id] = tuple(
+                v.inicio_ms if v is not None else (d.piso[k] if d.piso else -1)
+                for k, v in enumerate(d.ventanas))
+        while len(self._olvidados) > self.MAX_OLVIDADOS:
+            del self._olvidados[next(iter(self._olvidados))]
+        self._ultima_purga_ms = ahora_ms
+
+    def _emitir(self, cerradas):
+        if not cerradas:
+            return
+        con_energia = self.carga_ohm is not None
+        lineas = []
+        with self._lock:
+            # Los valores se leen bajo el lock: otra lectura podría reabrir la ventana
+            puntos = [(esquema, device_id, v.valores(con_energia), v.inicio_ms)
+                      for esquema, device_id, v in cerradas]
+            for _, _, v in cerradas:
+                v.emitida = True
+        for esquema, device_id, valores, inicio_ms in puntos:
+            lineas.append(esquema.codificar((device_id,), valores, inicio_ms))
+        self.puntos += len(lineas)
+        self.emitir(lineas)
+
+    def cerrar_vencidas(self, ahora_ms=None):
+        """Emite las ventanas vencidas aunque no lleguen lecturas (mantenimiento periódico del servidor)"""
+        cerradas = []
+        with self._lock:
+            self._vencidas(int(time.time() * 1000) if ahora_ms is None else ahora_ms, cerradas)
+        self._emitir(cerradas)
+
+    def cerrar_todo(self):
+        """Emite todas las ventanas abiertas (parada del servidor)"""
+        cerradas = []
+        with self._lock:
+            for device_id, d in self._dispositivos.items():
+                for k, (_, esquema) in enumerate(self.ventanas):
+                    v = d.ventanas[k]
+                    if v is not None and not v.emitida:
+                        cerradas.append((esquema, device_id, v))
+        self._emitir(cerradas)
+
+    def __len__(self):
+        return len(self._dispositivos)
+
+    def get_stats(self):
+        """Retorna métricas del agregador"""
+        return {
+            'rollup_devices': len(self._dispositivos),
+            'rollup_readings': self.lecturas,
+            'rollup_points': self.puntos,
+            'rollup_reemitted': self.reemitidos,
+            'rollup_late_dropped': self.tardias,
+            'rollup_windows_s': [duracion // 1000 for duracion, _ in self.ventanas]
+        }
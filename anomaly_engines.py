@@ -0,0 +1,133 @@
+"""
+Motores de detección de anomalías para RiverAnalyzer.
+
+Todos siguen la interfaz de River (score_one / learn_one, puntuación 0..1)
+para que detectar_anomalias no cambie y los snapshots antiguos, que guardan
+un HalfSpaceTrees tal cual, sigan cargando. River solo se importa al crear
+un detector HalfSpaceTrees, de modo que el servidor puede validar la
+configuración sin pagar su importación (LAZY_INIT):
+
+    - "hst": HalfSpaceTrees completo, puntúa y aprende cada muestra (por defecto)
+    - "hst_subsample": HalfSpaceTrees que puntúa cada muestra pero solo aprende
+      una de cada `aprender_cada`; la ventana cubre proporcionalmente más tiempo
+    - "zscore": z-score incremental con media y varianza exponenciales sobre las
+      mismas cuatro características; O(4) por muestra y sin árboles
+
+HalfSpaceTrees de River no tiene score_many/learn_many vectorizados, así que
+agrupar las muestras en mini-lotes solo desplazaría el coste; el ahorro real
+viene de aprender menos o de un detector más ligero.
+"""
+
+import math
+
+
+MOTORES = ("hst", "hst_subsample", "zscore")
+
+
+class HSTSubmuestreo:
+    """
+    HalfSpaceTrees que aprende solo una de cada `aprender_cada` muestras.
+
+    score_one es el de HalfSpaceTrees; learn_one descarta las demás muestras
+    antes de recorrer los árboles, que es la mitad del coste por muestra.
+    """
+
+    def __init__(self, n_trees=10, height=8, window_size=250, limits=None, seed=None, aprender_cada=4):
+        from river import anomaly
+
+        self.hst = anomaly.HalfSpaceTrees(n_trees=n_trees, height=height, window_size=window_size,
+                                          limits=limits, seed=seed)
+        self.aprender_cada = max(1, int(aprender_cada))
+        self._vistas = 0
+
+    def score_one(self, x):
+        return self.hst.score_one(x)
+
+    def learn_one(self, x):
+        self._vistas += 1
+        if self._vistas >= self.aprender_cada:
+            self._vistas = 0
+            self.hst.learn_one(x)
+
+
+class ZScoreEWM:
+    """
+    Detector por z-score con media y varianza móviles exponenciales.
+
+    La puntuación es max(|x - media| / desviación) sobre las características,
+    dividida por `z_max` y acotada a 1: con z_max=4 y el umbral por defecto
+    (0.7) se marca anomalía a partir de 2.8 desviaciones. `std_min` evita que
+    una característica casi constante (un servo parado) dispare con cualquier
+    movimiento.
+
+    Args:
+        ventana: muestras equivalentes de la media exponencial (alpha = 2 / (ventana + 1))
+        z_max: z-score que corresponde a puntuación 1
+        std_min: desviación mínima por característica, en sus unidades
+        calentamiento: muestras antes de puntuar (devuelve 0 mientras tanto)
+    """
+
+    def __init__(self, ventana=250, z_max=4.0, std_min=1.0, calentamiento=30):
+        self.ventana = ventana
+        self.z_max = z_max
+        self.std_min = std_min
+        self.calentamiento = calentamiento
+        self._alpha = 2.0 / (ventana + 1)
+        self._media = {}
+        self._var = {}
+        self.n = 0
+
+    def learn_one(self, x):
+        a = self._alpha
+        media = self._media
+        var = self._var
+        for k, v in x.items():
+            m = media.get(k)
+            if m is None:
+                media[k] = v
+                var[k] = 0.0
+                continue
+            d = v - m
+            incremento = a * d
+            media[k] = m + incremento
+            # Varianza exponencial (West, 1979)
+            var[k] = (1.0 - a) * (var[k] + d * incremento)
+        self.n += 1
+
+    def score_one(self, x):
+        if self.n < self.calentamiento:
+            return 0.0
+        media = self._media
+        var = self._var
+        std_min = self.std_min
+        z = 0.0
+        for k, v in x.items():
+            m = media.get(k)
+            if m is None:
+                continue
+            s = math.sqrt(var[k])
+            zk = abs(v - m) / (s if s > std_min else std_min)
+            if zk > z:
+                z = zk
+        return min(1.0, z / self.z_max)
+
+
+def crear_detector(motor="hst", hst_n_trees=10, hst_height=8, hst_window=250,
+                   hst_learn_every=4, zscore_max=4.0):
+    """
+    Construye el detector de anomalías de un motor.
+
+    Raises:
+        ValueError: si el motor no está en MOTORES
+    """
+    if motor == "hst":
+        from river import anomaly
+
+        return anomaly.HalfSpaceTrees(n_trees=hst_n_trees, height=hst_height,
+                                      window_size=hst_window, seed=42)
+    if motor == "hst_subsample":
+        return HSTSubmuestreo(n_trees=hst_n_trees, height=hst_height, window_size=hst_window,
+                              seed=42, aprender_cada=hst_learn_every)
+    if motor == "zscore":
+        return ZScoreEWM(ventana=hst_window, z_max=zscore_max)
+    raise ValueError(f"motor de anomalías desconocido: {motor!r} (opciones: {', '.join(MOTORES)})")
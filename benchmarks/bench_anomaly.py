@@ -0,0 +1,173 @@
+"""
+Benchmark de los motores de anomalías (anomaly_engines.py).
+
+Pasa el mismo flujo de las cuatro características de detectar_anomalias
+(avg_light, light_variance, servo_h, servo_v) por cada motor, con un
+detector por dispositivo como en el servidor, y compara con el
+HalfSpaceTrees actual ("hst"):
+
+    - µs por muestra (score_one + learn_one) y aceleración frente a hst
+    - alertas y precisión/recall/F1 tomando las alertas de hst como referencia
+    - con datos sintéticos, además precisión/recall frente a los fallos inyectados
+      (LDR muerto, sombra parcial, salto de servo)
+
+Uso:
+    python benchmarks/bench_anomaly.py                       # flujo sintético
+    python benchmarks/bench_anomaly.py --captura captura.jsonl.gz
+    python benchmarks/bench_anomaly.py --motores hst,zscore --umbral 0.8
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from anomaly_engines import MOTORES, crear_detector
+from features import caracteristicas_muestra
+
+
+def _muestra(device_id, ldr, servo_h, servo_v):
+    car = caracteristicas_muestra(*ldr, servo_h, servo_v, ts=0)
+    return device_id, {
+        'avg_light': car['avg_light'],
+        'light_variance': car['light_variance'],
+        'servo_h': float(servo_h),
+        'servo_v': float(servo_v)
+    }
+
+
+def flujo_sintetico(muestras, dispositivos, tasa_fallos, semilla=11):
+    """
+    Lista de (device_id, x, es_fallo): un día solar por dispositivo con ruido,
+    nubes lentas y fallos puntuales inyectados.
+    """
+    rng = random.Random(semilla)
+    por_dispositivo = muestras // dispositivos
+    series = []
+    for d in range(dispositivos):
+        device_id = f"tracker_{d}"
+        serie = []
+        servo_h, servo_v = 90, 120
+        nube = 1.0
+        for i in range(por_dispositivo):
+            fase = i / por_dispositivo
+            sol = max(0.0, math.sin(math.pi * fase))
+            nube = min(1.0, max(0.3, nube + rng.gauss(0, 0.01)))
+            base = 150 + 3500 * sol * nube
+            ldr = [max(0, int(base * (1 + rng.gauss(0, 0.03)))) for _ in range(4)]
+            servo_h = int(30 + 120 * fase)
+            servo_v = int(120 + 30 * sol)
+
+            fallo = rng.random() < tasa_fallos
+            if fallo:
+                tipo = rng.randrange(3)
+                if tipo == 0:
+                    ldr[rng.randrange(4)] = 0                      # LDR muerto
+                elif tipo == 1:
+                    ldr[0] = ldr[1] = int(ldr[0] * 0.15)           # sombra parcial
+                else:
+                    servo_h = min(180, servo_h + 60)               # salto de servo
+            serie.append(_muestra(device_id, ldr, servo_h, servo_v) + (fallo,))
+        series.append(serie)
+    # Intercalar dispositivos como llegarían al servidor, cada uno en su orden
+    return [m for paso in zip(*series) for m in paso]
+
+
+def flujo_captura(path, limite):
+    from replay import leer_capturas
+
+    flujo = []
+    for ts_ms, data in leer_capturas(path):
+        if limite is not None and len(flujo) >= limite:
+            break
+        ldr = [int(data.get(k, 0)) for k in ("ldr_tl", "ldr_tr", "ldr_bl", "ldr_br")]
+        flujo.append(_muestra(data.get("device_id", "unknown"), ldr,
+                              int(data.get("servo_h", 0)), int(data.get("servo_v", 0))) + (None,))
+    return flujo
+
+
+def ejecutar(motor, flujo, umbral, kwargs):
+    detectores = {}
+    alertas = []
+    reloj = time.perf_counter
+    total = 0.0
+    for device_id, x, _ in flujo:
+        det = detectores.get(device_id)
+        if det is None:
+            det = detectores[device_id] = crear_detector(motor, **kwargs)
+        t0 = reloj()
+        score = det.score_one(x)
+        det.learn_one(x)
+        total += reloj() - t0
+        alertas.append(score > umbral)
+    return total / len(flujo), alertas
+
+
+def _prf(pred, ref):
+    vp = sum(1 for p, r in zip(pred, ref) if p and r)
+    n_pred = sum(pred)
+    n_ref = sum(ref)
+    precision = vp / n_pred if n_pred else None
+    recall = vp / n_ref if n_ref else None
+    f1 = (2 * precision * recall / (precision + recall)
+          if precision is not None and recall is not None and precision + recall > 0 else None)
+    return precision, recall, f1
+
+
+def _fmt(v):
+    return f"{v:.3f}" if v is not None else "-"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de los motores de anomalías")
+    parser.add_argument("--captura", help="JSONL de /sensor_values (como replay.py); sin ella, flujo sintético")
+    parser.add_argument("--limite", type=int, default=None, help="muestras máximas de la captura")
+    parser.add_argument("--muestras", type=int, default=20000)
+    parser.add_argument("--dispositivos", type=int, default=4)
+    parser.add_argument("--tasa-fallos", type=float, default=0.01)
+    parser.add_argument("--motores", default=",".join(MOTORES))
+    parser.add_argument("--umbral", type=float, default=0.7)
+    parser.add_argument("--hst-learn-every", type=int, default=4)
+    parser.add_argument("--zscore-max", type=float, default=4.0)
+    args = parser.parse_args(argv)
+
+    if args.captura:
+        flujo = flujo_captura(args.captura, args.limite)
+    else:
+        flujo = flujo_sintetico(args.muestras, args.dispositivos, args.tasa_fallos)
+    if not flujo:
+        print("sin muestras")
+        return 1
+
+    kwargs = {'hst_learn_every': args.hst_learn_every, 'zscore_max': args.zscore_max}
+    motores = [m.strip() for m in args.motores.split(",") if m.strip()]
+    if "hst" not in motores:
+        motores.insert(0, "hst")
+    resultados = {m: ejecutar(m, flujo, args.umbral, kwargs) for m in motores}
+    t_ref, alertas_ref = resultados["hst"]
+    fallos = [f for _, _, f in flujo] if flujo[0][2] is not None else None
+
+    print(f"{len(flujo)} muestras, umbral {args.umbral}"
+          + (f", {sum(fallos)} fallos inyectados" if fallos else ""))
+    cabecera = f"{'motor':<14} {'us/muestra':>10} {'x hst':>6} {'alertas':>8} {'P(hst)':>7} {'R(hst)':>7} {'F1(hst)':>7}"
+    if fallos:
+        cabecera += f" {'P(fallos)':>9} {'R(fallos)':>9}"
+    print(cabecera)
+    for motor in motores:
+        t, alertas = resultados[motor]
+        p, r, f1 = _prf(alertas, alertas_ref)
+        linea = (f"{motor:<14} {t * 1e6:>10.1f} {t_ref / t:>6.1f} {sum(alertas):>8} "
+                 f"{_fmt(p):>7} {_fmt(r):>7} {_fmt(f1):>7}")
+        if fallos:
+            pf, rf, _ = _prf(alertas, fallos)
+            linea += f" {_fmt(pf):>9} {_fmt(rf):>9}"
+        print(linea)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""
+Benchmark en lazo cerrado del avance solar (ephemeris.AvanceSolar).
+
+Las capturas de replay.py son lazo abierto: las posiciones grabadas no
+dependen de los comandos, así que no sirven para medir convergencia. Aquí
+cada tracker virtual repite el bucle de Flask/Flask.ino contra el mismo
+código del servidor (DevicePIDController, AvanceSolar y SamplingScheduler):
+
+    - LDR según el ángulo entre panel y sol (con nubes y ruido)
+    - el servo va al comando recibido; el siguiente envío llega tras el
+      intervalo indicado por el planificador (o HTTP_SEND_INTERVAL al vencer)
+    - cada día arranca en la posición por defecto del PID (120/150)
+
+Compara solo PID, PID + avance con el montaje bien configurado y con un
+montaje desviado (que el avance tiene que aprender), e informa por
+dispositivo y día: peticiones, fracción en modo rápido por seguimiento,
+muestras y segundos hasta converger tras el arranque y tras cada nube, y
+error medio de apuntado.
+
+Uso:
+    python benchmarks/bench_feedforward.py
+    python benchmarks/bench_feedforward.py --dispositivos 8 --dias 3 --lat -33.9 --lon 18.4
+"""
+
+import argparse
+import datetime
+import math
+import os
+import random
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ephemeris import AvanceSolar, Montaje, TablaSolar
+from pid_controller import DevicePIDController
+from sampling import SamplingScheduler, error_seguimiento
+
+
+HTTP_SEND_INTERVAL_MS = 500     # Flask.ino
+CONVERGIDO_DEG = 3
+
+
+class Planta:
+    """Panel con montaje `montaje` bajo el sol de su sitio: LDR a partir del error de apuntado"""
+
+    def __init__(self, montaje, tabla, rng):
+        self.montaje = montaje
+        self.tabla = tabla
+        self.rng = rng
+
+    def objetivo(self, ts):
+        """Posición de servos (limitada) que mira al sol, y elevación del sol"""
+        az, el = self.tabla.posicion(self.montaje.lat, self.montaje.lon, ts)
+        h, v = self.montaje.servos(az, el)
+        min_h, max_h, min_v, max_v = self.montaje.limites
+        return max(min_h, min(max_h, h)), max(min_v, min(max_v, v)), az, el
+
+    def desalineacion(self, ts, servo_h, servo_v):
+        """Error angular de apuntado por eje (grados) y elevación del sol"""
+        m = self.montaje
+        az, el = self.tabla.posicion(m.lat, m.lon, ts)
+        panel_az = m.acimut_centro + (servo_h - m.h_centro) / m.escala_h
+        panel_el = (servo_v - m.v_horizonte) / m.escala_v
+        # Izquierda/arriba más iluminadas si el sol está hacia ese lado
+        dh = ((az - panel_az + 180.0) % 360.0 - 180.0) * math.cos(math.radians(el))
+        return dh, el - panel_el, el
+
+    def ldr(self, ts, servo_h, servo_v, nube):
+        dh, dv, el = self.desalineacion(ts, servo_h, servo_v)
+        directa = 3500.0 * max(0.0, math.sin(math.radians(el)))
+        base = 150.0 + directa * (0.25 + 0.75 * nube)
+        kh = 0.6 * nube * math.tanh(dh / 40.0)
+        kv = 0.6 * nube * math.tanh(dv / 40.0)
+        ruido = self.rng.gauss
+        return [max(0, min(4095, int(base * (1 + (sh * kh + sv * kv) / 2) * (1 + ruido(0, 0.01)))))
+                for sh, sv in ((1, 1), (-1, 1), (1, -1), (-1, -1))]
+
+
+def nubes(rng, inicio, fin, por_dia):
+    """Episodios (desde, hasta) de nube densa de 5 a 30 minutos"""
+    episodios = []
+    for _ in range(por_dia):
+        desde = rng.uniform(inicio, fin)
+        episodios.append((desde, desde + rng.uniform(300, 1800)))
+    return sorted(episodios)
+
+
+def simular_dia(device_id, dia_ts, planta, avance, rng, nubes_por_dia):
+    """Un día de un tracker; devuelve métricas"""
+    pid = DevicePIDController(device_id)
+    planificador = SamplingScheduler(budget_rps=1e9)
+
+    # Desde que el sol pasa de 5° hasta que baja de 5°
+    inicio = fin = None
+    for minuto in range(0, 1440, 5):
+        ts = dia_ts + minuto * 60
+        el = planta.tabla.posicion(planta.montaje.lat, planta.montaje.lon, ts)[1]
+        if el >= 5 and inicio is None:
+            inicio = ts
+        if el >= 5:
+            fin = ts
+    episodios = nubes(rng, inicio, fin, nubes_por_dia)
+
+    servo_h, servo_v = pid.lastPosH, pid.lastPosV
+    t = inicio
+    intervalo_ms, rapido_hasta = HTTP_SEND_INTERVAL_MS, t
+    peticiones = seguimiento = 0
+    errores = []
+    # Convergencia tras el arranque y tras cada nube: (inicio, muestras, convergido_en)
+    pendiente = [t, 0]
+    convergencias = []
+    en_nube_prev = False
+
+    while t < fin:
+        nube_activa = any(desde <= t < hasta for desde, hasta in episodios)
+        nube = 0.1 if nube_activa else 1.0
+        if en_nube_prev and not nube_activa and pendiente is None:
+            pendiente = [t, 0]
+        en_nube_prev = nube_activa
+
+        tl, tr, bl, br = planta.ldr(t, servo_h, servo_v, nube)
+        nuevo_h, nuevo_v, debug = pid.calcular_angulos(tl, tr, bl, br, servo_h, servo_v,
+                                                       servo_h in (pid.limiteMinH, pid.limiteMaxH),
+                                                       servo_v in (pid.limiteMinV, pid.limiteMaxV))
+        luz = (tl + tr + bl + br) / 4.0
+        if avance is not None:
+            nuevo_h, nuevo_v, _ = avance.ajustar(device_id, int(t * 1000), servo_h, servo_v, nuevo_h, nuevo_v,
+                                                 debug['diffH'], debug['diffV'], luz)
+        hora = datetime.datetime.fromtimestamp(t + planta.montaje.lon / 15 * 3600, datetime.timezone.utc).hour
+        fast = planificador.siguiente(
+            device_id, error_pid=error_seguimiento(debug),
+            en_movimiento=max(abs(nuevo_h - servo_h), abs(nuevo_v - servo_v)) >= 2,
+            estado="CLOUDY" if nube_activa else "SUNNY", luz_media=luz, hora=hora, ahora=t)
+        peticiones += 1
+        if fast['reason'] == 'tracking':
+            seguimiento += 1
+        servo_h, servo_v = nuevo_h, nuevo_v
+
+        obj_h, obj_v, _, _ = planta.objetivo(t)
+        error = max(abs(servo_h - obj_h), abs(servo_v - obj_v))
+        if not nube_activa:
+            errores.append(error)
+            if pendiente is not None:
+                pendiente[1] += 1
+                if error <= CONVERGIDO_DEG:
+                    convergencias.append((pendiente[1], t - pendiente[0]))
+                    pendiente = None
+
+        # Firmware: intervalo indicado durante fast_duration_ms, luego HTTP_SEND_INTERVAL
+        if t >= rapido_hasta:
+            intervalo_ms = HTTP_SEND_INTERVAL_MS
+        if 200 <= fast['fast_interval_ms'] <= 60000:
+            intervalo_ms = fast['fast_interval_ms']
+            rapido_hasta = t + fast['fast_duration_ms'] / 1000.0
+        t += intervalo_ms / 1000.0
+
+    return {
+        'peticiones': peticiones,
+        'seguimiento': seguimiento,
+        'convergencias': convergencias,
+        'error_medio': statistics.fmean(errores) if errores else float('nan'),
+        'alineado': sum(1 for e in errores if e <= CONVERGIDO_DEG) / len(errores) if errores else float('nan')
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Avance solar frente a solo PID, en lazo cerrado")
+    parser.add_argument("--dispositivos", type=int, default=2)
+    parser.add_argument("--dias", type=int, default=1)
+    parser.add_argument("--fecha", default="2024-06-21", help="primer día (UTC)")
+    parser.add_argument("--lat", type=float, default=40.4)
+    parser.add_argument("--lon", type=float, default=-3.7)
+    parser.add_argument("--nubes", type=int, default=4, help="episodios de nube densa por día")
+    parser.add_argument("--semilla", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    tabla = TablaSolar()
+    real = Montaje(args.lat, args.lon)
+    # Montaje configurado con 10° de acimut y 6° de inclinación de error
+    desviado = Montaje(args.lat, args.lon, acimut_centro=real.acimut_centro + 10, v_horizonte=real.v_horizonte - 6)
+    escenarios = {
+        'pid': None,
+        'pid+avance': lambda: AvanceSolar(lambda _: real, tabla=tabla),
+        'pid+avance desviado': lambda: AvanceSolar(lambda _: desviado, tabla=tabla),
+    }
+    primer_dia = int(datetime.datetime.fromisoformat(args.fecha).replace(tzinfo=datetime.timezone.utc).timestamp())
+
+    print(f"{args.dispositivos} dispositivos x {args.dias} días en ({args.lat}, {args.lon}), "
+          f"{args.nubes} nubes/día, convergido = error <= {CONVERGIDO_DEG}°")
+    print(f"{'escenario':<20} {'pet/día':>8} {'rápido %':>9} {'conv muestras':>13} {'conv s':>7} "
+          f"{'p90 muestras':>12} {'error °':>8} {'alineado %':>10}")
+    for nombre, crear in escenarios.items():
+        peticiones = seguimiento = 0
+        muestras, segundos, errores, alineado = [], [], [], []
+        for d in range(args.dispositivos):
+            # Misma semilla por dispositivo en todos los escenarios: mismas nubes y ruido
+            rng = random.Random(args.semilla * 1000 + d)
+            avance = crear() if crear else None
+            for dia in range(args.dias):
+                r = simular_dia(f"tracker_{d}", primer_dia + dia * 86400, Planta(real, tabla, rng),
+                                avance, rng, args.nubes)
+                peticiones += r['peticiones']
+                seguimiento += r['seguimiento']
+                muestras += [m for m, _ in r['convergencias']]
+                segundos += [s for _, s in r['convergencias']]
+                errores.append(r['error_medio'])
+                alineado.append(r['alineado'])
+        dias = args.dispositivos * args.dias
+        p90 = sorted(muestras)[int(0.9 * (len(muestras) - 1))] if muestras else float('nan')
+        print(f"{nombre:<20} {peticiones / dias:>8.0f} {seguimiento / peticiones * 100:>9.1f} "
+              f"{statistics.fmean(muestras) if muestras else float('nan'):>13.1f} "
+              f"{statistics.fmean(segundos) if segundos else float('nan'):>7.1f} {p90:>12} "
+              f"{statistics.fmean(errores):>8.2f} {statistics.fmean(alineado) * 100:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
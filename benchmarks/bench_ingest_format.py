@@ -0,0 +1,125 @@
+"""
+Benchmark de los formatos de ingesta de /sensor_values: JSON frente al
+binario compacto (binary_format.py), y MessagePack/CBOR si están instalados
+(msgpack, cbor2) como referencia.
+
+Para cada formato informa:
+
+    - bytes por lectura en el cable, sin y con BME280
+    - µs por lectura para decodificar el cuerpo, y para decodificar y
+      normalizar (normalizar_lectura, la validación común que reciben el
+      PID y River), tanto lectura a lectura como en lotes
+
+Uso:
+    python benchmarks/bench_ingest_format.py
+    python benchmarks/bench_ingest_format.py --muestras 50000 --lote 100
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import binary_format
+
+
+def lecturas_sinteticas(n, con_bme, semilla=7):
+    rng = random.Random(semilla)
+    lecturas = []
+    for i in range(n):
+        lectura = {
+            "device_id": f"tracker_{i % 8:02d}",
+            "ldr_tl": rng.randrange(4096), "ldr_tr": rng.randrange(4096),
+            "ldr_bl": rng.randrange(4096), "ldr_br": rng.randrange(4096),
+            "servo_h": rng.randrange(181), "servo_v": rng.randrange(181),
+            "at_limit_h": False, "at_limit_v": rng.random() < 0.05,
+            # float32 en el ESP32: ArduinoJson lo serializa con ~7 cifras
+            "panel_voltage": round(rng.uniform(0.0, 6.5), 6)
+        }
+        if con_bme:
+            lectura.update(bme_temp_c=round(rng.uniform(5, 45), 6), bme_press_hpa=round(rng.uniform(950, 1050), 6),
+                           bme_hum_pct=round(rng.uniform(10, 95), 6), bme_alt_m=round(rng.uniform(0, 2500), 6))
+        lecturas.append(lectura)
+    return lecturas
+
+
+def formatos():
+    """{nombre: (codificar lectura, codificar lote, decodificar lectura, decodificar lote)}"""
+    def json_uno(l):
+        return json.dumps(l, separators=(",", ":")).encode()
+
+    def json_lote(ls):
+        return json.dumps(ls, separators=(",", ":")).encode()
+
+    resultado = {
+        "json": (json_uno, json_lote, json.loads, json.loads),
+        "binario": (binary_format.codificar_lectura,
+                    lambda ls: b"".join(binary_format.codificar_lectura(l) for l in ls),
+                    lambda b: binary_format.decodificar(b)[0], binary_format.decodificar),
+    }
+    try:
+        import msgpack
+        resultado["msgpack"] = (msgpack.packb, msgpack.packb, msgpack.unpackb, msgpack.unpackb)
+    except ImportError:
+        pass
+    try:
+        import cbor2
+        resultado["cbor"] = (cbor2.dumps, cbor2.dumps, cbor2.loads, cbor2.loads)
+    except ImportError:
+        pass
+    return resultado
+
+
+def medir(funcion, cuerpos, repeticiones):
+    reloj = time.perf_counter
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        t0 = reloj()
+        for cuerpo in cuerpos:
+            funcion(cuerpo)
+        mejor = min(mejor, reloj() - t0)
+    return mejor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bytes y coste de decodificación por formato de ingesta")
+    parser.add_argument("--muestras", type=int, default=20000)
+    parser.add_argument("--lote", type=int, default=50, help="lecturas por cuerpo de /sensor_values/batch")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    # Solo se usa normalizar_lectura: sin River, snapshots ni spool al importar
+    for clave, valor in (("LAZY_INIT", "1"), ("WARMUP", "0"), ("SNAPSHOTS_ENABLED", "0"), ("SPOOL_ENABLED", "0")):
+        os.environ.setdefault(clave, valor)
+    from servidor_flask import normalizar_lectura
+
+    print(f"{args.muestras} lecturas, lotes de {args.lote}, mejor de {args.repeticiones}")
+    print(f"{'formato':<10} {'BME':>4} {'B/lect':>7} {'B/lect lote':>11} "
+          f"{'us decod':>9} {'us +norm':>9} {'us lote':>8} {'us lote+norm':>12}")
+    for con_bme in (False, True):
+        lecturas = lecturas_sinteticas(args.muestras, con_bme)
+        lotes = [lecturas[i:i + args.lote] for i in range(0, len(lecturas), args.lote)]
+        for nombre, (cod_uno, cod_lote, dec_uno, dec_lote) in formatos().items():
+            unos = [cod_uno(l) for l in lecturas]
+            cuerpos_lote = [cod_lote(ls) for ls in lotes]
+            b_uno = sum(map(len, unos)) / len(unos)
+            b_lote = sum(map(len, cuerpos_lote)) / len(lecturas)
+
+            t_dec = medir(dec_uno, unos, args.repeticiones)
+            t_norm = medir(lambda b: normalizar_lectura(dec_uno(b)), unos, args.repeticiones)
+            t_lote = medir(dec_lote, cuerpos_lote, args.repeticiones)
+            t_lote_norm = medir(lambda b: [normalizar_lectura(l) for l in dec_lote(b)],
+                                cuerpos_lote, args.repeticiones)
+            n = len(lecturas)
+            print(f"{nombre:<10} {'sí' if con_bme else 'no':>4} {b_uno:>7.1f} {b_lote:>11.1f} "
+                  f"{t_dec / n * 1e6:>9.2f} {t_norm / n * 1e6:>9.2f} "
+                  f"{t_lote / n * 1e6:>8.2f} {t_lote_norm / n * 1e6:>12.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Benchmark del codificador de line protocol.
+
+Compara, por punto de la medición `tracker`:
+    - fstrings: construcción anterior (~30 f-strings + join, sin escapado)
+    - esquema:  line_protocol.TRACKER (plantilla precompilada)
+    - omitir:   line_protocol.OmitirSinCambios sobre el mismo esquema
+y el cuerpo completo de un lote con Esquema.codificar_lote.
+
+Uso:
+    python benchmarks/bench_line_protocol.py --puntos 20000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import line_protocol
+
+
+def _lectura(rng, i):
+    """Valores de un punto tracker con los campos opcionales habituales"""
+    ldr = [rng.randint(0, 4095) for _ in range(4)]
+    return {
+        'device_id': f"tracker_{i % 8}",
+        'servo_h': 120, 'servo_v': 150,
+        'ldr': ldr,
+        'car': {
+            'ldr_arriba': (ldr[0] + ldr[1]) / 2.0, 'ldr_abajo': (ldr[2] + ldr[3]) / 2.0,
+            'ldr_izquierda': (ldr[0] + ldr[2]) / 2.0, 'ldr_derecha': (ldr[1] + ldr[3]) / 2.0,
+            'norm_tl': ldr[0] / 40.95, 'norm_tr': ldr[1] / 40.95,
+            'norm_bl': ldr[2] / 40.95, 'norm_br': ldr[3] / 40.95,
+        },
+        'at_limit_h': False, 'at_limit_v': i % 50 == 0,
+        'cmd_h': 121, 'cmd_v': 149,
+        'bme': (24.5, 1009.3, 45.0 + (i % 10) / 10.0, None),
+        'panel_voltage': 3.0 + rng.random(),
+        'amb': {'state': 'SUNNY', 'confidence': 0.9, 'rel_light_change': rng.random() / 10, 'state_id': 0},
+        'efic': {'voltage_predicted': 3.2, 'error': 0.05, 'status': 'OK'},
+        'anom': {'score': rng.random(), 'is_anomaly': False},
+        'drift': False,
+        'ts_ms': 1700000000000 + i * 1000,
+    }
+
+
+def fstrings(p):
+    """Construcción por f-strings previa al codificador (referencia)"""
+    car = p['car']
+    ldr_tl, ldr_tr, ldr_bl, ldr_br = p['ldr']
+    bme_temp_c, bme_press_hpa, bme_hum_pct, bme_alt_m = p['bme']
+    fields = [
+        f"servo_h={p['servo_h']}", f"servo_v={p['servo_v']}",
+        f"ldr_tl={ldr_tl}", f"ldr_tr={ldr_tr}",
+        f"ldr_bl={ldr_bl}", f"ldr_br={ldr_br}",
+        f"ldr_arriba={car['ldr_arriba']:.1f}", f"ldr_abajo={car['ldr_abajo']:.1f}",
+        f"ldr_izquierda={car['ldr_izquierda']:.1f}", f"ldr_derecha={car['ldr_derecha']:.1f}",
+        f"ldr_norm_tl={car['norm_tl']:.1f}", f"ldr_norm_tr={car['norm_tr']:.1f}",
+        f"ldr_norm_bl={car['norm_bl']:.1f}", f"ldr_norm_br={car['norm_br']:.1f}",
+        f"limit_hit_h={'1' if p['at_limit_h'] else '0'}", f"limit_hit_v={'1' if p['at_limit_v'] else '0'}",
+        f"cmd_h={p['cmd_h']}", f"cmd_v={p['cmd_v']}"
+    ]
+    if bme_temp_c is not None:
+        fields.append(f"bme_temp_c={float(bme_temp_c):.2f}")
+    if bme_press_hpa is not None:
+        fields.append(f"bme_press_hpa={float(bme_press_hpa):.2f}")
+    if bme_hum_pct is not None:
+        fields.append(f"bme_hum_pct={float(bme_hum_pct):.2f}")
+    if bme_alt_m is not None:
+        fields.append(f"bme_alt_m={float(bme_alt_m):.2f}")
+    fields.append(f"panel_voltage={p['panel_voltage']:.4f}")
+    amb = p['amb']
+    fields.append(f"env_state=\"{amb.get('state','NA')}\"")
+    fields.append(f"env_confidence={float(amb.get('confidence',0.0)):.2f}")
+    fields.append(f"env_rel_light_change={float(amb.get('rel_light_change',0.0)):.4f}")
+    fields.append(f"env_state_id={int(amb.get('state_id', -1))}")
+    efic = p['efic']
+    fields.append(f"voltage_predicted={efic['voltage_predicted']:.4f}")
+    fields.append(f"voltage_error={efic['error']:.4f}")
+    fields.append(f"efficiency_ok={'1' if efic['status'] == 'OK' else '0'}")
+    fields.append(f"anomaly_score={p['anom']['score']:.4f}")
+    fields.append(f"is_anomaly={'1' if p['anom']['is_anomaly'] else '0'}")
+    fields.append(f"drift_detected={'1' if p['drift'] else '0'}")
+    fieldset = ",".join(fields)
+    return f"tracker,device={p['device_id']} {fieldset} {p['ts_ms']}"
+
+
+def _valores(p):
+    """Tupla en el orden de TRACKER, igual que la arma servidor_flask"""
+    car, amb, efic = p['car'], p['amb'], p['efic']
+    bme_temp_c, bme_press_hpa, bme_hum_pct, bme_alt_m = p['bme']
+    return (
+        p['servo_h'], p['servo_v'], *p['ldr'],
+        car['ldr_arriba'], car['ldr_abajo'], car['ldr_izquierda'], car['ldr_derecha'],
+        car['norm_tl'], car['norm_tr'], car['norm_bl'], car['norm_br'],
+        1 if p['at_limit_h'] else 0, 1 if p['at_limit_v'] else 0,
+        p['cmd_h'], p['cmd_v'],
+        float(bme_temp_c) if bme_temp_c is not None else None,
+        float(bme_press_hpa) if bme_press_hpa is not None else None,
+        float(bme_hum_pct) if bme_hum_pct is not None else None,
+        float(bme_alt_m) if bme_alt_m is not None else None,
+        p['panel_voltage'],
+        amb.get('state', 'NA'), float(amb.get('confidence', 0.0)),
+        float(amb.get('rel_light_change', 0.0)), int(amb.get('state_id', -1)),
+        efic['voltage_predicted'], efic['error'], 1 if efic['status'] == 'OK' else 0,
+        p['anom']['score'], 1 if p['anom']['is_anomaly'] else 0, 1 if p['drift'] else 0
+    )
+
+
+def _medir(casos, entradas, repeticiones):
+    """Mejor tiempo por entrada de cada caso, alternando los casos en cada ronda"""
+    mejores = {nombre: None for nombre in casos}
+    resultados = {}
+    for _ in range(repeticiones):
+        for nombre, funcion in casos.items():
+            inicio = time.perf_counter()
+            resultados[nombre] = [funcion(x) for x in entradas]
+            duracion = time.perf_counter() - inicio
+            if mejores[nombre] is None or duracion < mejores[nombre]:
+                mejores[nombre] = duracion
+    return {nombre: mejores[nombre] / len(entradas) * 1e6 for nombre in casos}, resultados
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del codificador de line protocol")
+    parser.add_argument("--puntos", type=int, default=20000)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--lote", type=int, default=500, help="líneas por cuerpo de escritura")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(7)
+    puntos = [_lectura(rng, i) for i in range(args.puntos)]
+
+    omitir = line_protocol.OmitirSinCambios(line_protocol.TRACKER)
+    casos = {
+        'fstrings': fstrings,
+        'esquema': lambda p: line_protocol.TRACKER.codificar((p['device_id'],), _valores(p), p['ts_ms']),
+        'omitir': lambda p: omitir.codificar((p['device_id'],), _valores(p), p['ts_ms']),
+    }
+
+    tiempos, lineas = _medir(casos, puntos, args.repeticiones)
+    base = tiempos['fstrings']
+    for nombre, us in tiempos.items():
+        bytes_medios = sum(len(l) for l in lineas[nombre]) / len(lineas[nombre])
+        print(f"{nombre:<10} {us:>7.2f} us/punto  x{base / us:>4.2f}  {bytes_medios:>6.1f} bytes/punto")
+
+    # Mismo contenido salvo escapado: sin caracteres especiales en los ids deben coincidir
+    iguales = sum(a == b for a, b in zip(lineas['fstrings'], lineas['esquema']))
+    print(f"líneas idénticas fstrings/esquema: {iguales}/{len(puntos)}")
+
+    # Cuerpo completo de un lote a partir de las lecturas
+    lotes = [puntos[i:i + args.lote] for i in range(0, len(puntos), args.lote)]
+    tiempos, _ = _medir({
+        'join': lambda lote: "\n".join([fstrings(p) for p in lote]).encode("utf-8"),
+        'codificar_lote': lambda lote: line_protocol.TRACKER.codificar_lote(
+            ((p['device_id'],), _valores(p), p['ts_ms']) for p in lote),
+    }, lotes, args.repeticiones)
+    print(f"lote fstrings+join  {tiempos['join'] / args.lote:>7.2f} us/punto (lotes de {args.lote})")
+    print(f"lote codificar_lote {tiempos['codificar_lote'] / args.lote:>7.2f} us/punto")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Benchmark del almacén de controladores PID (pid_store.py).
+
+Para cada tamaño de flota compara:
+    - objeto:  un DevicePIDController por dispositivo en un dict
+    - escalar: PIDControllerStore.calcular_angulos (un dispositivo por llamada)
+    - lote:    PIDControllerStore.calcular_angulos_lote (todos en un paso)
+midiendo bytes por dispositivo (tracemalloc, incluye ids y diccionario) y
+µs por paso de dispositivo. Con una flota sana ambos valores se mantienen
+planos al crecer el número de dispositivos.
+
+Uso:
+    python benchmarks/bench_pid_store.py --dispositivos 1000,10000,100000
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from pid_controller import DevicePIDController
+from pid_store import PIDControllerStore
+
+
+def _memoria(crear):
+    tracemalloc.start()
+    try:
+        objeto = crear()
+        return objeto, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def _medir(funcion, repeticiones):
+    mejor = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        duracion = time.perf_counter() - inicio
+        mejor = duracion if mejor is None or duracion < mejor else mejor
+    return mejor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del almacén de controladores PID")
+    parser.add_argument("--dispositivos", default="1000,10000,100000")
+    parser.add_argument("--pasos-escalares", type=int, default=20000,
+                        help="pasos individuales medidos por tamaño")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(7)
+    print(f"{'dispositivos':>12} {'caso':<8} {'bytes/disp':>10} {'us/paso':>8}")
+    for n in (int(x) for x in args.dispositivos.split(",")):
+        ids = [f"tracker_{i}" for i in range(n)]
+        ldr = rng.integers(0, 4096, size=(n, 4))
+        servo_h = np.full(n, 120)
+        servo_v = np.full(n, 150)
+        lecturas = [tuple(int(x) for x in fila) for fila in ldr[:args.pasos_escalares]]
+        m = len(lecturas)
+
+        objetos, mem_obj = _memoria(lambda: {d: DevicePIDController(d) for d in ids})
+
+        def paso_objeto():
+            for k in range(m):
+                objetos[ids[k]].calcular_angulos(*lecturas[k], 120, 150)
+
+        def crear_store():
+            s = PIDControllerStore(capacidad_inicial=n)
+            for d in ids:
+                s.indice(d)
+            return s
+
+        store, mem_store = _memoria(crear_store)
+
+        def paso_escalar():
+            for k in range(m):
+                store.calcular_angulos(ids[k], *lecturas[k], 120, 150)
+
+        t_obj = _medir(paso_objeto, args.repeticiones) / m
+        t_esc = _medir(paso_escalar, args.repeticiones) / m
+        t_lote = _medir(lambda: store.calcular_angulos_lote(ids, ldr, servo_h, servo_v), args.repeticiones) / n
+
+        print(f"{n:>12} {'objeto':<8} {mem_obj / n:>10.0f} {t_obj * 1e6:>8.2f}")
+        print(f"{n:>12} {'escalar':<8} {mem_store / n:>10.0f} {t_esc * 1e6:>8.2f}")
+        print(f"{n:>12} {'lote':<8} {mem_store / n:>10.0f} {t_lote * 1e6:>8.2f}")
+        del objetos, store
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
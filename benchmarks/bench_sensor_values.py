@@ -0,0 +1,281 @@
+"""
+Benchmark del hot path de /sensor_values.
+
+Lanza peticiones contra la app Flask de dos formas:
+    - test_client: sin red, mide solo el coste del handler
+    - wsgi: servidor WSGI real (werkzeug, multihilo) con clientes HTTP concurrentes
+
+InfluxDB se sustituye por un stub local. Para cada escenario (1..N
+dispositivos simulados) informa latencia p50/p99, peticiones por segundo
+y el desglose por etapa: parseo JSON, PID, cada modelo River, construcción
+del line protocol y escritura en Influx.
+
+Uso:
+    python benchmarks/bench_sensor_values.py --dispositivos 1,4,16 --peticiones 500
+    python benchmarks/bench_sensor_values.py --guardar-baseline
+    python benchmarks/bench_sensor_values.py --comparar        # exit 1 si hay regresión
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from influx_stub import InfluxStub
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    idx = min(len(ordenados) - 1, max(0, int(round(p / 100.0 * (len(ordenados) - 1)))))
+    return ordenados[idx]
+
+
+class ColectorEtapas:
+    """Observador de etapas: list.append es atómico con el GIL, sin locks"""
+
+    def __init__(self):
+        self.muestras = {}
+
+    def __call__(self, etapa, segundos):
+        lista = self.muestras.get(etapa)
+        if lista is None:
+            lista = self.muestras.setdefault(etapa, [])
+        lista.append(segundos)
+
+    def flush(self, n_lineas, segundos, ok):
+        self('influx_write', segundos)
+
+    def reset(self):
+        self.muestras = {}
+
+    def resumen(self):
+        return {
+            etapa: {
+                'n': len(v),
+                'p50_us': round(percentil(v, 50) * 1e6, 2),
+                'p99_us': round(percentil(v, 99) * 1e6, 2)
+            }
+            for etapa, v in sorted(self.muestras.items())
+        }
+
+
+class DispositivoSimulado:
+    """Genera lecturas con un paseo aleatorio de luz para un tracker"""
+
+    def __init__(self, device_id, seed):
+        self.device_id = device_id
+        self.rng = random.Random(seed)
+        self.base = self.rng.uniform(1500, 3000)
+        self.servo_h = 120
+        self.servo_v = 150
+
+    def payload(self):
+        self.base = min(4000, max(200, self.base + self.rng.gauss(0, 20)))
+        b = self.base
+        return json.dumps({
+            "device_id": self.device_id,
+            "ldr_tl": int(b + self.rng.gauss(40, 15)),
+            "ldr_tr": int(b + self.rng.gauss(0, 15)),
+            "ldr_bl": int(b + self.rng.gauss(-30, 15)),
+            "ldr_br": int(b + self.rng.gauss(-50, 15)),
+            "servo_h": self.servo_h,
+            "servo_v": self.servo_v,
+            "at_limit_h": False,
+            "at_limit_v": False,
+            "panel_voltage": round(b / 1000.0, 3),
+            "bme_temp_c": 24.5,
+            "bme_press_hpa": 1009.3,
+            "bme_hum_pct": 45.0
+        })
+
+    def aplicar(self, respuesta):
+        cmd = respuesta.get("command")
+        if cmd:
+            self.servo_h = cmd["servo_h"]
+            self.servo_v = cmd["servo_v"]
+
+
+def _resultado(latencias, duracion, colector):
+    n = len(latencias)
+    return {
+        'requests': n,
+        'rps': round(n / duracion, 1) if duracion > 0 else None,
+        'p50_ms': round(percentil(latencias, 50) * 1e3, 3),
+        'p99_ms': round(percentil(latencias, 99) * 1e3, 3),
+        'stages': colector.resumen()
+    }
+
+
+def escenario_test_client(sf, colector, n_dispositivos, n_peticiones, calentamiento):
+    client = sf.app.test_client()
+    dispositivos = [DispositivoSimulado(f"bench_tc_{n_dispositivos}_{i}", i) for i in range(n_dispositivos)]
+
+    for _ in range(calentamiento):
+        for d in dispositivos:
+            d.aplicar(client.post("/sensor_values", data=d.payload(), content_type="application/json").get_json())
+
+    colector.reset()
+    latencias = []
+    inicio = time.perf_counter()
+    for i in range(n_peticiones):
+        d = dispositivos[i % n_dispositivos]
+        body = d.payload()
+        t0 = time.perf_counter()
+        r = client.post("/sensor_values", data=body, content_type="application/json")
+        latencias.append(time.perf_counter() - t0)
+        d.aplicar(r.get_json())
+    return _resultado(latencias, time.perf_counter() - inicio, colector)
+
+
+def escenario_wsgi(sf, colector, n_dispositivos, n_peticiones, calentamiento, concurrencia):
+    import requests
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class _SinLog(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, sf.app, threaded=True, request_handler=_SinLog)
+    hilo = threading.Thread(target=server.serve_forever, daemon=True)
+    hilo.start()
+    url = f"http://127.0.0.1:{server.server_port}/sensor_values"
+
+    dispositivos = [DispositivoSimulado(f"bench_wsgi_{n_dispositivos}_{i}", 1000 + i) for i in range(n_dispositivos)]
+    hilos = max(1, min(concurrencia, n_dispositivos))
+    # Cada hilo cliente atiende un subconjunto fijo de dispositivos, en serie,
+    # igual que un ESP32 que espera la respuesta antes de volver a enviar
+    grupos = [dispositivos[i::hilos] for i in range(hilos)]
+    por_hilo = max(1, n_peticiones // hilos)
+    headers = {"Content-Type": "application/json"}
+
+    def trabajar(grupo, n, medir):
+        sesion = requests.Session()
+        lat = []
+        for i in range(n):
+            d = grupo[i % len(grupo)]
+            body = d.payload()
+            t0 = time.perf_counter()
+            r = sesion.post(url, data=body, headers=headers, timeout=30)
+            lat.append(time.perf_counter() - t0)
+            d.aplicar(r.json())
+        sesion.close()
+        return lat if medir else []
+
+    try:
+        with ThreadPoolExecutor(max_workers=hilos) as pool:
+            list(pool.map(lambda g: trabajar(g, calentamiento * len(g), False), grupos))
+            colector.reset()
+            inicio = time.perf_counter()
+            resultados = list(pool.map(lambda g: trabajar(g, por_hilo, True), grupos))
+            duracion = time.perf_counter() - inicio
+    finally:
+        server.shutdown()
+
+    latencias = [x for lat in resultados for x in lat]
+    res = _resultado(latencias, duracion, colector)
+    res['client_threads'] = hilos
+    return res
+
+
+def comparar(actual, baseline, tolerancia):
+    """Devuelve la lista de regresiones (métrica, baseline, actual)"""
+    regresiones = []
+    for clave, res in actual.items():
+        base = baseline.get(clave)
+        if not base:
+            continue
+        if res['p50_ms'] > base['p50_ms'] * (1 + tolerancia):
+            regresiones.append((f"{clave} p50_ms", base['p50_ms'], res['p50_ms']))
+        if base.get('rps') and res['rps'] < base['rps'] * (1 - tolerancia):
+            regresiones.append((f"{clave} rps", base['rps'], res['rps']))
+        for etapa, st in res['stages'].items():
+            st_base = base.get('stages', {}).get(etapa)
+            if st_base and st['p50_us'] > st_base['p50_us'] * (1 + tolerancia):
+                regresiones.append((f"{clave} {etapa} p50_us", st_base['p50_us'], st['p50_us']))
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de /sensor_values")
+    parser.add_argument("--dispositivos", default="1,4,16", help="lista de números de dispositivos")
+    parser.add_argument("--peticiones", type=int, default=500, help="peticiones medidas por escenario")
+    parser.add_argument("--calentamiento", type=int, default=20, help="peticiones por dispositivo sin medir")
+    parser.add_argument("--modo", choices=("test_client", "wsgi", "all"), default="all")
+    parser.add_argument("--concurrencia", type=int, default=32, help="máximo de hilos cliente en modo wsgi")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--guardar-baseline", action="store_true")
+    parser.add_argument("--comparar", action="store_true")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="empeoramiento relativo permitido")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    stub = InfluxStub().start()
+    os.environ.update({
+        "INFLUX_URL_BASE": stub.host,
+        "INFLUX_PORT": str(stub.port),
+        "INFLUX_FLUSH_INTERVAL_S": "0.2",
+        "SNAPSHOTS_ENABLED": "0",
+    })
+    import servidor_flask as sf
+
+    colector = ColectorEtapas()
+    sf.stage_observer = colector
+    sf.influx_writer.flush_observer = colector.flush
+
+    resultados = {}
+    for n in [int(x) for x in args.dispositivos.split(",") if x.strip()]:
+        if args.modo in ("test_client", "all"):
+            resultados[f"test_client/{n}"] = escenario_test_client(sf, colector, n, args.peticiones, args.calentamiento)
+        if args.modo in ("wsgi", "all"):
+            # Dar tiempo a que el escritor vacíe la cola y medir su latencia
+            resultados[f"wsgi/{n}"] = escenario_wsgi(sf, colector, n, args.peticiones, args.calentamiento, args.concurrencia)
+            time.sleep(sf.influx_writer.flush_interval_s * 2)
+            resultados[f"wsgi/{n}"]['stages'].update(
+                {k: v for k, v in colector.resumen().items() if k == 'influx_write'})
+
+    sf.influx_writer.stop()
+    stub.stop()
+
+    if args.json:
+        print(json.dumps(resultados, indent=2))
+    else:
+        for clave, res in resultados.items():
+            print(f"{clave:<16} {res['requests']:>6} req  {res['rps']:>9} req/s  "
+                  f"p50 {res['p50_ms']:>8.3f} ms  p99 {res['p99_ms']:>8.3f} ms")
+            for etapa, st in res['stages'].items():
+                print(f"    {etapa:<14} p50 {st['p50_us']:>10.1f} us  p99 {st['p99_us']:>10.1f} us  (n={st['n']})")
+
+    if args.guardar_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, sort_keys=True)
+        print(f"Baseline guardada en {args.baseline}")
+
+    if args.comparar:
+        try:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print(f"No hay baseline en {args.baseline}; ejecuta con --guardar-baseline")
+            return 2
+        regresiones = comparar(resultados, baseline, args.tolerancia)
+        for metrica, antes, ahora in regresiones:
+            print(f"REGRESIÓN {metrica}: {antes} -> {ahora}")
+        if regresiones:
+            return 1
+        print("Sin regresiones respecto a la baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Benchmark del arranque del servidor.
+
+Lanza procesos nuevos que importan servidor_flask y mide, para el modo
+normal (LAZY_INIT=0) y el perezoso (LAZY_INIT=1, con calentamiento en
+segundo plano):
+
+    - import_s: hasta que el módulo está importado (el servidor ya podría escuchar)
+    - ready_s:  hasta que /ready respondería 200 (River importado y calentado)
+
+e imprime los módulos que más tardan en importarse (python -X importtime).
+Con --guardar-baseline / --comparar detecta regresiones del arranque.
+
+Uso:
+    python benchmarks/bench_startup.py --repeticiones 5
+    python benchmarks/bench_startup.py --guardar-baseline
+    python benchmarks/bench_startup.py --comparar --tolerancia 0.25   # exit 1 si hay regresión
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines_startup.json")
+
+MODOS = {
+    "eager": {"LAZY_INIT": "0"},
+    "lazy": {"LAZY_INIT": "1", "WARMUP": "1"},
+}
+
+_MEDIR = """
+import json, time
+t0 = time.perf_counter()
+import servidor_flask as sf
+t1 = time.perf_counter()
+while sf.arranque['state'] == 'warming':
+    time.sleep(0.002)
+t2 = time.perf_counter()
+print(json.dumps({'import_s': t1 - t0, 'ready_s': t2 - t0, 'state': sf.arranque['state']}))
+"""
+
+
+def _entorno(extra):
+    # Sin efectos en disco ni en InfluxDB: solo se mide el arranque
+    return dict(os.environ, SNAPSHOTS_ENABLED="0", SPOOL_ENABLED="0", **extra)
+
+
+def medir(modo, repeticiones):
+    muestras = []
+    for _ in range(repeticiones):
+        r = subprocess.run([sys.executable, "-c", _MEDIR], cwd=RAIZ, env=_entorno(MODOS[modo]),
+                           capture_output=True, text=True, check=True)
+        muestras.append(json.loads(r.stdout.strip().splitlines()[-1]))
+    return {
+        'import_s': round(statistics.median(m['import_s'] for m in muestras), 4),
+        'ready_s': round(statistics.median(m['ready_s'] for m in muestras), 4),
+        'state': muestras[-1]['state']
+    }
+
+
+def modulos_mas_lentos(n):
+    """(segundos acumulados, módulo) de las importaciones de primer nivel más caras"""
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", "import servidor_flask"], cwd=RAIZ,
+                       env=_entorno({"LAZY_INIT": "0"}), capture_output=True, text=True, check=True)
+    filas = []
+    for linea in r.stderr.splitlines():
+        if not linea.startswith("import time:") or "|" not in linea:
+            continue
+        _, acumulado, nombre = linea[len("import time:"):].split("|")
+        if not acumulado.strip().isdigit():
+            continue
+        # Sangría de dos espacios = importado directamente por el módulo raíz
+        if nombre.startswith("   ") and not nombre.startswith("    "):
+            filas.append((int(acumulado) / 1e6, nombre.strip()))
+    return sorted(filas, reverse=True)[:n]
+
+
+def comparar(actual, baseline, tolerancia):
+    """Devuelve la lista de regresiones (métrica, baseline, actual)"""
+    regresiones = []
+    for modo, res in actual.items():
+        base = baseline.get(modo)
+        if not base:
+            continue
+        for metrica in ('import_s', 'ready_s'):
+            if res[metrica] > base[metrica] * (1 + tolerancia):
+                regresiones.append((f"{modo}.{metrica}", base[metrica], res[metrica]))
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del arranque del servidor")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--modulos", type=int, default=10, help="módulos más lentos a mostrar")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--guardar-baseline", action="store_true")
+    parser.add_argument("--comparar", action="store_true")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="empeoramiento relativo permitido")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    resultados = {modo: medir(modo, args.repeticiones) for modo in MODOS}
+
+    if args.json:
+        print(json.dumps(resultados, indent=2))
+    else:
+        print(f"{'modo':<6} {'import_s':>9} {'ready_s':>8}  estado")
+        for modo, res in resultados.items():
+            print(f"{modo:<6} {res['import_s']:>9.3f} {res['ready_s']:>8.3f}  {res['state']}")
+        if args.modulos:
+            print("Importaciones más caras (modo eager, acumulado):")
+            for segundos, nombre in modulos_mas_lentos(args.modulos):
+                print(f"  {segundos:>7.3f} s  {nombre}")
+
+    if args.guardar_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, sort_keys=True)
+        print(f"Baseline guardada en {args.baseline}")
+
+    if args.comparar:
+        try:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print(f"No hay baseline en {args.baseline}; ejecuta con --guardar-baseline")
+            return 2
+        regresiones = comparar(resultados, baseline, args.tolerancia)
+        for metrica, antes, ahora in regresiones:
+            print(f"REGRESIÓN {metrica}: {antes} -> {ahora}")
+        if regresiones:
+            return 1
+        print("Sin regresiones respecto a la baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
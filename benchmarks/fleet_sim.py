@@ -0,0 +1,479 @@
+"""
+Simulador en lazo cerrado de una flota de trackers virtuales.
+
+Sin ESP32 físicos no hay forma de cargar el servidor con tráfico real. Cada
+tracker virtual repite el bucle de Flask/Flask.ino contra /sensor_values por
+HTTP (asyncio + aiohttp, miles de trackers en un proceso):
+
+    - lee los LDR y el voltaje del panel según el sol de su sitio
+      (ephemeris.py, Planta de bench_feedforward.py), las nubes y el ruido
+    - envía la lectura (JSON o binario) a /sensor_values?format=compact
+    - aplica [ok, h, v, fast_interval_ms, fast_duration_ms] como el
+      firmware: el comando solo si respeta limiteMinH/MaxH/MinV/MaxV, y el
+      intervalo indicado durante fast_duration_ms
+    - vuelve a enviar al vencer httpInterval, comprobado cada 50 ms (delay(50))
+
+El servidor se arranca en un subproceso (WSGI con cluster.py backend, ASGI
+con uvicorn o cluster.py serve) con InfluxDB sustituido por influx_stub.py;
+con --url se usa uno ya arrancado. Informa throughput de la flota, latencia
+vista por los trackers, intervalos asignados, tiempo hasta converger tras el
+arranque y tras cada nube, y la frecuencia de cada estado de
+clasificar_condicion_ambiental (campo env_state de los puntos escritos).
+
+Las nubes son por sitio (todos sus trackers a la vez, como en una planta
+real) y parpadean en los bordes, que es lo que produce UNSTABLE. El reloj del
+sol y de las nubes puede acelerarse (--aceleracion): el bucle de envío sigue
+en tiempo real, así que la carga es la real y el sol se mueve más deprisa
+entre muestras.
+
+Uso:
+    python benchmarks/fleet_sim.py --dispositivos 200 --duracion 60
+    python benchmarks/fleet_sim.py --dispositivos 3000 --servidor asgi --presupuesto-rps 5000 --binario --rampa-s 60
+    python benchmarks/fleet_sim.py --dispositivos 500 --servidor cluster --workers 4 --avance
+    python benchmarks/fleet_sim.py --url http://127.0.0.1:6000 --dispositivos 50
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import aiohttp
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import binary_format
+from bench_feedforward import Planta
+from ephemeris import Montaje, TablaSolar
+from influx_stub import InfluxStub
+
+
+# Flask.ino
+HTTP_SEND_INTERVAL_MS = 500
+LOOP_MS = 50
+POS_INICIAL = (120, 150)
+LIMITES = (40, 180, 40, 175)    # limiteMinH, limiteMaxH, limiteMinV, limiteMaxV
+DEVICE_ID = "sim_{:05d}"
+
+CONVERGIDO_DEG = 3
+ELEVACION_MIN = 5               # por debajo no se mide apuntado ni convergencia
+VOC = 6.0                       # voltaje del panel a plena irradiancia
+ESTADOS = ("SUNNY", "CLOUDY", "UNSTABLE", "HUMID_HAZY")
+_ENV_STATE = re.compile(rb'env_state="([A-Z_]+)"')
+
+
+def percentil(valores, p):
+    if not valores:
+        return float("nan")
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100.0 * (len(ordenados) - 1))))]
+
+
+class Reloj:
+    """Tiempo solar simulado: `inicio_ts` + tiempo real transcurrido x `aceleracion`"""
+
+    def __init__(self, inicio_ts, aceleracion):
+        self.inicio_ts = inicio_ts
+        self.aceleracion = aceleracion
+        self.m0 = time.monotonic()
+
+    def ts(self, monotonic):
+        return self.inicio_ts + (monotonic - self.m0) * self.aceleracion
+
+
+class Sitio:
+    """Montaje y episodios de nube compartidos por los trackers de un sitio"""
+
+    def __init__(self, lat, lon, inicio_ts, fin_ts, nubes_hora, nube_min_s, nube_max_s, rng):
+        self.montaje = Montaje(lat, lon)
+        # Episodios (desde, hasta, transmisión) como proceso de Poisson en tiempo solar
+        self.nubes = []
+        t = inicio_ts
+        while nubes_hora > 0:
+            t += rng.expovariate(nubes_hora / 3600.0)
+            if t >= fin_ts:
+                break
+            duracion = rng.uniform(nube_min_s, nube_max_s)
+            self.nubes.append((t, t + duracion, rng.uniform(0.05, 0.3)))
+            t += duracion
+
+    def nube(self, ts, rng):
+        """(factor de luz directa, dentro de un episodio); en los bordes parpadea"""
+        for desde, hasta, transmision in self.nubes:
+            if desde <= ts < hasta:
+                borde = 0.15 * (hasta - desde)
+                if ts < desde + borde or ts >= hasta - borde:
+                    return rng.uniform(transmision, 1.0), True
+                return transmision, True
+            if desde > ts:
+                break
+        return 1.0, False
+
+
+class Metricas:
+    def __init__(self):
+        self.peticiones = 0
+        self.errores_conexion = 0
+        self.no_200 = Counter()
+        self.fuera_de_limites = 0
+        self.latencias = []
+        self.bytes_enviados = 0
+        self.intervalos = []
+        self.convergencias = {'arranque': [], 'nube': []}
+        self.sin_converger = Counter()
+        self.error_apuntado = []
+
+
+def voltaje_panel(planta, ts, servo_h, servo_v, nube, rng):
+    """Voltaje del panel: irradiancia directa por coseno de incidencia más difusa, curva logarítmica"""
+    dh, dv, el = planta.desalineacion(ts, servo_h, servo_v)
+    incidencia = max(0.0, math.cos(math.radians(dh)) * math.cos(math.radians(dv)))
+    g = max(0.0, math.sin(math.radians(el))) * (nube * incidencia + 0.15)
+    return round(VOC * math.log1p(40.0 * g) / math.log1p(40.0) * (1 + rng.gauss(0, 0.005)), 4)
+
+
+def bme(ts, nube, en_nube, rng):
+    """BME280: más humedad y algo menos de temperatura bajo nube"""
+    return {
+        "bme_temp_c": round(28.0 - (3.0 if en_nube else 0.0) + rng.gauss(0, 0.2), 2),
+        "bme_press_hpa": round(1013.0 + rng.gauss(0, 0.3), 2),
+        "bme_hum_pct": round(min(99.0, 45.0 + (1.0 - nube) * 45.0 + rng.gauss(0, 1.0)), 2),
+        "bme_alt_m": 650.0
+    }
+
+
+def siguiente_envio(inicio_envio, fin_respuesta, intervalo_ms, rapido_hasta):
+    """
+    Instante del próximo envío según el loop del firmware: se comprueba cada
+    LOOP_MS tras la respuesta; al pasar fastModeUntil vuelve HTTP_SEND_INTERVAL.
+    """
+    paso = LOOP_MS / 1000.0
+
+    def primer_tick(desde):
+        return fin_respuesta + paso * max(1, math.ceil((desde - fin_respuesta) / paso))
+
+    t = primer_tick(inicio_envio + intervalo_ms / 1000.0)
+    if rapido_hasta is None or t <= rapido_hasta:
+        return t
+    return min(t, primer_tick(max(inicio_envio + HTTP_SEND_INTERVAL_MS / 1000.0, rapido_hasta)))
+
+
+async def tracker(i, sesion, url, sitio, tabla, reloj, fin, args, met):
+    rng = random.Random(args.semilla * 100003 + i)
+    planta = Planta(sitio.montaje, tabla, rng)
+    device_id = DEVICE_ID.format(i)
+    min_h, max_h, min_v, max_v = LIMITES
+    servo_h, servo_v = POS_INICIAL
+    intervalo_ms, rapido_hasta = HTTP_SEND_INTERVAL_MS, None
+    cabeceras = {"Content-Type": binary_format.CONTENT_TYPE if args.binario else "application/json"}
+
+    # Arranque escalonado: dentro del primer intervalo o a lo largo de la rampa
+    await asyncio.sleep(rng.uniform(0, max(args.rampa_s, HTTP_SEND_INTERVAL_MS / 1000.0)))
+    pendiente = ['arranque', time.monotonic(), 0]
+    en_nube_prev = False
+
+    while True:
+        inicio = time.monotonic()
+        if inicio >= fin:
+            break
+        ts = reloj.ts(inicio)
+        nube, en_nube = sitio.nube(ts, rng)
+        if en_nube_prev and not en_nube and pendiente is None:
+            pendiente = ['nube', inicio, 0]
+        en_nube_prev = en_nube
+
+        tl, tr, bl, br = planta.ldr(ts, servo_h, servo_v, nube)
+        lectura = {
+            "device_id": device_id,
+            "ldr_tl": tl, "ldr_tr": tr, "ldr_bl": bl, "ldr_br": br,
+            "servo_h": servo_h, "servo_v": servo_v,
+            "at_limit_h": servo_h in (min_h, max_h), "at_limit_v": servo_v in (min_v, max_v),
+            "panel_voltage": voltaje_panel(planta, ts, servo_h, servo_v, nube, rng)
+        }
+        if not args.sin_bme:
+            lectura.update(bme(ts, nube, en_nube, rng))
+        cuerpo = binary_format.codificar_lectura(lectura) if args.binario \
+            else json.dumps(lectura, separators=(",", ":")).encode()
+
+        t0 = time.perf_counter()
+        try:
+            async with sesion.post(url, data=cuerpo, headers=cabeceras) as r:
+                respuesta = await r.read()
+                estado = r.status
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            met.errores_conexion += 1
+            estado = None
+        met.latencias.append(time.perf_counter() - t0)
+        met.peticiones += 1
+        met.bytes_enviados += len(cuerpo)
+        fin_respuesta = time.monotonic()
+
+        if estado == 200:
+            cmd = json.loads(respuesta)
+            if len(cmd) >= 5:
+                nuevo_h, nuevo_v, fi, fd = int(cmd[1]), int(cmd[2]), int(cmd[3]), int(cmd[4])
+                if min_h <= nuevo_h <= max_h and min_v <= nuevo_v <= max_v:
+                    servo_h, servo_v = nuevo_h, nuevo_v
+                else:
+                    met.fuera_de_limites += 1
+                if 200 <= fi <= 60000 and 0 < fd <= 600000:
+                    intervalo_ms, rapido_hasta = fi, fin_respuesta + fd / 1000.0
+        elif estado is not None:
+            met.no_200[estado] += 1
+
+        # Apuntado y convergencia con el sol alto y fuera de nube
+        obj_h, obj_v, _, el = planta.objetivo(ts)
+        if el >= ELEVACION_MIN and not en_nube:
+            error = max(abs(servo_h - obj_h), abs(servo_v - obj_v))
+            met.error_apuntado.append(error)
+            if pendiente is not None:
+                pendiente[2] += 1
+                if error <= CONVERGIDO_DEG:
+                    met.convergencias[pendiente[0]].append((pendiente[2], fin_respuesta - pendiente[1]))
+                    pendiente = None
+
+        if rapido_hasta is not None and fin_respuesta > rapido_hasta:
+            intervalo_ms, rapido_hasta = HTTP_SEND_INTERVAL_MS, None
+        proximo = siguiente_envio(inicio, fin_respuesta, intervalo_ms, rapido_hasta)
+        met.intervalos.append(proximo - inicio)
+        await asyncio.sleep(max(0.0, proximo - time.monotonic()))
+
+    if pendiente is not None:
+        met.sin_converger[pendiente[0]] += 1
+
+
+def comando_servidor(modo, puerto, workers):
+    if modo == "wsgi":
+        return [sys.executable, "cluster.py", "backend", "--port", str(puerto)]
+    if modo == "asgi":
+        return [sys.executable, "-m", "uvicorn", "servidor_asgi:app", "--host", "127.0.0.1",
+                "--port", str(puerto), "--workers", "1", "--backlog", "4096", "--log-level", "warning"]
+    return [sys.executable, "cluster.py", "serve", "--workers", str(workers), "--port", str(puerto),
+            "--backend-base-port", str(puerto + 1), "--sin-gunicorn"]
+
+
+async def esperar_listo(base, timeout_s=90.0):
+    limite = time.monotonic() + timeout_s
+    async with aiohttp.ClientSession() as sesion:
+        while time.monotonic() < limite:
+            try:
+                async with sesion.get(f"{base}/ready", timeout=aiohttp.ClientTimeout(total=1)) as r:
+                    if r.status == 200:
+                        return True
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            await asyncio.sleep(0.2)
+    return False
+
+
+async def estadisticas_servidor(base):
+    """Contadores del planificador y del registro (backend 0 en modo cluster)"""
+    resultado = {}
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as sesion:
+        for ruta in ("/scheduler_stats", "/registry_stats"):
+            try:
+                async with sesion.get(base + ruta) as r:
+                    if r.status == 200:
+                        resultado[ruta.strip("/")] = await r.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                pass
+    return resultado
+
+
+async def simular(args, base, sitios, tabla, reloj):
+    met = Metricas()
+    conector = aiohttp.TCPConnector(limit=args.conexiones, force_close=args.sin_keep_alive)
+    url = f"{base}/sensor_values?format=compact"
+    cpu0 = time.process_time()
+    inicio = time.monotonic()
+    fin = inicio + args.duracion
+    async with aiohttp.ClientSession(connector=conector, timeout=aiohttp.ClientTimeout(total=10)) as sesion:
+        await asyncio.gather(*(
+            tracker(i, sesion, url, sitios[i % len(sitios)], tabla, reloj, fin, args, met)
+            for i in range(args.dispositivos)
+        ))
+    duracion = time.monotonic() - inicio
+    return met, duracion, time.process_time() - cpu0
+
+
+def informe(args, met, duracion, cpu_s, estados, stub, servidor, modo):
+    lat = met.latencias
+    rapido = sum(1 for s in met.intervalos if s < HTTP_SEND_INTERVAL_MS / 1000.0)
+    total_estados = sum(estados.values())
+
+    def conv(tipo):
+        datos = met.convergencias[tipo]
+        muestras = [m for m, _ in datos]
+        segundos = [s for _, s in datos]
+        return {
+            'converged': len(datos),
+            'not_converged': met.sin_converger[tipo],
+            'samples_mean': statistics.fmean(muestras) if muestras else None,
+            'samples_p90': percentil(muestras, 90) if muestras else None,
+            'seconds_mean': statistics.fmean(segundos) if segundos else None,
+            'seconds_p90': percentil(segundos, 90) if segundos else None
+        }
+
+    resultado = {
+        'devices': args.dispositivos, 'sites': args.sitios, 'server': modo, 'duration_s': round(duracion, 2),
+        'requests': met.peticiones, 'rps': met.peticiones / duracion,
+        'connection_errors': met.errores_conexion, 'non_200': dict(met.no_200),
+        'commands_out_of_limits': met.fuera_de_limites,
+        'bytes_per_request': met.bytes_enviados / max(1, met.peticiones),
+        'latency_ms': {p: percentil(lat, q) * 1000 for p, q in (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100))},
+        'interval_mean_ms': statistics.fmean(met.intervalos) * 1000 if met.intervalos else None,
+        'fast_fraction': rapido / max(1, len(met.intervalos)),
+        'convergence': {'startup': conv('arranque'), 'cloud': conv('nube')},
+        'pointing_error_mean_deg': statistics.fmean(met.error_apuntado) if met.error_apuntado else None,
+        'aligned_fraction': (sum(1 for e in met.error_apuntado if e <= CONVERGIDO_DEG) / len(met.error_apuntado)
+                             if met.error_apuntado else None),
+        'env_states': {e: estados.get(e, 0) for e in ESTADOS},
+        'simulator_cpu': cpu_s / duracion,
+        'influx_stub': stub.get_stats() if stub else None,
+        'server_stats': servidor
+    }
+    if args.json:
+        print(json.dumps(resultado, indent=2, default=str))
+        return resultado
+
+    print(f"flota: {args.dispositivos} trackers en {args.sitios} sitio(s) contra {modo}, "
+          f"{duracion:.1f} s, sol x{args.aceleracion:g} desde {args.inicio}")
+    print(f"peticiones   {met.peticiones} ({resultado['rps']:.1f}/s), {resultado['bytes_per_request']:.0f} B/petición, "
+          f"errores de conexión {met.errores_conexion}, no-200 {dict(met.no_200) or 0}, "
+          f"comandos fuera de límites {met.fuera_de_limites}")
+    l = resultado['latency_ms']
+    print(f"latencia     p50 {l['p50']:.2f} ms  p90 {l['p90']:.2f} ms  p99 {l['p99']:.2f} ms  max {l['max']:.2f} ms")
+    print(f"intervalo    medio {resultado['interval_mean_ms'] or float('nan'):.0f} ms, "
+          f"modo rápido (< {HTTP_SEND_INTERVAL_MS} ms) {resultado['fast_fraction'] * 100:.1f} %")
+    for nombre, tipo in (("arranque", 'startup'), ("tras nube", 'cloud')):
+        c = resultado['convergence'][tipo]
+        if c['converged']:
+            print(f"convergencia {nombre:<9} {c['converged']} (sin converger {c['not_converged']}): "
+                  f"{c['samples_mean']:.1f} muestras / {c['seconds_mean']:.1f} s de media, "
+                  f"p90 {c['samples_p90']} muestras / {c['seconds_p90']:.1f} s")
+        else:
+            print(f"convergencia {nombre:<9} sin casos (sin converger {c['not_converged']})")
+    if met.error_apuntado:
+        print(f"apuntado     error medio {resultado['pointing_error_mean_deg']:.2f}°, "
+              f"alineado (≤ {CONVERGIDO_DEG}°) {resultado['aligned_fraction'] * 100:.1f} %")
+    if total_estados:
+        print("estados      " + "  ".join(f"{e} {estados.get(e, 0) / total_estados * 100:.1f} %" for e in ESTADOS)
+              + f"  ({total_estados} puntos)")
+    print(f"simulador    {resultado['simulator_cpu'] * 100:.0f} % de una CPU"
+          + ("  (cerca del 100 %: el cliente limita la carga)" if resultado['simulator_cpu'] > 0.9 else ""))
+    if stub:
+        s = stub.get_stats()
+        print(f"influx stub  {s['lines']} líneas en {s['requests']} escrituras")
+    sched = servidor.get('scheduler_stats') or {}
+    registro = servidor.get('registry_stats') or {}
+    if sched or registro:
+        print("servidor     " + ", ".join(f"{k}={v}" for k, v in (
+            ('observed_rps', sched.get('observed_rps')), ('projected_rps', sched.get('projected_rps')),
+            ('budget_rps', sched.get('budget_rps')), ('devices', registro.get('devices')),
+            ('learn_max_lag_s', registro.get('learn_max_lag_s')), ('learn_dropped', registro.get('learn_dropped')))
+            if v is not None))
+    return resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Flota de trackers virtuales en lazo cerrado contra /sensor_values")
+    parser.add_argument("--dispositivos", type=int, default=100)
+    parser.add_argument("--duracion", type=float, default=60.0, help="segundos reales de simulación")
+    parser.add_argument("--servidor", choices=("wsgi", "asgi", "cluster"), default="wsgi")
+    parser.add_argument("--workers", type=int, default=2, help="backends con --servidor cluster")
+    parser.add_argument("--url", help="servidor ya arrancado (no se arranca ninguno ni el stub)")
+    parser.add_argument("--puerto", type=int, default=6500)
+    parser.add_argument("--presupuesto-rps", type=float, help="SCHED_BUDGET_RPS del servidor")
+    parser.add_argument("--avance", action="store_true", help="activar el avance solar con el sitio de cada tracker")
+    parser.add_argument("--binario", action="store_true", help="lecturas en binary_format en lugar de JSON")
+    parser.add_argument("--sin-bme", action="store_true")
+    parser.add_argument("--sitios", type=int, default=1)
+    parser.add_argument("--lat", type=float, default=40.4)
+    parser.add_argument("--lon", type=float, default=-3.7)
+    parser.add_argument("--inicio", default="2024-06-21T08:00:00+00:00", help="instante solar inicial (ISO, UTC)")
+    parser.add_argument("--aceleracion", type=float, default=1.0, help="velocidad del reloj solar y de las nubes")
+    parser.add_argument("--nubes-hora", type=float, default=60.0, help="episodios de nube por hora solar y sitio")
+    parser.add_argument("--nube-min-s", type=float, default=10.0)
+    parser.add_argument("--nube-max-s", type=float, default=40.0)
+    parser.add_argument("--rampa-s", type=float, default=0.0,
+                        help="repartir el arranque de la flota en estos segundos (crear los modelos River es caro)")
+    parser.add_argument("--conexiones", type=int, default=512, help="conexiones HTTP simultáneas del simulador")
+    parser.add_argument("--sin-keep-alive", action="store_true",
+                        help="una conexión por petición, como el firmware (agota puertos con flotas grandes)")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="mostrar la salida del servidor")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.semilla)
+    inicio_ts = datetime.datetime.fromisoformat(args.inicio).timestamp()
+    fin_ts = inicio_ts + args.duracion * args.aceleracion
+    sitios = [Sitio(args.lat + (rng.uniform(-3, 3) if j else 0.0), args.lon + (rng.uniform(-3, 3) if j else 0.0),
+                    inicio_ts, fin_ts, args.nubes_hora, args.nube_min_s, args.nube_max_s, rng)
+              for j in range(max(1, args.sitios))]
+    tabla = TablaSolar()
+
+    estados = Counter()
+    stub = proceso = fichero_montajes = None
+    if args.url:
+        base, modo = args.url.rstrip("/"), args.url
+    else:
+        stub = InfluxStub(observador=lambda cuerpo: estados.update(m.decode() for m in _ENV_STATE.findall(cuerpo)))
+        stub.start()
+        entorno = dict(os.environ, INFLUX_URL_BASE="127.0.0.1", INFLUX_PORT=str(stub.port),
+                       SNAPSHOTS_ENABLED="0", SPOOL_ENABLED="0", LP_SKIP_UNCHANGED="0", INFLUX_RAW_WRITES="1")
+        for clave in ("RIVER_MAX_DEVICES", "HISTORY_MAX_DEVICES"):
+            entorno.setdefault(clave, str(max(256, args.dispositivos)))
+        if args.presupuesto_rps:
+            entorno["SCHED_BUDGET_RPS"] = str(args.presupuesto_rps)
+        if args.avance:
+            # Sitio de cada tracker, como en producción con SOLAR_DEVICES_FILE
+            fichero_montajes = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+            json.dump({DEVICE_ID.format(i): {"lat": sitios[i % len(sitios)].montaje.lat,
+                                             "lon": sitios[i % len(sitios)].montaje.lon}
+                       for i in range(args.dispositivos)}, fichero_montajes)
+            fichero_montajes.close()
+            entorno["SOLAR_DEVICES_FILE"] = fichero_montajes.name
+        salida = None if args.verbose else subprocess.DEVNULL
+        proceso = subprocess.Popen(comando_servidor(args.servidor, args.puerto, args.workers),
+                                   cwd=RAIZ, env=entorno, stdout=salida, stderr=salida)
+        base, modo = f"http://127.0.0.1:{args.puerto}", args.servidor
+
+    try:
+        if not asyncio.run(esperar_listo(base)):
+            print(f"el servidor en {base} no respondió a /ready", file=sys.stderr)
+            return 1
+        met, duracion, cpu_s = asyncio.run(simular(args, base, sitios, tabla, Reloj(inicio_ts, args.aceleracion)))
+        servidor = asyncio.run(estadisticas_servidor(base))
+        if stub:
+            # Último lote del escritor de InfluxDB (INFLUX_FLUSH_INTERVAL_S)
+            time.sleep(float(os.environ.get('INFLUX_FLUSH_INTERVAL_S', '1.0')) + 0.5)
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            try:
+                proceso.wait(15)
+            except subprocess.TimeoutExpired:
+                proceso.kill()
+        if stub:
+            stub.stop()
+        if fichero_montajes is not None:
+            os.unlink(fichero_montajes.name)
+
+    informe(args, met, duracion, cpu_s, estados, stub, servidor, modo)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Servidor HTTP mínimo que imita el endpoint /api/v2/write de InfluxDB.
+
+Acepta cualquier escritura (con o sin gzip), responde 204 y cuenta líneas
+y bytes. Lo usan los benchmarks y el simulador para no depender de una
+instancia real de InfluxDB.
+"""
+
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class InfluxStub:
+    """Stub de InfluxDB en un hilo de fondo"""
+
+    def __init__(self, host="127.0.0.1", port=0, status_code=204, latency_s=0.0, observador=None):
+        self.status_code = status_code
+        self.latency_s = latency_s
+        # Callback opcional (cuerpo descomprimido) por escritura, bajo el lock del stub
+        self.observador = observador
+        self.requests = 0
+        self.lines = 0
+        self.bytes = 0
+        self.last_body = None
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                if stub.latency_s:
+                    threading.Event().wait(stub.latency_s)
+                with stub._lock:
+                    stub.requests += 1
+                    stub.lines += body.count(b"\n") + 1 if body else 0
+                    stub.bytes += len(body)
+                    stub.last_body = body
+                    if stub.observador is not None:
+                        stub.observador(body)
+                self.send_response(stub.status_code)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="influx-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def get_stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'lines': self.lines, 'bytes': self.bytes}
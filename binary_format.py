@@ -0,0 +1,170 @@
+"""
+Formato binario compacto para las lecturas del tracker.
+
+Alternativa a JSON para /sensor_values y /sensor_values/batch, negociada
+por Content-Type (CONTENT_TYPE). Cada registro es una estructura de
+disposición fija, little-endian y sin relleno, que el ESP32 rellena sin
+serializador:
+
+    offset  tipo     campo
+    0       uint8    versión (VERSION)
+    1       uint8    flags: bit0 at_limit_h, bit1 at_limit_v,
+                            bit2 hay BME280, bit3 hay age_ms
+    2       uint8    n = longitud de device_id (0 = "unknown")
+    3       n bytes  device_id en UTF-8
+    3+n     uint16   ldr_tl, ldr_tr, ldr_bl, ldr_br
+            uint8    servo_h, servo_v
+            float32  panel_voltage (NaN = sin medida)
+    [BME]   float32  bme_temp_c, bme_press_hpa, bme_hum_pct, bme_alt_m
+    [AGE]   uint32   age_ms (antigüedad respecto a la recepción)
+
+Con device_id de 10 caracteres un registro ocupa 27 bytes (43 con BME280)
+frente a ~200 en JSON. Un cuerpo puede llevar varios registros seguidos
+(lotes). El decodificador devuelve dicts con las mismas claves que el JSON,
+así que la validación y los tipos los aplica el mismo código en ambos casos
+(servidor_flask.normalizar_lectura).
+"""
+
+import struct
+
+
+CONTENT_TYPE = "application/x-solar-tracker"
+VERSION = 1
+
+FLAG_LIMIT_H = 0x01
+FLAG_LIMIT_V = 0x02
+FLAG_BME = 0x04
+FLAG_AGE = 0x08
+
+_CABECERA = struct.Struct("<BBB")
+_FIJO = struct.Struct("<4H2Bf")
+_BME = struct.Struct("<4f")
+_AGE = struct.Struct("<I")
+
+
+class FormatoBinarioError(ValueError):
+    """Cuerpo binario truncado, con versión desconocida o mal formado"""
+
+
+def codificar_lectura(lectura):
+    """
+    Codifica una lectura (dict con las claves del JSON) en un registro.
+
+    Raises:
+        struct.error: si algún valor no cabe en su tipo
+    """
+    device_id = str(lectura.get("device_id", "")).encode("utf-8")
+    if len(device_id) > 255:
+        raise FormatoBinarioError("device_id de más de 255 bytes")
+    bme = lectura.get("bme_temp_c") is not None
+    age = lectura.get("age_ms") is not None
+    flags = ((FLAG_LIMIT_H if lectura.get("at_limit_h") else 0)
+             | (FLAG_LIMIT_V if lectura.get("at_limit_v") else 0)
+             | (FLAG_BME if bme else 0)
+             | (FLAG_AGE if age else 0))
+    partes = [
+        _CABECERA.pack(VERSION, flags, len(device_id)), device_id,
+        _FIJO.pack(int(lectura.get("ldr_tl", 0)), int(lectura.get("ldr_tr", 0)),
+                   int(lectura.get("ldr_bl", 0)), int(lectura.get("ldr_br", 0)),
+                   int(lectura.get("servo_h", 0)), int(lectura.get("servo_v", 0)),
+                   float(lectura.get("panel_voltage", float("nan"))))
+    ]
+    if bme:
+        partes.append(_BME.pack(*(float(lectura.get(k) if lectura.get(k) is not None else float("nan"))
+                                  for k in ("bme_temp_c", "bme_press_hpa", "bme_hum_pct", "bme_alt_m"))))
+    if age:
+        partes.append(_AGE.pack(int(lectura["age_ms"])))
+    return b"".join(partes)
+
+
+def registros(cuerpo):
+    """
+    Separa un cuerpo en sus registros sin decodificar los valores (p. ej. para
+    repartir un lote entre procesos).
+
+    Returns:
+        list: (device_id, bytes del registro completo)
+
+    Raises:
+        FormatoBinarioError: cuerpo vacío, truncado o de otra versión
+    """
+    cuerpo = bytes(cuerpo)
+    total = len(cuerpo)
+    if not total:
+        raise FormatoBinarioError("cuerpo binario vacío")
+
+    partes = []
+    off = 0
+    while off < total:
+        if off + 3 > total:
+            raise FormatoBinarioError(f"registro truncado en el byte {off}")
+        version, flags, n = _CABECERA.unpack_from(cuerpo, off)
+        if version != VERSION:
+            raise FormatoBinarioError(f"versión {version} no soportada (se espera {VERSION})")
+        fin = off + 3 + n + _FIJO.size \
+            + (_BME.size if flags & FLAG_BME else 0) + (_AGE.size if flags & FLAG_AGE else 0)
+        if fin > total:
+            raise FormatoBinarioError(f"registro truncado en el byte {off + 3}")
+        try:
+            device_id = cuerpo[off + 3:off + 3 + n].decode("utf-8") if n else "unknown"
+        except UnicodeDecodeError:
+            raise FormatoBinarioError("device_id no es UTF-8 válido") from None
+        partes.append((device_id, cuerpo[off:fin]))
+        off = fin
+    return partes
+
+
+def decodificar(cuerpo):
+    """
+    Decodifica uno o varios registros seguidos.
+
+    Returns:
+        list: dicts con las claves del JSON (device_id, ldr_*, servo_*,
+            at_limit_*, panel_voltage y, si vienen, bme_* y age_ms)
+
+    Raises:
+        FormatoBinarioError: cuerpo vacío, truncado o de otra versión
+    """
+    cuerpo = memoryview(cuerpo)
+    total = len(cuerpo)
+    if not total:
+        raise FormatoBinarioError("cuerpo binario vacío")
+
+    lecturas = []
+    off = 0
+    cabecera = _CABECERA.unpack_from
+    fijo = _FIJO.unpack_from
+    while off < total:
+        if off + 3 > total:
+            raise FormatoBinarioError(f"registro truncado en el byte {off}")
+        version, flags, n = cabecera(cuerpo, off)
+        if version != VERSION:
+            raise FormatoBinarioError(f"versión {version} no soportada (se espera {VERSION})")
+        off += 3
+        fin = off + n + _FIJO.size \
+            + (_BME.size if flags & FLAG_BME else 0) + (_AGE.size if flags & FLAG_AGE else 0)
+        if fin > total:
+            raise FormatoBinarioError(f"registro truncado en el byte {off}")
+        try:
+            device_id = bytes(cuerpo[off:off + n]).decode("utf-8") if n else "unknown"
+        except UnicodeDecodeError:
+            raise FormatoBinarioError("device_id no es UTF-8 válido") from None
+        off += n
+        tl, tr, bl, br, servo_h, servo_v, voltaje = fijo(cuerpo, off)
+        off += _FIJO.size
+        lectura = {
+            "device_id": device_id,
+            "ldr_tl": tl, "ldr_tr": tr, "ldr_bl": bl, "ldr_br": br,
+            "servo_h": servo_h, "servo_v": servo_v,
+            "at_limit_h": bool(flags & FLAG_LIMIT_H), "at_limit_v": bool(flags & FLAG_LIMIT_V),
+            "panel_voltage": voltaje
+        }
+        if flags & FLAG_BME:
+            (lectura["bme_temp_c"], lectura["bme_press_hpa"],
+             lectura["bme_hum_pct"], lectura["bme_alt_m"]) = _BME.unpack_from(cuerpo, off)
+            off += _BME.size
+        if flags & FLAG_AGE:
+            lectura["age_ms"] = _AGE.unpack_from(cuerpo, off)[0]
+            off += _AGE.size
+        lecturas.append(lectura)
+    return lecturas
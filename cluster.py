@@ -0,0 +1,392 @@
+"""
+Modo de producción multi-proceso con afinidad por dispositivo.
+
+El estado de cada tracker (integral del PID, modelos River, snapshots) vive
+en memoria del proceso que lo atiende, así que repartir peticiones al azar
+entre procesos lo corrompería. Este módulo arranca N procesos backend, cada
+uno con su propia instancia de servidor_flask, y un router WSGI sin estado
+que envía cada petición al backend dueño del dispositivo:
+
+    backend = blake2b(device_id) % N
+
+El mismo device_id siempre cae en el mismo proceso, y cada backend escribe
+los snapshots de sus dispositivos en el directorio compartido sin pisarse.
+
+El device_id se toma de la cabecera X-Device-Id, del parámetro ?device_id=
+o, si no, del cuerpo (JSON, o la cabecera del registro binario). Un lote de
+/sensor_values/batch con dispositivos de varios backends se reparte: cada
+backend recibe solo las lecturas de sus dispositivos y las respuestas se
+combinan en una. Las rutas sin dispositivo (/metrics, /influx_stats, ...) van
+al backend indicado en ?worker=i (0 por defecto).
+
+Uso:
+    python cluster.py serve --workers 4 --port 6000
+    # o el router bajo gunicorn, con los backends ya arrancados:
+    CLUSTER_BACKENDS=127.0.0.1:6001,127.0.0.1:6002 gunicorn -w 2 --threads 16 -b 0.0.0.0:6000 cluster:router_app
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from http import HTTPStatus
+from urllib.parse import parse_qs
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import binary_format
+
+
+_DEVICE_RE = re.compile(rb'"device_id"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+RUTA_LOTE = "/sensor_values/batch"
+# Mismo límite que el backend: un lote mayor se le envía entero para que lo rechace (413)
+BATCH_MAX_READINGS = int(os.environ.get('BATCH_MAX_READINGS', '1000'))
+
+# Cabeceras que no se reenvían (hop-by-hop o recalculadas)
+_HOP_BY_HOP = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+               "te", "trailers", "transfer-encoding", "upgrade", "content-length", "host"}
+
+
+def backend_para(device_id, n_backends):
+    """Índice del backend dueño de un dispositivo (estable entre reinicios)"""
+    # blake2b y no crc32: crc32 es lineal y ids casi iguales ("dev0", "dev1")
+    # comparten los bits bajos, lo que concentra dispositivos en un backend
+    digest = hashlib.blake2b(str(device_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % n_backends
+
+
+def _tipo(environ):
+    return (environ.get("CONTENT_TYPE") or "").split(";")[0].strip().lower()
+
+
+def extraer_device_id(environ, body):
+    """device_id de cabecera, query string o cuerpo (sin parsear el JSON completo)"""
+    device_id = environ.get("HTTP_X_DEVICE_ID")
+    if device_id:
+        return device_id
+    qs = parse_qs(environ.get("QUERY_STRING", ""))
+    if "device_id" in qs:
+        return qs["device_id"][0]
+    if _tipo(environ) == binary_format.CONTENT_TYPE:
+        # Registro binario: longitud del device_id en el byte 2 y el id a continuación
+        if len(body) < 3:
+            return None
+        n = body[2]
+        try:
+            return body[3:3 + n].decode("utf-8") if n else "unknown"
+        except UnicodeDecodeError:
+            return None
+    m = _DEVICE_RE.search(body)
+    if m:
+        try:
+            return json.loads(b'"' + m.group(1) + b'"')
+        except ValueError:
+            return m.group(1).decode("utf-8", "replace")
+    return None
+
+
+def partir_lote(environ, body, n_backends):
+    """
+    Reparte un cuerpo de /sensor_values/batch por backend dueño de cada lectura,
+    en el mismo formato que llegó (JSON, NDJSON o binario).
+
+    Returns:
+        tuple: (partes, ultimo) con partes = {backend: cuerpo} y ultimo = backend
+        del último dispositivo del lote, cuya respuesta es la que devuelve el
+        backend; None si el cuerpo no se puede interpretar o supera
+        BATCH_MAX_READINGS (se reenvía entero y lo rechaza el backend)
+    """
+    tipo = _tipo(environ)
+    try:
+        if tipo == binary_format.CONTENT_TYPE:
+            lecturas = binary_format.registros(body)
+            unir = b"".join
+        elif tipo in ("application/x-ndjson", "application/jsonl"):
+            lineas = [l for l in body.splitlines() if l.strip()]
+            lecturas = [(json.loads(l).get("device_id", "unknown"), l) for l in lineas]
+            unir = b"\n".join
+        else:
+            cuerpo = json.loads(body) if body.strip() else []
+            defecto = "unknown"
+            if isinstance(cuerpo, dict):
+                defecto = cuerpo.get("device_id", defecto)
+                cuerpo = cuerpo.get("readings", [])
+            # El device_id por defecto del objeto pasa a cada lectura (las partes van como lista)
+            lecturas = [(l.get("device_id", defecto), {"device_id": defecto, **l}) for l in cuerpo]
+
+            def unir(partes):
+                return json.dumps(partes).encode("utf-8")
+    except (ValueError, AttributeError, TypeError):
+        return None
+    if not lecturas or len(lecturas) > BATCH_MAX_READINGS:
+        return None
+
+    grupos = {}
+    orden = {}
+    for device_id, lectura in lecturas:
+        idx = backend_para(device_id, n_backends)
+        grupos.setdefault(idx, []).append(lectura)
+        orden.setdefault(device_id, idx)
+    # El backend agrupa por dispositivo en orden de aparición y responde con el último grupo
+    ultimo = orden[next(reversed(orden))]
+    return {idx: unir(partes) for idx, partes in grupos.items()}, ultimo
+
+
+def combinar_respuestas(respuestas, ultimo):
+    """
+    Una sola respuesta para un lote repartido entre backends: la del backend
+    `ultimo` (comando de servos del último dispositivo) con `processed` sumado
+    y status "ok" solo si todas las partes lo son. Si alguna parte falló se
+    devuelve su error; las demás partes ya se procesaron.
+
+    Args:
+        respuestas: {backend: requests.Response}
+
+    Returns:
+        tuple: (código HTTP, cuerpo JSON en bytes)
+    """
+    for idx in sorted(respuestas):
+        r = respuestas[idx]
+        if r.status_code >= 300:
+            return r.status_code, r.content
+    cuerpos = {idx: r.json() for idx, r in respuestas.items()}
+    final = cuerpos[ultimo]
+    if isinstance(final, list):
+        # Respuesta compacta: [ok, servo_h, servo_v, fast_interval_ms, fast_duration_ms]
+        ok = all(c[0] == 1 for c in cuerpos.values())
+        final = [1 if ok else 0] + final[1:]
+    else:
+        ok = all(c.get("status") == "ok" for c in cuerpos.values())
+        final = {**final, "status": "ok" if ok else "error",
+                 "processed": sum(c.get("processed", 0) for c in cuerpos.values())}
+    return 200, json.dumps(final).encode("utf-8")
+
+
+class RouterApp:
+    """Router WSGI sin estado: reenvía cada petición al backend dueño"""
+
+    def __init__(self, backends, timeout=(2.0, 30.0), pool_size=64):
+        if not backends:
+            raise ValueError("se necesita al menos un backend")
+        self.backends = [b if b.startswith("http") else f"http://{b}" for b in backends]
+        self.timeout = timeout
+
+        # Una sesión con pool keep-alive por backend
+        self._sesiones = []
+        for _ in self.backends:
+            sesion = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            sesion.mount("http://", adapter)
+            self._sesiones.append(sesion)
+
+    def elegir(self, environ, body):
+        path = environ.get("PATH_INFO", "")
+        device_id = extraer_device_id(environ, body)
+        if device_id is not None:
+            return backend_para(device_id, len(self.backends))
+        # /devices/<id>/... lleva el dispositivo en la ruta
+        partes = path.strip("/").split("/")
+        if len(partes) >= 2 and partes[0] == "devices":
+            return backend_para(partes[1], len(self.backends))
+        qs = parse_qs(environ.get("QUERY_STRING", ""))
+        try:
+            return int(qs.get("worker", ["0"])[0]) % len(self.backends)
+        except ValueError:
+            return 0
+
+    def __call__(self, environ, start_response):
+        try:
+            largo = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            largo = 0
+        body = environ["wsgi.input"].read(largo) if largo else b""
+
+        if environ.get("PATH_INFO") == RUTA_LOTE and environ.get("REQUEST_METHOD") == "POST":
+            reparto = partir_lote(environ, body, len(self.backends))
+            if reparto is not None and len(reparto[0]) > 1:
+                return self._lote(environ, start_response, *reparto)
+            idx = next(iter(reparto[0])) if reparto is not None else self.elegir(environ, body)
+        else:
+            idx = self.elegir(environ, body)
+
+        try:
+            r = self._reenviar(idx, environ, body)
+        except requests.RequestException as e:
+            return self._error_backend(start_response, idx, e)
+
+        contenido = r.content
+        cabeceras = [(k, v) for k, v in r.headers.items()
+                     if k.lower() not in _HOP_BY_HOP and k.lower() != "content-encoding"]
+        cabeceras.append(("Content-Length", str(len(contenido))))
+        cabeceras.append(("X-Backend", str(idx)))
+        start_response(f"{r.status_code} {r.reason}", cabeceras)
+        return [contenido]
+
+    def _lote(self, environ, start_response, partes, ultimo):
+        """Lote con dispositivos de varios backends: una parte por dueño (en serie)"""
+        respuestas = {}
+        for idx, cuerpo in partes.items():
+            try:
+                respuestas[idx] = self._reenviar(idx, environ, cuerpo)
+            except requests.RequestException as e:
+                return self._error_backend(start_response, idx, e)
+        codigo, contenido = combinar_respuestas(respuestas, ultimo)
+        start_response(f"{codigo} {HTTPStatus(codigo).phrase}", [
+            ("Content-Type", "application/json"),
+            ("Content-Length", str(len(contenido))),
+            ("X-Backend", ",".join(str(idx) for idx in sorted(partes)))
+        ])
+        return [contenido]
+
+    def _reenviar(self, idx, environ, body):
+        url = self.backends[idx] + environ.get("PATH_INFO", "")
+        if environ.get("QUERY_STRING"):
+            url += "?" + environ["QUERY_STRING"]
+
+        headers = {}
+        for k, v in environ.items():
+            if k.startswith("HTTP_"):
+                nombre = k[5:].replace("_", "-").lower()
+                if nombre not in _HOP_BY_HOP:
+                    headers[nombre] = v
+        if environ.get("CONTENT_TYPE"):
+            headers["content-type"] = environ["CONTENT_TYPE"]
+        return self._sesiones[idx].request(environ["REQUEST_METHOD"], url, data=body or None,
+                                           headers=headers, timeout=self.timeout)
+
+    @staticmethod
+    def _error_backend(start_response, idx, e):
+        payload = json.dumps({"status": "error", "msg": f"backend {idx} no disponible: {e!r}"}).encode()
+        start_response("502 Bad Gateway", [("Content-Type", "application/json"),
+                                           ("Content-Length", str(len(payload)))])
+        return [payload]
+
+
+def _router_desde_entorno():
+    backends = [b.strip() for b in os.environ.get("CLUSTER_BACKENDS", "").split(",") if b.strip()]
+    return RouterApp(backends) if backends else None
+
+
+# Punto de entrada para gunicorn: cluster:router_app
+router_app = _router_desde_entorno()
+
+
+def _comando_backend(port, threads, usar_gunicorn):
+    if usar_gunicorn:
+        return [sys.executable, "-m", "gunicorn", "-w", "1", "--threads", str(threads),
+                "-b", f"127.0.0.1:{port}", "--log-level", "warning", "wsgi:app"]
+    return [sys.executable, os.path.abspath(__file__), "backend", "--port", str(port)]
+
+
+def _esperar_backend(port, timeout_s=60.0):
+    limite = time.monotonic() + timeout_s
+    while time.monotonic() < limite:
+        try:
+            # /ready responde 503 mientras el backend importa y calienta River
+            if requests.get(f"http://127.0.0.1:{port}/ready", timeout=1).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def serve(workers, port, backend_base_port, threads, usar_gunicorn):
+    """Arranca los backends, los supervisa y sirve el router en `port`"""
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class _SinLog(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    puertos = [backend_base_port + i for i in range(workers)]
+    procesos = {}
+
+    def lanzar(i):
+        env = dict(os.environ, CLUSTER_WORKER_ID=str(i))
+        procesos[i] = subprocess.Popen(_comando_backend(puertos[i], threads, usar_gunicorn),
+                                       cwd=directorio, env=env)
+
+    for i in range(workers):
+        lanzar(i)
+    for p in puertos:
+        if not _esperar_backend(p):
+            print(f"[CLUSTER] el backend en {p} no arrancó")
+
+    router = RouterApp([f"127.0.0.1:{p}" for p in puertos])
+    server = make_server("0.0.0.0", port, router, threaded=True, request_handler=_SinLog)
+
+    def parar(*_):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, parar)
+
+    hilo = threading.Thread(target=server.serve_forever, name="cluster-router", daemon=True)
+    hilo.start()
+    print(f"[CLUSTER] router en :{port} -> {workers} backends {puertos}")
+
+    try:
+        # Supervisión: relanzar backends caídos (su estado se recupera de los snapshots)
+        while True:
+            time.sleep(1.0)
+            for i, proc in list(procesos.items()):
+                if proc.poll() is not None:
+                    print(f"[CLUSTER] backend {i} terminó con código {proc.returncode}; relanzando")
+                    lanzar(i)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        for proc in procesos.values():
+            proc.terminate()
+        for proc in procesos.values():
+            try:
+                proc.wait(15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor multi-proceso con afinidad por device_id")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_serve = sub.add_parser("serve", help="arranca router + backends")
+    p_serve.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    p_serve.add_argument("--port", type=int, default=6000)
+    p_serve.add_argument("--backend-base-port", type=int, default=6101)
+    p_serve.add_argument("--threads", type=int, default=16, help="hilos por backend")
+    p_serve.add_argument("--sin-gunicorn", action="store_true",
+                         help="usar el servidor WSGI de werkzeug en los backends")
+
+    p_backend = sub.add_parser("backend", help="un backend (uso interno)")
+    p_backend.add_argument("--port", type=int, required=True)
+
+    args = parser.parse_args(argv)
+
+    if args.comando == "backend":
+        from werkzeug.serving import run_simple
+        from servidor_flask import app
+        run_simple("127.0.0.1", args.port, app, threaded=True, use_reloader=False)
+        return 0
+
+    usar_gunicorn = not args.sin_gunicorn
+    if usar_gunicorn:
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            usar_gunicorn = False
+    serve(args.workers, args.port, args.backend_base_port, args.threads, usar_gunicorn)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
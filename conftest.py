@@ -0,0 +1 @@
+# Presente para que pytest añada la raíz del proyecto a sys.path (tests/ importa los módulos del servidor)
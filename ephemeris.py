@@ -0,0 +1,342 @@
+"""
+Posición solar y avance (feed-forward) para el PID del tracker.
+
+El PID solo corrige con la diferencia entre LDR y como mucho 10° por
+muestra: tras un arranque, una nube larga o el amanecer necesita muchas
+ida y vuelta (en modo rápido de 400 ms) para llegar al sol. Conociendo la
+posición del tracker y cómo está montado, el ángulo de los servos que mira
+al sol se calcula de antemano:
+
+    - posicion_solar: acimut/elevación con las fórmulas de la NOAA
+      (precisión ~0.5°, de sobra para servos de 1°)
+    - TablaSolar: tabla diaria por sitio (un punto por minuto, interpolada),
+      compartida por todos los trackers del mismo sitio y día
+    - Montaje: de acimut/elevación a ángulos de servo (lineal y configurable)
+    - AvanceSolar: combina ese punto de consigna con el PID de cada dispositivo
+
+El avance no sustituye al PID, se reparte el trabajo con él por eje:
+
+    - lejos del punto de consigna y sin LDR que lo contradigan, el comando
+      salta directamente allí y el PID afina desde ese punto
+    - con los LDR alineados y buena luz, el comando sigue a la consigna en
+      lugar de a los pasos de ±2° con que el PID responde al ruido, que son
+      los que mantenían al tracker en modo rápido
+    - en el resto de casos manda el PID
+
+Mientras el tracker está alineado se aprende por dispositivo el desvío entre
+su posición y el modelo, así que un montaje algo torcido se corrige solo.
+"""
+
+import collections
+import math
+import threading
+
+import numpy as np
+
+from pid_controller import DevicePIDController
+
+
+def _posicion_solar(lat, lon, ts):
+    """acimut (0 = norte, 90 = este) y elevación en grados; ts en segundos epoch (escalar o array)"""
+    ts = np.asarray(ts, dtype=np.float64)
+    jc = (ts / 86400.0 + 2440587.5 - 2451545.0) / 36525.0
+    l0 = np.radians((280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360.0)
+    m = np.radians(357.52911 + jc * (35999.05029 - 0.0001537 * jc))
+    e = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+    centro = (np.sin(m) * (1.914602 - jc * (0.004817 + 0.000014 * jc))
+              + np.sin(2 * m) * (0.019993 - 0.000101 * jc) + np.sin(3 * m) * 0.000289)
+    omega = np.radians(125.04 - 1934.136 * jc)
+    longitud_aparente = np.radians(np.degrees(l0) + centro - 0.00569 - 0.00478 * np.sin(omega))
+    oblicuidad = np.radians(23.0 + (26.0 + (21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))) / 60.0) / 60.0
+                            + 0.00256 * np.cos(omega))
+    declinacion = np.arcsin(np.sin(oblicuidad) * np.sin(longitud_aparente))
+
+    y = np.tan(oblicuidad / 2) ** 2
+    ecuacion_tiempo = 4.0 * np.degrees(
+        y * np.sin(2 * l0) - 2 * e * np.sin(m) + 4 * e * y * np.sin(m) * np.cos(2 * l0)
+        - 0.5 * y * y * np.sin(4 * l0) - 1.25 * e * e * np.sin(2 * m))          # minutos
+    tiempo_solar = ((ts % 86400.0) / 60.0 + ecuacion_tiempo + 4.0 * lon) % 1440.0
+    angulo_horario = np.radians(tiempo_solar / 4.0 - 180.0)
+
+    phi = math.radians(lat)
+    cos_zenit = (math.sin(phi) * np.sin(declinacion)
+                 + math.cos(phi) * np.cos(declinacion) * np.cos(angulo_horario))
+    elevacion = 90.0 - np.degrees(np.arccos(np.clip(cos_zenit, -1.0, 1.0)))
+    acimut = (np.degrees(np.arctan2(np.sin(angulo_horario),
+                                    np.cos(angulo_horario) * math.sin(phi)
+                                    - np.tan(declinacion) * math.cos(phi))) + 180.0) % 360.0
+    return acimut, elevacion
+
+
+def posicion_solar(lat, lon, ts):
+    """
+    Posición del sol en un instante.
+
+    Args:
+        lat, lon: grados (norte y este positivos)
+        ts: segundos epoch (UTC)
+
+    Returns:
+        tuple: (acimut, elevación) en grados; acimut desde el norte hacia el este
+    """
+    acimut, elevacion = _posicion_solar(lat, lon, ts)
+    return float(acimut), float(elevacion)
+
+
+class TablaSolar:
+    """
+    Tablas diarias de acimut/elevación por sitio, en LRU.
+
+    Cada tabla cubre un día UTC con un punto cada `paso_s` y se interpola
+    linealmente (el acimut, desenrollado para no cruzar 360°). Los sitios se
+    redondean a 0.01° (~1 km), así que los trackers de una instalación
+    comparten tabla.
+
+    Args:
+        paso_s: separación entre puntos de la tabla
+        max_tablas: tablas (sitio, día) en memoria
+    """
+
+    def __init__(self, paso_s=60, max_tablas=64):
+        self.paso_s = int(paso_s)
+        self.max_tablas = int(max_tablas)
+        self._tablas = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.calculadas = 0
+
+    def _tabla(self, lat, lon, dia):
+        clave = (round(lat, 2), round(lon, 2), dia)
+        with self._lock:
+            tabla = self._tablas.get(clave)
+            if tabla is not None:
+                self._tablas.move_to_end(clave)
+                return tabla
+        ts = dia * 86400.0 + np.arange(0, 86400 + self.paso_s, self.paso_s, dtype=np.float64)
+        acimut, elevacion = _posicion_solar(clave[0], clave[1], ts)
+        # Listas: el acceso escalar por índice es más barato que en arrays
+        tabla = (np.degrees(np.unwrap(np.radians(acimut))).tolist(), elevacion.tolist())
+        with self._lock:
+            self._tablas[clave] = tabla
+            self.calculadas += 1
+            while len(self._tablas) > self.max_tablas:
+                self._tablas.popitem(last=False)
+        return tabla
+
+    def posicion(self, lat, lon, ts):
+        """(acimut, elevación) en grados para ts en segundos epoch"""
+        dia, segundos = divmod(ts, 86400.0)
+        acimut, elevacion = self._tabla(lat, lon, int(dia))
+        i, fraccion = divmod(segundos / self.paso_s, 1.0)
+        i = int(i)
+        az = acimut[i] + (acimut[i + 1] - acimut[i]) * fraccion
+        el = elevacion[i] + (elevacion[i + 1] - elevacion[i]) * fraccion
+        return float(az % 360.0), float(el)
+
+    def __len__(self):
+        return len(self._tablas)
+
+
+_LIMITES_PID = DevicePIDController(None)
+
+
+class Montaje:
+    """
+    Sitio y geometría de un tracker: de acimut/elevación a ángulos de servo.
+
+        servo_h = h_centro + escala_h * (acimut - acimut_centro)
+        servo_v = v_horizonte + escala_v * elevación
+
+    Con los valores por defecto el servo horizontal está centrado al sur
+    (al norte en el hemisferio sur) y crece hacia el oeste, y el vertical
+    apunta al horizonte en 180 y al cénit en 90.
+
+    Args:
+        lat, lon: grados
+        acimut_centro: acimut al que mira el panel con servo_h = h_centro (None = ecuador)
+        h_centro: ángulo del servo horizontal mirando a acimut_centro
+        escala_h: grados de servo por grado de acimut (negativo si gira al revés)
+        v_horizonte: ángulo del servo vertical mirando al horizonte
+        escala_v: grados de servo por grado de elevación
+        limites: (min_h, max_h, min_v, max_v); por defecto los del PID
+    """
+
+    def __init__(self, lat, lon, acimut_centro=None, h_centro=110, escala_h=1.0,
+                 v_horizonte=180, escala_v=-1.0, limites=None):
+        self.lat = float(lat)
+        self.lon = float(lon)
+        self.acimut_centro = float(acimut_centro if acimut_centro is not None else (180.0 if lat >= 0 else 0.0))
+        self.h_centro = float(h_centro)
+        self.escala_h = float(escala_h)
+        self.v_horizonte = float(v_horizonte)
+        self.escala_v = float(escala_v)
+        self.limites = tuple(limites) if limites else (
+            _LIMITES_PID.limiteMinH, _LIMITES_PID.limiteMaxH, _LIMITES_PID.limiteMinV, _LIMITES_PID.limiteMaxV)
+
+    def servos(self, acimut, elevacion):
+        """Ángulos (h, v) sin limitar que apuntan a (acimut, elevación)"""
+        # Diferencia de acimut en -180..180 respecto al centro
+        d = (acimut - self.acimut_centro + 180.0) % 360.0 - 180.0
+        return self.h_centro + self.escala_h * d, self.v_horizonte + self.escala_v * elevacion
+
+
+class _EstadoAvance:
+    __slots__ = ("desvio_h", "desvio_v", "alineaciones")
+
+    def __init__(self):
+        self.desvio_h = 0.0
+        self.desvio_v = 0.0
+        self.alineaciones = 0
+
+
+class AvanceSolar:
+    """
+    Punto de consigna solar combinado con el PID de cada dispositivo.
+
+    Args:
+        montaje: callable device_id -> Montaje, o None si el dispositivo no tiene modelo
+        tabla: TablaSolar compartida
+        elevacion_min: por debajo (noche, amanecer) solo actúa el PID
+        salto_min: grados entre la posición y la consigna a partir de los que se salta
+        error_alineado: |diferencia LDR| por debajo de la que el tracker mira al sol
+        luz_alineado: luz media mínima para fiarse de los LDR (sin nubes)
+        alpha_desvio: suavizado del desvío aprendido entre modelo y PID
+        desvio_max: desvío máximo entre modelo y posición alineada; uno mayor se descarta
+    """
+
+    def __init__(self, montaje, tabla=None, elevacion_min=3.0, salto_min=8, error_alineado=80,
+                 luz_alineado=800, alpha_desvio=0.2, desvio_max=30.0):
+        self.montaje = montaje
+        self.tabla = tabla if tabla is not None else TablaSolar()
+        self.elevacion_min = float(elevacion_min)
+        self.salto_min = float(salto_min)
+        self.error_alineado = float(error_alineado)
+        self.luz_alineado = float(luz_alineado)
+        self.alpha_desvio = float(alpha_desvio)
+        self.desvio_max = float(desvio_max)
+        self._estados = {}
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.aplicados = 0
+        self.saltos = 0
+        self.seguimientos = 0
+
+    def _estado(self, device_id):
+        estado = self._estados.get(device_id)
+        if estado is None:
+            with self._lock:
+                estado = self._estados.setdefault(device_id, _EstadoAvance())
+        return estado
+
+    def _aprender(self, desvio, observado, alineaciones):
+        if abs(observado) > self.desvio_max:
+            # Incompatible con el montaje configurado: luz difusa o LDR tapados, no alineación
+            return desvio
+        if not alineaciones:
+            return observado
+        return desvio + self.alpha_desvio * (observado - desvio)
+
+    def ajustar(self, device_id, ts_ms, actual_h, actual_v, nuevo_h, nuevo_v, diff_h, diff_v, luz_media):
+        """
+        Combina el comando del PID con la consigna solar. Con el lock del
+        dispositivo tomado (como el PID).
+
+        Args:
+            actual_h, actual_v: posición informada por el tracker
+            nuevo_h, nuevo_v: comando del PID
+            diff_h, diff_v: diferencias LDR del PID (izquierda - derecha, arriba - abajo)
+            luz_media: media de los 4 LDR
+
+        Returns:
+            tuple: (h, v, info) con info = None si el avance no aplica
+        """
+        montaje = self.montaje(device_id)
+        if montaje is None:
+            return nuevo_h, nuevo_v, None
+        acimut, elevacion = self.tabla.posicion(montaje.lat, montaje.lon, ts_ms / 1000.0)
+        if elevacion < self.elevacion_min:
+            return nuevo_h, nuevo_v, None
+
+        modelo_h, modelo_v = montaje.servos(acimut, elevacion)
+        estado = self._estado(device_id)
+        luz_fiable = luz_media >= self.luz_alineado
+        alineado_h = luz_fiable and abs(diff_h) <= self.error_alineado
+        alineado_v = luz_fiable and abs(diff_v) <= self.error_alineado
+        if alineado_h:
+            estado.desvio_h = self._aprender(estado.desvio_h, actual_h - modelo_h, estado.alineaciones)
+        if alineado_v:
+            estado.desvio_v = self._aprender(estado.desvio_v, actual_v - modelo_v, estado.alineaciones)
+        if alineado_h and alineado_v:
+            estado.alineaciones += 1
+
+        min_h, max_h, min_v, max_v = montaje.limites
+        consigna_h = int(round(max(min_h, min(max_h, modelo_h + estado.desvio_h))))
+        consigna_v = int(round(max(min_v, min(max_v, modelo_v + estado.desvio_v))))
+
+        # El PID mueve h en el sentido de diff_h y v en el contrario de diff_v (vertical invertido)
+        calibrado = estado.alineaciones > 0
+        h, modo_h = self._eje(consigna_h, actual_h, nuevo_h, diff_h, alineado_h, luz_fiable, calibrado)
+        v, modo_v = self._eje(consigna_v, actual_v, nuevo_v, -diff_v, alineado_v, luz_fiable, calibrado)
+
+        self.aplicados += 1
+        if "jump" in (modo_h, modo_v):
+            self.saltos += 1
+        elif "follow" in (modo_h, modo_v):
+            self.seguimientos += 1
+        return h, v, {
+            'azimuth': round(acimut, 2),
+            'elevation': round(elevacion, 2),
+            'setpoint_h': consigna_h,
+            'setpoint_v': consigna_v,
+            'mode_h': modo_h,
+            'mode_v': modo_v
+        }
+
+    def _eje(self, consigna, actual, nuevo, sentido_pid, alineado, luz_fiable, calibrado):
+        """
+        Comando de un eje: "jump" a la consigna si está lejos, "follow" de la
+        consigna si el eje está alineado y el desvío ya se aprendió, o "pid".
+        `sentido_pid` tiene el signo con el que el PID movería el servo.
+        """
+        d = consigna - actual
+        if abs(d) >= self.salto_min:
+            # Con buena luz, unos LDR que apuntan claramente al lado opuesto mandan sobre el modelo
+            if luz_fiable and not alineado and d * sentido_pid < 0:
+                return nuevo, "pid"
+            return consigna, "jump"
+        if alineado and calibrado:
+            # Mirando al sol: el modelo avanza 1° cada pocos minutos, mientras
+            # que el PID reacciona al ruido de los LDR con pasos de ±2°
+            return consigna, "follow"
+        return nuevo, "pid"
+
+    def get_state(self, device_id):
+        estado = self._estados.get(device_id)
+        if estado is None:
+            return None
+        return {'desvio_h': estado.desvio_h, 'desvio_v': estado.desvio_v, 'alineaciones': estado.alineaciones}
+
+    def set_state(self, device_id, datos):
+        if not datos:
+            return
+        estado = self._estado(device_id)
+        estado.desvio_h = float(datos.get('desvio_h', 0.0))
+        estado.desvio_v = float(datos.get('desvio_v', 0.0))
+        estado.alineaciones = int(datos.get('alineaciones', 0))
+
+    def olvidar(self, device_id):
+        with self._lock:
+            self._estados.pop(device_id, None)
+
+    def __len__(self):
+        return len(self._estados)
+
+    def get_stats(self):
+        return {
+            'solar_devices': len(self._estados),
+            'solar_tables': len(self.tabla),
+            'solar_tables_computed': self.tabla.calculadas,
+            'solar_applied': self.aplicados,
+            'solar_jumps': self.saltos,
+            'solar_follows': self.seguimientos
+        }
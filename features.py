@@ -0,0 +1,158 @@
+"""
+Motor de características derivadas de las lecturas LDR.
+
+Una sola definición de las características (promedios por cuadrante,
+normalización 0-100, varianza, hora/minuto) compartida por la petición
+individual, la ingesta por lotes y el replay offline:
+
+- calcular_caracteristicas_lote: pasada vectorizada con NumPy sobre un
+  array (N, 4) de LDRs [tl, tr, bl, br] más columnas de servos y tiempo.
+- caracteristicas_muestra: misma fórmula para una única lectura. Usa
+  escalares de Python porque para N=1 el coste fijo de NumPy es mayor que
+  el cálculo en sí.
+"""
+
+import time
+
+import numpy as np
+
+
+# Características que consume el modelo de eficiencia (no cambiar sin reentrenar)
+MODEL_KEYS = ('avg_light', 'max_light', 'min_light', 'light_variance',
+              'servo_h', 'servo_v', 'hour', 'minute')
+
+LDR_COLUMNAS = ('tl', 'tr', 'bl', 'br')
+
+
+def caracteristicas_muestra(ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v, ts=None):
+    """
+    Calcula todas las características derivadas de una lectura.
+
+    Args:
+        ts: epoch en segundos de la lectura (None = ahora)
+
+    Returns:
+        dict: características del modelo + promedios por cuadrante y LDR normalizados
+    """
+    avg_light = (ldr_tl + ldr_tr + ldr_bl + ldr_br) / 4.0
+    light_variance = ((ldr_tl - avg_light)**2 + (ldr_tr - avg_light)**2 +
+                      (ldr_bl - avg_light)**2 + (ldr_br - avg_light)**2) / 4.0
+
+    # Normalizar lecturas LDR a escala 0-100
+    # 50 = promedio, <50 = más oscuro, >50 = más brillante
+    if avg_light > 0:
+        escala = 50.0 / avg_light
+        norm_tl = max(0, min(100, 50 + (ldr_tl - avg_light) * escala))
+        norm_tr = max(0, min(100, 50 + (ldr_tr - avg_light) * escala))
+        norm_bl = max(0, min(100, 50 + (ldr_bl - avg_light) * escala))
+        norm_br = max(0, min(100, 50 + (ldr_br - avg_light) * escala))
+    else:
+        norm_tl = norm_tr = norm_bl = norm_br = 50.0
+
+    lt = time.localtime(ts)
+
+    return {
+        'avg_light': avg_light,
+        'max_light': max(ldr_tl, ldr_tr, ldr_bl, ldr_br),
+        'min_light': min(ldr_tl, ldr_tr, ldr_bl, ldr_br),
+        'light_variance': light_variance,
+        'servo_h': servo_h,
+        'servo_v': servo_v,
+        'hour': lt.tm_hour,
+        'minute': lt.tm_min,
+        'ldr_arriba': (ldr_tl + ldr_tr) / 2.0,
+        'ldr_abajo': (ldr_bl + ldr_br) / 2.0,
+        'ldr_izquierda': (ldr_tl + ldr_bl) / 2.0,
+        'ldr_derecha': (ldr_tr + ldr_br) / 2.0,
+        'norm_tl': norm_tl,
+        'norm_tr': norm_tr,
+        'norm_bl': norm_bl,
+        'norm_br': norm_br
+    }
+
+
+def features_modelo(caracteristicas):
+    """Subconjunto de características que entra al modelo de eficiencia"""
+    return {k: caracteristicas[k] for k in MODEL_KEYS}
+
+
+def _hora_minuto_lote(ts):
+    """Hora y minuto locales para un array de epochs en segundos"""
+    ts = np.asarray(ts, dtype=np.float64)
+    if ts.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    # Desplazamiento UTC en los extremos; si coincide (sin cambio de horario
+    # dentro del lote) se aplica a todo el lote de golpe
+    off_ini = time.localtime(float(ts.min())).tm_gmtoff
+    off_fin = time.localtime(float(ts.max())).tm_gmtoff
+    if off_ini == off_fin:
+        local_min = np.floor((ts + off_ini) / 60.0).astype(np.int64)
+        return (local_min // 60) % 24, local_min % 60
+
+    lts = [time.localtime(float(t)) for t in ts]
+    return (np.fromiter((lt.tm_hour for lt in lts), dtype=np.int64, count=len(lts)),
+            np.fromiter((lt.tm_min for lt in lts), dtype=np.int64, count=len(lts)))
+
+
+def calcular_caracteristicas_lote(ldr, servo_h, servo_v, ts=None):
+    """
+    Calcula en una pasada vectorizada las características de N lecturas.
+
+    Args:
+        ldr: array (N, 4) con columnas [tl, tr, bl, br]
+        servo_h, servo_v: arrays (N,) con las posiciones de los servos
+        ts: array (N,) de epochs en segundos (None = ahora para todas)
+
+    Returns:
+        dict: mismas claves que caracteristicas_muestra, con arrays (N,)
+    """
+    ldr = np.asarray(ldr, dtype=np.float64)
+    if ldr.ndim != 2 or ldr.shape[1] != 4:
+        raise ValueError("ldr debe tener forma (N, 4)")
+    n = ldr.shape[0]
+
+    if ts is None:
+        ts = np.full(n, time.time())
+
+    avg = ldr.mean(axis=1)
+    dev = ldr - avg[:, None]
+    variance = (dev * dev).mean(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        norm = 50.0 + dev * (50.0 / avg)[:, None]
+    norm = np.where((avg > 0)[:, None], np.clip(norm, 0.0, 100.0), 50.0)
+
+    hour, minute = _hora_minuto_lote(ts)
+    tl, tr, bl, br = ldr[:, 0], ldr[:, 1], ldr[:, 2], ldr[:, 3]
+
+    return {
+        'avg_light': avg,
+        'max_light': ldr.max(axis=1),
+        'min_light': ldr.min(axis=1),
+        'light_variance': variance,
+        'servo_h': np.asarray(servo_h, dtype=np.float64),
+        'servo_v': np.asarray(servo_v, dtype=np.float64),
+        'hour': hour,
+        'minute': minute,
+        'ldr_arriba': (tl + tr) / 2.0,
+        'ldr_abajo': (bl + br) / 2.0,
+        'ldr_izquierda': (tl + bl) / 2.0,
+        'ldr_derecha': (tr + br) / 2.0,
+        'norm_tl': norm[:, 0],
+        'norm_tr': norm[:, 1],
+        'norm_bl': norm[:, 2],
+        'norm_br': norm[:, 3]
+    }
+
+
+def filas(lote):
+    """
+    Recorre un lote como dicts de escalares de Python (mismo formato que
+    caracteristicas_muestra), convirtiendo cada columna una sola vez.
+    """
+    columnas = {k: v.tolist() for k, v in lote.items()}
+    claves = list(columnas.keys())
+    valores = [columnas[k] for k in claves]
+    for fila in zip(*valores):
+        yield dict(zip(claves, fila))
@@ -0,0 +1,221 @@
+"""
+Historial reciente en memoria por dispositivo (buffer circular sobre NumPy).
+
+Cada dispositivo tiene un array (capacidad x columnas) de float64 donde se
+sobrescribe la muestra más antigua: memoria fija por dispositivo y ninguna
+asignación por lectura. Las consultas copian la ventana pedida en orden
+cronológico y la devuelven por columnas (una lista por campo), que es lo que
+consumen los dashboards; con `cada` o `bucket_ms` se reduce en el servidor.
+
+Los dispositivos se guardan en LRU por última escritura hasta `max_dispositivos`.
+"""
+
+import collections
+import threading
+
+import numpy as np
+
+
+# Orden de las columnas de cada fila; NaN = valor ausente
+COLUMNAS = (
+    "ts_ms", "servo_h", "servo_v", "ldr_tl", "ldr_tr", "ldr_bl", "ldr_br",
+    "avg_light", "panel_voltage", "cmd_h", "cmd_v",
+    "voltage_predicted", "voltage_error", "anomaly_score", "is_anomaly",
+    "drift_detected", "env_state_id", "fast_interval_ms",
+)
+_INDICE = {c: i for i, c in enumerate(COLUMNAS)}
+# Columnas de conteo: al reducir por bucket se suman en lugar de promediarse
+_SUMABLES = ("is_anomaly", "drift_detected")
+
+
+class _Anillo:
+    __slots__ = ("datos", "pos", "n", "lock")
+
+    def __init__(self, capacidad):
+        self.datos = np.full((capacidad, len(COLUMNAS)), np.nan)
+        self.pos = 0
+        self.n = 0
+        self.lock = threading.Lock()
+
+    def ordenado(self):
+        """Copia de las filas válidas en orden cronológico. Con self.lock tomado"""
+        if self.n < len(self.datos):
+            return self.datos[:self.n].copy()
+        return np.concatenate((self.datos[self.pos:], self.datos[:self.pos]))
+
+
+class HistorialReciente:
+    """
+    Buffers circulares de las últimas `capacidad` muestras de cada dispositivo.
+
+    Args:
+        capacidad: muestras por dispositivo
+        max_dispositivos: dispositivos en memoria (LRU por última escritura)
+    """
+
+    def __init__(self, capacidad=512, max_dispositivos=256):
+        self.capacidad = int(capacidad)
+        self.max_dispositivos = int(max_dispositivos)
+        self._anillos = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.expulsados = 0
+
+    def agregar(self, device_id, fila):
+        """Añade una muestra (tupla en el orden de COLUMNAS, None = ausente)"""
+        with self._lock:
+            anillo = self._anillos.get(device_id)
+            if anillo is None:
+                anillo = self._anillos[device_id] = _Anillo(self.capacidad)
+                while len(self._anillos) > self.max_dispositivos:
+                    self._anillos.popitem(last=False)
+                    self.expulsados += 1
+            else:
+                self._anillos.move_to_end(device_id)
+        with anillo.lock:
+            anillo.datos[anillo.pos] = [np.nan if v is None else v for v in fila]
+            anillo.pos = (anillo.pos + 1) % self.capacidad
+            if anillo.n < self.capacidad:
+                anillo.n += 1
+
+    def olvidar(self, device_id):
+        with self._lock:
+            self._anillos.pop(device_id, None)
+
+    def dispositivos(self):
+        """{device_id: (muestras, ts_ms de la última)}"""
+        with self._lock:
+            anillos = list(self._anillos.items())
+        resultado = {}
+        for device_id, anillo in anillos:
+            with anillo.lock:
+                ultima = anillo.datos[(anillo.pos - 1) % self.capacidad, 0] if anillo.n else np.nan
+                resultado[device_id] = (anillo.n, None if ultima != ultima else int(ultima))
+        return resultado
+
+    def ventana(self, device_id, desde_ms=None, limite=None):
+        """
+        Filas en orden cronológico (array n x len(COLUMNAS)), o None si el
+        dispositivo no tiene historial.
+
+        Args:
+            desde_ms: solo muestras con ts_ms >= desde_ms
+            limite: como mucho las `limite` más recientes
+        """
+        with self._lock:
+            anillo = self._anillos.get(device_id)
+        if anillo is None:
+            return None
+        with anillo.lock:
+            filas = anillo.ordenado()
+        if desde_ms is not None:
+            # ts_ms crece salvo lotes atrasados: máscara en lugar de búsqueda binaria
+            filas = filas[filas[:, 0] >= desde_ms]
+        if limite is not None and limite >= 0:
+            filas = filas[len(filas) - min(limite, len(filas)):]
+        return filas
+
+    def recientes(self, device_id, desde_ms=None, limite=None, campos=None, cada=None, bucket_ms=None):
+        """
+        Historial por columnas: {"ts_ms": [...], "servo_h": [...], ...}.
+
+        Args:
+            campos: columnas a devolver (ts_ms siempre incluida); None = todas
+            cada: quedarse con una de cada N muestras (la más reciente de cada grupo)
+            bucket_ms: media por intervalos de bucket_ms (suma en is_anomaly y
+                drift_detected); ts_ms pasa a ser el inicio de cada intervalo
+
+        Returns:
+            dict, o None si el dispositivo no tiene historial
+
+        Raises:
+            KeyError: si algún campo no existe
+        """
+        filas = self.ventana(device_id, desde_ms, limite)
+        if filas is None:
+            return None
+        indices = list(range(len(COLUMNAS))) if not campos else \
+            [0] + [_INDICE[c] for c in campos if c != "ts_ms"]
+
+        if bucket_ms:
+            filas = _reducir(filas, int(bucket_ms))
+        elif cada and cada > 1:
+            filas = filas[(len(filas) - 1) % cada::cada]
+
+        columnas = filas[:, indices]
+        # NaN no es JSON válido: None en su lugar
+        validos = ~np.isnan(columnas)
+        resultado = {}
+        for j, i in enumerate(indices):
+            valores = columnas[:, j].tolist()
+            if not validos[:, j].all():
+                valores = [v if ok else None for v, ok in zip(valores, validos[:, j].tolist())]
+            resultado[COLUMNAS[i]] = valores
+        resultado["ts_ms"] = [int(t) for t in resultado["ts_ms"]]
+        return resultado
+
+    def resumen(self, device_id, desde_ms=None):
+        """
+        Estadísticas sobre el historial en memoria: muestras, intervalo cubierto,
+        y por columna mín/media/máx/última (ignorando ausentes).
+
+        Returns:
+            dict, o None si el dispositivo no tiene historial
+        """
+        filas = self.ventana(device_id, desde_ms)
+        if filas is None:
+            return None
+        if not len(filas):
+            return {'samples': 0}
+        ts = filas[:, 0]
+        campos = {}
+        for i, nombre in enumerate(COLUMNAS[1:], start=1):
+            columna = filas[:, i]
+            validos = columna[~np.isnan(columna)]
+            if not len(validos):
+                continue
+            campos[nombre] = {
+                'min': float(validos.min()),
+                'mean': float(validos.mean()),
+                'max': float(validos.max()),
+                'last': float(validos[-1])
+            }
+        return {
+            'samples': len(filas),
+            'first_ts_ms': int(ts.min()),
+            'last_ts_ms': int(ts.max()),
+            'anomalies': int(np.nansum(filas[:, _INDICE["is_anomaly"]])),
+            'drifts': int(np.nansum(filas[:, _INDICE["drift_detected"]])),
+            'fields': campos
+        }
+
+    def __len__(self):
+        return len(self._anillos)
+
+    def get_stats(self):
+        return {
+            'history_devices': len(self._anillos),
+            'history_capacity': self.capacidad,
+            'history_max_devices': self.max_dispositivos,
+            'history_evicted': self.expulsados,
+            'history_bytes': len(self._anillos) * self.capacidad * len(COLUMNAS) * 8
+        }
+
+
+def _reducir(filas, bucket_ms):
+    """Media por intervalos de bucket_ms (suma en las columnas de conteo)"""
+    if not len(filas):
+        return filas
+    filas = filas[np.argsort(filas[:, 0], kind="stable")]
+    inicio = filas[:, 0] - filas[:, 0] % bucket_ms
+    cortes = np.flatnonzero(np.diff(inicio)) + 1
+    limites = np.concatenate(([0], cortes))
+    validos = ~np.isnan(filas)
+    sumas = np.add.reduceat(np.where(validos, filas, 0.0), limites, axis=0)
+    cuentas = np.add.reduceat(validos, limites, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        medias = sumas / cuentas
+    for nombre in _SUMABLES:
+        i = _INDICE[nombre]
+        medias[:, i] = np.where(cuentas[:, i] > 0, sumas[:, i], np.nan)
+    medias[:, 0] = inicio[limites]
+    return medias
@@ -0,0 +1,366 @@
+"""
+Escritura por lotes hacia InfluxDB para el servidor asyncio (servidor_asgi.py).
+
+Misma semántica que InfluxBatchWriter (influx_writer.py): cola acotada con
+política de desborde, lotes por cantidad o antigüedad, gzip, reintentos con
+backoff, circuit breaker y spool en disco. La diferencia es que el envío lo
+hace una tarea del event loop con un cliente aiohttp no bloqueante, así que
+una escritura lenta no ocupa ningún hilo.
+
+put() se puede llamar desde cualquier hilo (los handlers ejecutan el PID y
+River en un executor); la tarea de vaciado se despierta con
+call_soon_threadsafe solo cuando la cola deja de estar vacía o completa un
+lote. Las operaciones del spool son E/S de disco y van al executor por defecto.
+"""
+
+import asyncio
+import collections
+import gzip
+import threading
+import time
+
+import aiohttp
+
+from influx_writer import CircuitBreaker, CircuitOpenError
+
+
+# Misma forma que lo que usan los handlers de requests.Response
+RespuestaInflux = collections.namedtuple("RespuestaInflux", ("status_code", "text"))
+
+
+class AsyncInfluxHTTPClient:
+    """Cliente aiohttp persistente para /api/v2/write"""
+
+    def __init__(self, write_url, headers, pool_size=10, connect_timeout=2.0, read_timeout=5.0,
+                 breaker=None):
+        self.write_url = write_url
+        self.headers = dict(headers)
+        self.pool_size = int(pool_size)
+        self.timeout = aiohttp.ClientTimeout(sock_connect=float(connect_timeout),
+                                             sock_read=float(read_timeout))
+        self.breaker = breaker or CircuitBreaker()
+        # La sesión se crea dentro del event loop (start)
+        self.session = None
+
+    async def start(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                headers=self.headers,
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            )
+        return self
+
+    async def write(self, body, headers=None):
+        """
+        Envía un cuerpo de line protocol.
+
+        Returns:
+            RespuestaInflux
+
+        Raises:
+            CircuitOpenError: si el breaker no permite el intento
+            aiohttp.ClientError, asyncio.TimeoutError: error de red o timeout
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"InfluxDB no disponible, reintento en {self.breaker.retry_after():.1f} s")
+        try:
+            async with self.session.post(self.write_url, data=body, headers=headers) as r:
+                respuesta = RespuestaInflux(r.status, await r.text())
+        except BaseException:
+            # Cualquier error, también la cancelación de la tarea: si era la
+            # prueba de HALF_OPEN, el breaker debe volver a OPEN
+            self.breaker.record_failure()
+            raise
+        # 5xx y 429 cuentan como caída; un 4xx es un problema de los datos, no del servidor
+        if respuesta.status_code >= 500 or respuesta.status_code == 429:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return respuesta
+
+    def get_stats(self):
+        return {
+            'breaker_state': self.breaker.state,
+            'breaker_failures': self.breaker.failures,
+            'breaker_times_opened': self.breaker.times_opened
+        }
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+class AsyncInfluxBatchWriter:
+    """Cola acotada en memoria + tarea asyncio que vacía los lotes hacia InfluxDB"""
+
+    POLITICAS_DESBORDE = ("drop_oldest", "drop_newest")
+
+    def __init__(self, client, batch_size=500, flush_interval_s=1.0,
+                 max_queue=10000, overflow_policy="drop_oldest", max_retries=3,
+                 backoff_base_s=0.5, backoff_max_s=10.0, gzip_enabled=True, spool=None,
+                 replay_batch_size=5000):
+        if overflow_policy not in self.POLITICAS_DESBORDE:
+            raise ValueError(f"overflow_policy debe ser uno de {self.POLITICAS_DESBORDE}")
+
+        self.client = client
+        self.batch_size = int(batch_size)
+        self.flush_interval_s = float(flush_interval_s)
+        self.max_queue = int(max_queue)
+        self.overflow_policy = overflow_policy
+        self.max_retries = int(max_retries)
+        self.backoff_base_s = float(backoff_base_s)
+        self.backoff_max_s = float(backoff_max_s)
+        self.gzip_enabled = gzip_enabled
+        self.spool = spool
+        self.replay_batch_size = int(replay_batch_size)
+
+        # Callback opcional (n_lineas, segundos, ok) tras cada envío de lote
+        self.flush_observer = None
+
+        self._buffer = collections.deque()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._hilo_loop = None
+        self._despertar = None
+        self._parando = False
+        self._task = None
+
+        # Métricas
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches_sent = 0
+        self.retries = 0
+        self.last_error = None
+        self.last_flush_ts = None
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    async def start(self):
+        """Arranca la tarea de vaciado en el event loop actual (idempotente)"""
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            self._hilo_loop = threading.get_ident()
+            self._despertar = asyncio.Event()
+            self._parando = False
+            await self.client.start()
+            self._task = self._loop.create_task(self._run(), name="influx-writer")
+        return self
+
+    async def stop(self, timeout=10.0):
+        """Detiene la tarea tras vaciar lo que quede en la cola"""
+        self._parando = True
+        if self._task is not None:
+            self._despertar.set()
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._task = None
+        if self.spool is not None:
+            await self._en_executor(self.spool.close)
+        await self.client.close()
+
+    def put(self, line):
+        """
+        Encola una línea de line protocol sin bloquear (desde cualquier hilo).
+
+        Returns:
+            bool: True si la línea quedó encolada
+        """
+        with self._lock:
+            if len(self._buffer) >= self.max_queue:
+                if self.overflow_policy == "drop_newest":
+                    self.dropped += 1
+                    return False
+                # drop_oldest: descartar el registro más antiguo
+                self._buffer.popleft()
+                self.dropped += 1
+            self._buffer.append(line)
+            self.enqueued += 1
+            n = len(self._buffer)
+        if n == 1 or n == self.batch_size:
+            self._avisar()
+        return True
+
+    def put_many(self, lines):
+        """Encola varias líneas; devuelve cuántas se aceptaron"""
+        return sum(1 for line in lines if self.put(line))
+
+    def queue_depth(self):
+        return len(self._buffer)
+
+    def get_stats(self):
+        """Retorna métricas actuales del escritor"""
+        return {
+            **self.client.get_stats(),
+            **(self.spool.get_stats() if self.spool is not None else {}),
+            'queue_depth': self.queue_depth(),
+            'queue_max': self.max_queue,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'written': self.written,
+            'failed': self.failed,
+            'batches_sent': self.batches_sent,
+            'retries': self.retries,
+            'last_error': self.last_error,
+            'last_flush_ts': self.last_flush_ts
+        }
+
+    # ------------------------------------------------------------------
+    # Tarea de vaciado
+    # ------------------------------------------------------------------
+    def _avisar(self):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            if threading.get_ident() == self._hilo_loop:
+                self._despertar.set()
+            else:
+                loop.call_soon_threadsafe(self._despertar.set)
+        except RuntimeError:
+            # Loop cerrándose: la línea queda en la cola hasta stop()
+            pass
+
+    async def _en_executor(self, funcion, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, funcion, *args)
+
+    def _sacar(self, n):
+        with self._lock:
+            return [self._buffer.popleft() for _ in range(min(n, len(self._buffer)))]
+
+    async def _run(self):
+        lote = []
+        inicio_lote = None
+        reenviando = False
+
+        while True:
+            # Esperar como mucho lo que le queda al lote actual por antigüedad;
+            # sin espera mientras se está vaciando el spool
+            if reenviando or self._parando:
+                espera = 0.0
+            elif inicio_lote is None:
+                espera = self.flush_interval_s
+            else:
+                espera = max(0.0, self.flush_interval_s - (time.monotonic() - inicio_lote))
+
+            # clear() antes de mirar la cola: un put() posterior vuelve a despertarla
+            self._despertar.clear()
+            if espera > 0 and not self._buffer:
+                try:
+                    await asyncio.wait_for(self._despertar.wait(), espera)
+                except asyncio.TimeoutError:
+                    pass
+
+            nuevas = self._sacar(self.batch_size - len(lote))
+            if nuevas:
+                if inicio_lote is None:
+                    inicio_lote = time.monotonic()
+                lote.extend(nuevas)
+
+            vencido = inicio_lote is not None and (time.monotonic() - inicio_lote) >= self.flush_interval_s
+            if lote and (len(lote) >= self.batch_size or vencido or self._parando):
+                await self._flush(lote)
+                lote = []
+                inicio_lote = None
+
+            reenviando = not self._parando and await self._reenviar_spool()
+
+            if self._parando and not self._buffer and not lote:
+                break
+
+    async def _flush(self, lote):
+        if self.spool is not None and self.spool.pendiente():
+            # Hay atrasos en disco: encolar detrás de ellos para conservar el orden
+            if not await self._en_executor(self.spool.append, lote):
+                self.failed += len(lote)
+                print("[INFLUX] lote descartado: spool lleno")
+            return False
+
+        # Con spool no se reintenta en línea: a disco y se sigue vaciando la cola
+        resultado = await self._enviar(lote, 0 if self.spool is not None else self.max_retries)
+        if resultado == "ok":
+            return True
+        if resultado == "reintentable" and self.spool is not None:
+            if await self._en_executor(self.spool.append, lote):
+                return False
+        self.failed += len(lote)
+        print("[INFLUX] lote descartado:", self.last_error)
+        return False
+
+    async def _enviar(self, lote, max_retries):
+        """
+        Envía un lote con reintentos y backoff.
+
+        Returns:
+            str: "ok", "reintentable" (InfluxDB caído) o "rechazado" (4xx)
+        """
+        body = "\n".join(lote).encode("utf-8")
+        headers = None
+        if self.gzip_enabled:
+            body = gzip.compress(body, compresslevel=5)
+            headers = {"Content-Encoding": "gzip"}
+
+        intento = 0
+        while True:
+            inicio = time.perf_counter()
+            try:
+                r = await self.client.write(body, headers=headers)
+                if self.flush_observer:
+                    self.flush_observer(len(lote), time.perf_counter() - inicio, r.status_code == 204)
+                if r.status_code == 204:
+                    self.written += len(lote)
+                    self.batches_sent += 1
+                    self.last_flush_ts = time.time()
+                    return "ok"
+                self.last_error = f"HTTP {r.status_code}: {r.text[:200]}"
+                # 4xx (salvo 429) no mejora reintentando: datos o credenciales inválidos
+                if r.status_code != 429 and r.status_code < 500:
+                    return "rechazado"
+            except CircuitOpenError as e:
+                # Sin llamada de red: esperar a que el breaker permita otra prueba
+                self.last_error = str(e)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if self.flush_observer:
+                    self.flush_observer(len(lote), time.perf_counter() - inicio, False)
+                self.last_error = repr(e)
+
+            if intento >= max_retries or self._parando:
+                return "reintentable"
+
+            espera = min(self.backoff_max_s,
+                         max(self.backoff_base_s * (2 ** intento), self.client.breaker.retry_after()))
+            intento += 1
+            self.retries += 1
+            await asyncio.sleep(espera)
+
+    async def _reenviar_spool(self):
+        """
+        Reenvía un bloque del spool si InfluxDB parece disponible.
+
+        Returns:
+            bool: True si se avanzó y quedan líneas pendientes
+        """
+        if self.spool is None or not self.spool.pendiente():
+            return False
+        if self.client.breaker.retry_after() > 0:
+            return False
+
+        lines, token = await self._en_executor(self.spool.leer_lote, self.replay_batch_size)
+        if not lines:
+            # Segmento vacío o con una línea truncada: avanzar igualmente
+            await self._en_executor(self.spool.confirmar, token)
+            return self.spool.pendiente()
+
+        resultado = await self._enviar(lines, 0)
+        if resultado == "reintentable":
+            return False
+        if resultado == "rechazado":
+            self.failed += len(lines)
+            print("[SPOOL] bloque rechazado por InfluxDB:", self.last_error)
+        await self._en_executor(self.spool.confirmar, token)
+        return self.spool.pendiente()
@@ -0,0 +1,386 @@
+"""
+Escritura asíncrona por lotes hacia InfluxDB (API v2, line protocol).
+
+El handler de Flask solo encola la línea y responde de inmediato; un hilo
+de fondo agrupa los registros por cantidad o por antigüedad y los envía en
+una sola llamada a /api/v2/write, comprimida con gzip y con reintentos.
+
+Todas las escrituras pasan por InfluxHTTPClient: una requests.Session con
+pool de conexiones keep-alive, timeouts de conexión/lectura separados y un
+circuit breaker que deja de insistir mientras InfluxDB está caído.
+
+Con un WriteAheadSpool (spool.py), los lotes que no se pueden entregar se
+guardan en disco en lugar de descartarse y se reenvían en orden cuando
+InfluxDB se recupera; el handler sigue sin esperar a la red.
+"""
+
+import gzip
+import queue
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class CircuitOpenError(Exception):
+    """El circuit breaker está abierto: no se intenta la escritura"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker clásico: CLOSED -> OPEN tras `failure_threshold` fallos
+    seguidos; tras `reset_timeout_s` pasa a HALF_OPEN y deja pasar una
+    petición de prueba que lo cierra (éxito) o lo vuelve a abrir (fallo).
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout_s=30.0):
+        self.failure_threshold = int(failure_threshold)
+        self.reset_timeout_s = float(reset_timeout_s)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout_s:
+                self.state = self.HALF_OPEN
+                return True
+            # OPEN dentro de la ventana, o HALF_OPEN con la prueba ya en curso
+            return False
+
+    def retry_after(self):
+        """Segundos hasta que se permita el siguiente intento"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout_s - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class InfluxHTTPClient:
+    """Cliente HTTP persistente para /api/v2/write"""
+
+    def __init__(self, write_url, headers, pool_size=10, connect_timeout=2.0, read_timeout=5.0,
+                 breaker=None):
+        self.write_url = write_url
+        self.timeout = (float(connect_timeout), float(read_timeout))
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        # Las cabeceras fijas viajan en la sesión, no se reconstruyen por llamada
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=int(pool_size), max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def write(self, body, headers=None):
+        """
+        Envía un cuerpo de line protocol.
+
+        Returns:
+            requests.Response
+
+        Raises:
+            CircuitOpenError: si el breaker no permite el intento
+            requests.RequestException: error de red o timeout
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"InfluxDB no disponible, reintento en {self.breaker.retry_after():.1f} s")
+        try:
+            r = self.session.post(self.write_url, data=body, headers=headers, timeout=self.timeout)
+        except Exception:
+            # Cualquier error cuenta: si era la prueba de HALF_OPEN, el breaker
+            # debe volver a OPEN en lugar de quedarse esperando una respuesta
+            self.breaker.record_failure()
+            raise
+        # 5xx y 429 cuentan como caída; un 4xx es un problema de los datos, no del servidor
+        if r.status_code >= 500 or r.status_code == 429:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return r
+
+    def get_stats(self):
+        return {
+            'breaker_state': self.breaker.state,
+            'breaker_failures': self.breaker.failures,
+            'breaker_times_opened': self.breaker.times_opened
+        }
+
+    def close(self):
+        self.session.close()
+
+
+class InfluxBatchWriter:
+    """Cola acotada en memoria + hilo que vacía los lotes hacia InfluxDB"""
+
+    POLITICAS_DESBORDE = ("drop_oldest", "drop_newest")
+
+    def __init__(self, client, batch_size=500, flush_interval_s=1.0,
+                 max_queue=10000, overflow_policy="drop_oldest", max_retries=3,
+                 backoff_base_s=0.5, backoff_max_s=10.0, gzip_enabled=True, spool=None,
+                 replay_batch_size=5000):
+        if overflow_policy not in self.POLITICAS_DESBORDE:
+            raise ValueError(f"overflow_policy debe ser uno de {self.POLITICAS_DESBORDE}")
+
+        self.client = client
+        self.batch_size = int(batch_size)
+        self.flush_interval_s = float(flush_interval_s)
+        self.overflow_policy = overflow_policy
+        self.max_retries = int(max_retries)
+        self.backoff_base_s = float(backoff_base_s)
+        self.backoff_max_s = float(backoff_max_s)
+        self.gzip_enabled = gzip_enabled
+        self.spool = spool
+        self.replay_batch_size = int(replay_batch_size)
+
+        # Callback opcional (n_lineas, segundos, ok) tras cada envío de lote
+        self.flush_observer = None
+
+        self._queue = queue.Queue(maxsize=int(max_queue))
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Métricas
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches_sent = 0
+        self.retries = 0
+        self.last_error = None
+        self.last_flush_ts = None
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    def start(self):
+        """Arranca el hilo de vaciado (idempotente)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="influx-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=10.0):
+        """Detiene el hilo tras vaciar lo que quede en la cola"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self.spool is not None:
+            self.spool.close()
+
+    def put(self, line):
+        """
+        Encola una línea de line protocol sin bloquear.
+
+        Returns:
+            bool: True si la línea quedó encolada
+        """
+        try:
+            self._queue.put_nowait(line)
+            self.enqueued += 1
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow_policy == "drop_newest":
+            self.dropped += 1
+            return False
+
+        # drop_oldest: descartar el registro más antiguo y reintentar una vez
+        try:
+            self._queue.get_nowait()
+            self.dropped += 1
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(line)
+            self.enqueued += 1
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def put_many(self, lines):
+        """Encola varias líneas; devuelve cuántas se aceptaron"""
+        return sum(1 for line in lines if self.put(line))
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def get_stats(self):
+        """Retorna métricas actuales del escritor"""
+        return {
+            **self.client.get_stats(),
+            **(self.spool.get_stats() if self.spool is not None else {}),
+            'queue_depth': self.queue_depth(),
+            'queue_max': self._queue.maxsize,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'written': self.written,
+            'failed': self.failed,
+            'batches_sent': self.batches_sent,
+            'retries': self.retries,
+            'last_error': self.last_error,
+            'last_flush_ts': self.last_flush_ts
+        }
+
+    # ------------------------------------------------------------------
+    # Hilo de vaciado
+    # ------------------------------------------------------------------
+    def _run(self):
+        lote = []
+        inicio_lote = None
+        reenviando = False
+
+        while True:
+            # Esperar como mucho lo que le queda al lote actual por antigüedad;
+            # sin espera mientras se está vaciando el spool
+            if reenviando:
+                espera = 0.0
+            elif inicio_lote is None:
+                espera = self.flush_interval_s
+            else:
+                espera = max(0.0, self.flush_interval_s - (time.monotonic() - inicio_lote))
+
+            try:
+                line = self._queue.get(timeout=espera) if espera > 0 else self._queue.get_nowait()
+                if inicio_lote is None:
+                    inicio_lote = time.monotonic()
+                lote.append(line)
+                # Vaciar de golpe lo que ya esté disponible
+                while len(lote) < self.batch_size:
+                    try:
+                        lote.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+            except queue.Empty:
+                pass
+
+            vencido = inicio_lote is not None and (time.monotonic() - inicio_lote) >= self.flush_interval_s
+            if lote and (len(lote) >= self.batch_size or vencido or self._stop.is_set()):
+                self._flush(lote)
+                lote = []
+                inicio_lote = None
+
+            reenviando = not self._stop.is_set() and self._reenviar_spool()
+
+            if self._stop.is_set() and self._queue.empty() and not lote:
+                break
+
+    def _flush(self, lote):
+        if self.spool is not None and self.spool.pendiente():
+            # Hay atrasos en disco: encolar detrás de ellos para conservar el orden
+            if not self.spool.append(lote):
+                self.failed += len(lote)
+                print("[INFLUX] lote descartado: spool lleno")
+            return False
+
+        # Con spool no se reintenta en línea: a disco y se sigue vaciando la cola
+        resultado = self._enviar(lote, 0 if self.spool is not None else self.max_retries)
+        if resultado == "ok":
+            return True
+        if resultado == "reintentable" and self.spool is not None:
+            if self.spool.append(lote):
+                return False
+        self.failed += len(lote)
+        print("[INFLUX] lote descartado:", self.last_error)
+        return False
+
+    def _enviar(self, lote, max_retries):
+        """
+        Envía un lote con reintentos y backoff.
+
+        Returns:
+            str: "ok", "reintentable" (InfluxDB caído) o "rechazado" (4xx)
+        """
+        body = "\n".join(lote).encode("utf-8")
+        headers = None
+        if self.gzip_enabled:
+            body = gzip.compress(body, compresslevel=5)
+            headers = {"Content-Encoding": "gzip"}
+
+        intento = 0
+        while True:
+            inicio = time.perf_counter()
+            try:
+                r = self.client.write(body, headers=headers)
+                if self.flush_observer:
+                    self.flush_observer(len(lote), time.perf_counter() - inicio, r.status_code == 204)
+                if r.status_code == 204:
+                    self.written += len(lote)
+                    self.batches_sent += 1
+                    self.last_flush_ts = time.time()
+                    return "ok"
+                # 4xx (salvo 429) no mejora reintentando: datos o credenciales inválidos
+                if r.status_code != 429 and r.status_code < 500:
+                    self.last_error = f"HTTP {r.status_code}: {r.text[:200]}"
+                    return "rechazado"
+                self.last_error = f"HTTP {r.status_code}: {r.text[:200]}"
+            except CircuitOpenError as e:
+                # Sin llamada de red: esperar a que el breaker permita otra prueba
+                self.last_error = str(e)
+            except requests.RequestException as e:
+                if self.flush_observer:
+                    self.flush_observer(len(lote), time.perf_counter() - inicio, False)
+                self.last_error = repr(e)
+
+            if intento >= max_retries or self._stop.is_set():
+                return "reintentable"
+
+            espera = min(self.backoff_max_s,
+                         max(self.backoff_base_s * (2 ** intento), self.client.breaker.retry_after()))
+            intento += 1
+            self.retries += 1
+            time.sleep(espera)
+
+    def _reenviar_spool(self):
+        """
+        Reenvía un bloque del spool si InfluxDB parece disponible.
+
+        Returns:
+            bool: True si se avanzó y quedan líneas pendientes
+        """
+        if self.spool is None or not self.spool.pendiente():
+            return False
+        if self.client.breaker.retry_after() > 0:
+            return False
+
+        lines, token = self.spool.leer_lote(self.replay_batch_size)
+        if not lines:
+            # Segmento vacío o con una línea truncada: avanzar igualmente
+            self.spool.confirmar(token)
+            return self.spool.pendiente()
+
+        resultado = self._enviar(lines, 0)
+        if resultado == "reintentable":
+            return False
+        if resultado == "rechazado":
+            self.failed += len(lines)
+            print("[SPOOL] bloque rechazado por InfluxDB:", self.last_error)
+        self.spool.confirmar(token)
+        return self.spool.pendiente()
@@ -0,0 +1,207 @@
+"""
+Aprendizaje de los modelos River fuera del camino de la petición.
+
+Con RiverAnalyzer.aprendizaje_diferido la petición solo predice y puntúa
+(predict_one / score_one) con el modelo publicado y devuelve un evento de
+aprendizaje; este módulo lo encola y un hilo de fondo lo aplica:
+
+    - cada dispositivo va siempre al mismo hilo (crc32(device_id) % hilos),
+      así que sus eventos se aplican en orden de llegada sin más locks
+    - cada hilo despierta como mucho una vez cada `intervalo_s` y aplica
+      juntos los eventos pendientes de cada dispositivo: el modelo se publica
+      una vez por tanda (RiverAnalyzer.aprender_diferido)
+    - el retraso está acotado: como mucho `max_pendientes` eventos por
+      dispositivo; al llenarse se descarta el más antiguo (drop_oldest) o la
+      petición espera a que haya sitio (block, con `espera_max_s`)
+
+River es Python puro y comparte el GIL con las peticiones: los hilos no
+añaden CPU, pero sacan el coste de learn_one de la latencia de cada tracker.
+"""
+
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+
+
+class _Hilo:
+    """Cola por dispositivo (en orden de llegada) de un hilo del pool"""
+    __slots__ = ("colas", "cond", "thread")
+
+    def __init__(self):
+        self.colas = OrderedDict()
+        self.cond = threading.Condition()
+        self.thread = None
+
+
+class LearnerPool:
+    """
+    Pool de hilos que aplica los eventos de aprendizaje por dispositivo.
+
+    Args:
+        resolver: función device_id -> entrada del registro (con .analyzer y
+            .lock) o None si el dispositivo ya no está en memoria
+        hilos: número de hilos de aprendizaje
+        max_pendientes: eventos pendientes como máximo por dispositivo
+        intervalo_s: espera mínima entre pasadas de un hilo; agrupa eventos en
+            tandas (menos cambios de hilo con el GIL) a costa de ese retraso
+        overflow_policy: "drop_oldest" o "block"
+        espera_max_s: con "block", espera máxima antes de descartar el evento
+    """
+
+    POLITICAS_DESBORDE = ("drop_oldest", "block")
+
+    def __init__(self, resolver, hilos=2, max_pendientes=256, intervalo_s=0.05,
+                 overflow_policy="drop_oldest", espera_max_s=1.0):
+        if overflow_policy not in self.POLITICAS_DESBORDE:
+            raise ValueError(f"overflow_policy debe ser uno de {self.POLITICAS_DESBORDE}")
+        self.resolver = resolver
+        self.max_pendientes = max(1, int(max_pendientes))
+        self.intervalo_s = float(intervalo_s)
+        self.overflow_policy = overflow_policy
+        self.espera_max_s = float(espera_max_s)
+
+        # Callback opcional (n_eventos, retraso_s) tras cada tanda aplicada;
+        # retraso_s es la antigüedad del evento más antiguo de la tanda
+        self.lag_observer = None
+
+        self._hilos = [_Hilo() for _ in range(max(1, int(hilos)))]
+        self._stop = threading.Event()
+
+        # Métricas
+        self.enqueued = 0
+        self.applied = 0
+        self.dropped = 0
+        self.discarded_evicted = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_lag_s = 0.0
+        self.max_lag_s = 0.0
+        self.last_error = None
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    def start(self):
+        """Arranca los hilos (idempotente)"""
+        self._stop.clear()
+        for i, hilo in enumerate(self._hilos):
+            if hilo.thread is None or not hilo.thread.is_alive():
+                hilo.thread = threading.Thread(target=self._run, args=(hilo,), name=f"river-learner-{i}",
+                                               daemon=True)
+                hilo.thread.start()
+        return self
+
+    def stop(self, timeout=10.0):
+        """Detiene los hilos tras aplicar lo que quede pendiente"""
+        self._stop.set()
+        for hilo in self._hilos:
+            with hilo.cond:
+                hilo.cond.notify_all()
+        for hilo in self._hilos:
+            if hilo.thread is not None:
+                hilo.thread.join(timeout)
+                hilo.thread = None
+
+    def encolar(self, device_id, evento):
+        """
+        Encola el evento de aprendizaje de una lectura.
+
+        Returns:
+            bool: True si quedó encolado sin descartar ninguno
+        """
+        hilo = self._hilos[zlib.crc32(device_id.encode("utf-8")) % len(self._hilos)]
+        descartado = False
+        with hilo.cond:
+            cola = hilo.colas.get(device_id)
+            if cola is None:
+                cola = hilo.colas[device_id] = deque()
+            elif len(cola) >= self.max_pendientes:
+                if self.overflow_policy == "block":
+                    limite = time.monotonic() + self.espera_max_s
+                    while len(cola) >= self.max_pendientes and not self._stop.is_set():
+                        restante = limite - time.monotonic()
+                        if restante <= 0:
+                            break
+                        hilo.cond.wait(restante)
+                    # El hilo pudo llevarse la cola mientras se esperaba
+                    cola = hilo.colas.get(device_id)
+                    if cola is None:
+                        cola = hilo.colas[device_id] = deque()
+                if len(cola) >= self.max_pendientes:
+                    cola.popleft()
+                    self.dropped += 1
+                    descartado = True
+            cola.append((time.monotonic(), evento))
+            self.enqueued += 1
+            hilo.cond.notify_all()
+        return not descartado
+
+    def pendientes(self):
+        """Eventos encolados aún sin aplicar"""
+        total = 0
+        for hilo in self._hilos:
+            with hilo.cond:
+                total += sum(len(c) for c in hilo.colas.values())
+        return total
+
+    def get_stats(self):
+        """Retorna métricas actuales del pool"""
+        return {
+            'learn_threads': len(self._hilos),
+            'learn_pending': self.pendientes(),
+            'learn_max_pending': self.max_pendientes,
+            'learn_interval_s': self.intervalo_s,
+            'learn_overflow_policy': self.overflow_policy,
+            'learn_enqueued': self.enqueued,
+            'learn_applied': self.applied,
+            'learn_dropped': self.dropped,
+            'learn_discarded_evicted': self.discarded_evicted,
+            'learn_batches': self.batches,
+            'learn_errors': self.errors,
+            'learn_last_lag_s': round(self.last_lag_s, 6),
+            'learn_max_lag_s': round(self.max_lag_s, 6),
+            'learn_last_error': self.last_error
+        }
+
+    # ------------------------------------------------------------------
+    # Hilos de aprendizaje
+    # ------------------------------------------------------------------
+    def _run(self, hilo):
+        while True:
+            with hilo.cond:
+                while not hilo.colas and not self._stop.is_set():
+                    hilo.cond.wait()
+                if not hilo.colas:
+                    # Parada con todo aplicado
+                    return
+                # Los eventos que lleguen mientras tanto van a colas nuevas
+                pendientes, hilo.colas = hilo.colas, OrderedDict()
+                # Hay sitio otra vez para las peticiones en "block"
+                hilo.cond.notify_all()
+            for device_id, cola in pendientes.items():
+                self._aplicar(device_id, cola)
+            if not self._stop.is_set():
+                self._stop.wait(self.intervalo_s)
+
+    def _aplicar(self, device_id, cola):
+        entry = self.resolver(device_id)
+        if entry is None:
+            # Expulsado del registro: su estado ya se guardó sin estos eventos
+            self.discarded_evicted += len(cola)
+            return
+        retraso = time.monotonic() - cola[0][0]
+        try:
+            entry.analyzer.aprender_diferido([evento for _, evento in cola], entry.lock)
+        except Exception as e:
+            self.errors += 1
+            self.last_error = repr(e)
+            print("[LEARNER]", device_id, repr(e))
+            return
+        self.applied += len(cola)
+        self.batches += 1
+        self.last_lag_s = retraso
+        if retraso > self.max_lag_s:
+            self.max_lag_s = retraso
+        if self.lag_observer:
+            self.lag_observer(len(cola), retraso)
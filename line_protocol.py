@@ -0,0 +1,268 @@
+"""
+Codificador de line protocol de InfluxDB para las mediciones del servidor.
+
+Cada medición tiene un esquema (orden, nombre y formato de cada campo). Al
+codificar un punto se pasan los valores como tupla en el orden del esquema;
+None significa "campo ausente". Al crear el esquema se genera el código
+de su función de formato (como hace collections.namedtuple): una
+expresión por campo, sin bucles ni búsquedas de claves por punto.
+
+Escapado (https://docs.influxdata.com/influxdb/v2/reference/syntax/line-protocol/):
+    - medición:             coma y espacio
+    - claves y tag values:  coma, signo igual y espacio
+    - campos string:        comillas dobles y barra invertida
+
+Los floats no finitos (NaN, inf) no son representables en line protocol y
+se omiten del punto.
+
+Tipos de campo (compatibles con los datos ya escritos, donde todo lo
+numérico es float sin sufijo):
+    - "num":    número tal cual (str), p. ej. servos y LDR crudos
+    - "float":  float con `decimales` fijos
+    - "bool":   1/0 como número
+    - "int":    entero con sufijo `i`
+    - "string": texto entre comillas
+"""
+
+import math
+from operator import itemgetter
+
+
+_TABLA_MEDICION = str.maketrans({",": "\\,", " ": "\\ ", "\n": "\\n"})
+_TABLA_TAG = str.maketrans({",": "\\,", "=": "\\=", " ": "\\ ", "\n": "\\n"})
+_TABLA_STRING = str.maketrans({"\\": "\\\\", '"': '\\"'})
+
+
+def escapar_medicion(nombre):
+    return str(nombre).translate(_TABLA_MEDICION)
+
+
+def escapar_tag(valor):
+    """Escapa una clave de tag/campo o un tag value"""
+    return str(valor).translate(_TABLA_TAG)
+
+
+def escapar_string(valor):
+    """Escapa el contenido de un campo string (sin las comillas)"""
+    valor = str(valor)
+    if '"' in valor or "\\" in valor:
+        return valor.translate(_TABLA_STRING)
+    return valor
+
+
+def _literal(texto):
+    """Texto fijo como parte de una f-string entre comillas dobles"""
+    return (texto.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            .replace("{", "{{").replace("}", "}}"))
+
+
+class Campo:
+    """Definición de un campo del esquema"""
+
+    __slots__ = ("nombre", "tipo", "decimales")
+
+    TIPOS = ("num", "float", "bool", "int", "string")
+
+    def __init__(self, nombre, tipo="num", decimales=None):
+        if tipo not in self.TIPOS:
+            raise ValueError(f"tipo debe ser uno de {self.TIPOS}")
+        if tipo == "float" and decimales is None:
+            raise ValueError(f"el campo float {nombre} necesita decimales")
+        self.nombre = nombre
+        self.tipo = tipo
+        self.decimales = decimales
+
+    def expresion(self, i):
+        """Fragmento de f-string que formatea v[i], p. ej. 'ldr_arriba={v[6]:.1f}'"""
+        clave = _literal(escapar_tag(self.nombre))
+        if self.tipo == "float":
+            return f"{clave}={{v[{i}]:.{int(self.decimales)}f}}"
+        if self.tipo == "bool":
+            return f"{clave}={{v[{i}]:d}}"
+        if self.tipo == "int":
+            return f"{clave}={{v[{i}]:d}}i"
+        if self.tipo == "string":
+            return f'{clave}=\\"{{_e(v[{i}])}}\\"'
+        return f"{clave}={{v[{i}]}}"
+
+
+class Esquema:
+    """Medición con tags y campos fijos; codifica puntos a line protocol"""
+
+    MAX_COMBINACIONES = 4096
+
+    def __init__(self, medicion, tags, campos):
+        self.medicion = medicion
+        self.tags = tuple(tags)
+        self.campos = tuple(campos)
+        self._medicion_esc = escapar_medicion(medicion)
+        self._strings = tuple(i for i, c in enumerate(self.campos) if c.tipo == "string")
+        self._numericos = tuple(i for i, c in enumerate(self.campos) if c.tipo in ("num", "float"))
+        # Extrae en C los valores numéricos (siempre como tupla) para la comprobación de finitud
+        self._extraer_numericos = (itemgetter(*self._numericos, *self._numericos[:1])
+                                   if self._numericos else None)
+        self._codificar = self._compilar()
+        self._prefijos = {}     # tag values -> "medicion,tag=valor "
+
+    def indice(self, nombre):
+        for i, c in enumerate(self.campos):
+            if c.nombre == nombre:
+                return i
+        raise KeyError(nombre)
+
+    def prefijo(self, tag_values):
+        """'medicion,tag=valor,... ' con escapado, cacheado por combinación de tags"""
+        prefijo = self._prefijos.get(tag_values)
+        if prefijo is None:
+            partes = [self._medicion_esc]
+            for clave, valor in zip(self.tags, tag_values):
+                if valor is None or valor == "":
+                    continue
+                partes.append(f"{escapar_tag(clave)}={escapar_tag(valor)}")
+            prefijo = ",".join(partes) + " "
+            # Acotado: el número de dispositivos es pequeño, pero el id viene del cliente
+            if len(self._prefijos) >= self.MAX_COMBINACIONES:
+                self._prefijos.clear()
+            self._prefijos[tag_values] = prefijo
+        return prefijo
+
+    def _compilar(self):
+        """Genera la función que formatea los campos presentes y el timestamp"""
+        partes = "".join(f'        "" if v[{i}] is None else f",{c.expresion(i)}",\n'
+                         for i, c in enumerate(self.campos))
+        # Cada campo lleva su coma delante; codificar() quita la del primero
+        codigo = f'def codificar(v, ts, _e=_e):\n    return "".join((\n{partes}        f" {{ts}}"))\n'
+        espacio = {"_e": escapar_string}
+        exec(compile(codigo, f"<line_protocol {self.medicion}>", "exec"), espacio)
+        return espacio["codificar"]
+
+    def codificar(self, tag_values, valores, ts_ms):
+        """
+        Codifica un punto.
+
+        Args:
+            tag_values: tupla con el valor de cada tag (en el orden del esquema)
+            valores: tupla con el valor de cada campo; None = ausente
+            ts_ms: timestamp en milisegundos
+
+        Returns:
+            str: línea sin salto final
+
+        Raises:
+            ValueError: si no queda ningún campo que escribir
+        """
+        # NaN/inf no son representables: su suma (en C, sin los None) los
+        # delata sin mirar campo a campo, y solo entonces se quitan
+        if self._extraer_numericos is not None and \
+                not math.isfinite(sum(filter(None, self._extraer_numericos(valores)))):
+            valores = tuple(
+                None if i in self._numericos and isinstance(v, float) and not math.isfinite(v) else v
+                for i, v in enumerate(valores)
+            )
+
+        linea = self._codificar(valores, ts_ms)
+        if linea[0] != ",":
+            raise ValueError(f"punto de {self.medicion} sin campos")
+        return self.prefijo(tag_values) + linea[1:]
+
+    def codificar_lote(self, puntos):
+        """
+        Codifica varios puntos en un único cuerpo para /api/v2/write.
+
+        Args:
+            puntos: iterable de (tag_values, valores, ts_ms)
+
+        Returns:
+            bytes: líneas separadas por salto de línea, en UTF-8
+        """
+        # str.join calcula el tamaño total y reserva el buffer una sola vez
+        return "\n".join([self.codificar(t, v, ts) for t, v, ts in puntos]).encode("utf-8")
+
+
+class OmitirSinCambios:
+    """
+    Codifica solo los campos cuyo valor cambió desde el último punto de la
+    misma serie. Cada `refresco_cada` puntos se emite el punto completo para
+    que las consultas por ventana de tiempo sigan encontrando todos los campos.
+    """
+
+    def __init__(self, esquema, refresco_cada=60, max_series=4096):
+        self.esquema = esquema
+        self.refresco_cada = int(refresco_cada)
+        self.max_series = int(max_series)
+        self._ultimos = {}   # tag values -> [puntos desde el refresco, valores]
+        self.campos_omitidos = 0
+
+    def codificar(self, tag_values, valores, ts_ms):
+        estado = self._ultimos.get(tag_values)
+        if estado is None:
+            if len(self._ultimos) >= self.max_series:
+                self._ultimos.clear()
+            estado = self._ultimos[tag_values] = [0, None]
+
+        anteriores = estado[1]
+        estado[1] = valores
+        estado[0] += 1
+        if anteriores is None or estado[0] > self.refresco_cada:
+            estado[0] = 1
+            return self.esquema.codificar(tag_values, valores, ts_ms)
+
+        # v != v: un NaN repetido también cuenta como "sin cambios"
+        cambiados = tuple(None if v == a or (v != v and a != a) else v for v, a in zip(valores, anteriores))
+        ausentes = valores.count(None)
+        omitidos = cambiados.count(None) - ausentes
+        if omitidos == len(valores) - ausentes:
+            # Sin cambios: conservar un campo (no NaN) para que el punto exista
+            primero = next((i for i, v in enumerate(valores) if v is not None and v == v), None)
+            if primero is None:
+                return self.esquema.codificar(tag_values, valores, ts_ms)
+            cambiados = cambiados[:primero] + (valores[primero],) + cambiados[primero + 1:]
+            omitidos -= 1
+        self.campos_omitidos += omitidos
+        return self.esquema.codificar(tag_values, cambiados, ts_ms)
+
+
+# ----------------------------------------------------------------------
+# Esquemas de las mediciones del servidor
+# ----------------------------------------------------------------------
+# model_version: versión del modelo de eficiencia que hizo la predicción
+# (RiverAnalyzer.model_version, aumenta con cada reentrenamiento aceptado)
+TRACKER = Esquema("tracker", tags=("device", "model_version"), campos=(
+    Campo("servo_h"), Campo("servo_v"),
+    Campo("ldr_tl"), Campo("ldr_tr"), Campo("ldr_bl"), Campo("ldr_br"),
+    Campo("ldr_arriba", "float", 1), Campo("ldr_abajo", "float", 1),
+    Campo("ldr_izquierda", "float", 1), Campo("ldr_derecha", "float", 1),
+    Campo("ldr_norm_tl", "float", 1), Campo("ldr_norm_tr", "float", 1),
+    Campo("ldr_norm_bl", "float", 1), Campo("ldr_norm_br", "float", 1),
+    Campo("limit_hit_h", "bool"), Campo("limit_hit_v", "bool"),
+    Campo("cmd_h"), Campo("cmd_v"),
+    Campo("bme_temp_c", "float", 2), Campo("bme_press_hpa", "float", 2),
+    Campo("bme_hum_pct", "float", 2), Campo("bme_alt_m", "float", 2),
+    Campo("panel_voltage", "float", 4),
+    Campo("env_state", "string"), Campo("env_confidence", "float", 2),
+    Campo("env_rel_light_change", "float", 4), Campo("env_state_id"),
+    Campo("voltage_predicted", "float", 4), Campo("voltage_error", "float", 4),
+    Campo("efficiency_ok", "bool"),
+    Campo("anomaly_score", "float", 4), Campo("is_anomaly", "bool"), Campo("drift_detected", "bool"),
+))
+
+POTENTIOMETER = Esquema("potentiometer", tags=("device",), campos=(
+    Campo("value"), Campo("voltage"),
+))
+
+# Agregados por dispositivo y ventana (aggregates.py); timestamp = inicio de la ventana
+_CAMPOS_AGREGADO = (
+    Campo("samples", "int"),
+    Campo("ldr_mean", "float", 1), Campo("ldr_min", "float", 1), Campo("ldr_max", "float", 1),
+    Campo("ldr_tl_mean", "float", 1), Campo("ldr_tr_mean", "float", 1),
+    Campo("ldr_bl_mean", "float", 1), Campo("ldr_br_mean", "float", 1),
+    Campo("panel_voltage_mean", "float", 4), Campo("panel_voltage_max", "float", 4),
+    Campo("volt_seconds", "float", 3), Campo("energy_wh", "float", 6),
+    Campo("t_sunny_s", "float", 1), Campo("t_cloudy_s", "float", 1),
+    Campo("t_unstable_s", "float", 1), Campo("t_humid_hazy_s", "float", 1),
+    Campo("anomalies", "int"), Campo("drifts", "int"),
+    Campo("servo_travel_h"), Campo("servo_travel_v"),
+)
+
+TRACKER_1M = Esquema("tracker_1m", tags=("device",), campos=_CAMPOS_AGREGADO)
+TRACKER_1H = Esquema("tracker_1h", tags=("device",), campos=_CAMPOS_AGREGADO)
@@ -0,0 +1,208 @@
+"""
+Métricas en formato de exposición de texto de Prometheus.
+
+Pensado para el hot path de /sensor_values: cada hilo escribe en su propio
+fragmento (threading.local), así que incrementar un contador u observar un
+histograma no toma ningún lock. Los fragmentos se suman al generar /metrics;
+los de hilos ya terminados (Werkzeug crea un hilo por petición) se pliegan
+en un acumulador común cada vez que un hilo nuevo registra su fragmento, así
+que la memoria no crece aunque nadie consulte /metrics.
+"""
+
+import math
+import threading
+from bisect import bisect_left
+
+
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                   0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres, valores, extra=None):
+    pares = list(zip(nombres, valores))
+    if extra:
+        pares.append(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+
+def _numero(v):
+    if v == math.inf:
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+class _Fragmentado:
+    """Base de métricas con un fragmento por hilo"""
+
+    tipo = None
+
+    def __init__(self, nombre, ayuda, labelnames=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._fragmentos = []      # (hilo, dict)
+        self._retirado = {}        # suma de fragmentos de hilos terminados
+        self._lock = threading.Lock()
+
+    def _fragmento(self):
+        try:
+            return self._local.datos
+        except AttributeError:
+            datos = {}
+            self._local.datos = datos
+            with self._lock:
+                # Con un hilo por petición (werkzeug) y sin scrapes, los fragmentos
+                # de hilos terminados se pliegan aquí: la lista no pasa de los hilos vivos
+                self._plegar_terminados()
+                self._fragmentos.append((threading.current_thread(), datos))
+            return datos
+
+    def _sumar(self, destino, origen):
+        raise NotImplementedError
+
+    def _plegar_terminados(self):
+        """Suma en _retirado los fragmentos de hilos terminados. Con self._lock tomado"""
+        vivos = []
+        for hilo, datos in self._fragmentos:
+            if hilo.is_alive():
+                vivos.append((hilo, datos))
+            else:
+                self._sumar(self._retirado, datos)
+        self._fragmentos = vivos
+
+    def _recoger(self):
+        """Suma de todos los fragmentos (plegando los de hilos terminados)"""
+        with self._lock:
+            self._plegar_terminados()
+            vivos = self._fragmentos
+            total = {}
+            self._sumar(total, self._retirado)
+            for _, datos in vivos:
+                # Copia superficial: el hilo dueño puede seguir escribiendo
+                self._sumar(total, dict(datos))
+        return total
+
+    def render(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        lineas.extend(self._muestras())
+        return lineas
+
+
+class Counter(_Fragmentado):
+    tipo = "counter"
+
+    def inc(self, cantidad=1, labels=()):
+        datos = self._fragmento()
+        datos[labels] = datos.get(labels, 0) + cantidad
+
+    def _sumar(self, destino, origen):
+        for k, v in origen.items():
+            destino[k] = destino.get(k, 0) + v
+
+    def valor(self, labels=()):
+        return self._recoger().get(labels, 0)
+
+    def _muestras(self):
+        for labels, v in sorted(self._recoger().items()):
+            yield f"{self.nombre}{_etiquetas(self.labelnames, labels)} {_numero(v)}"
+
+
+class Histogram(_Fragmentado):
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(nombre, ayuda, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, valor, labels=()):
+        datos = self._fragmento()
+        fila = datos.get(labels)
+        if fila is None:
+            # [cuenta por bucket..., +Inf, suma]
+            fila = datos[labels] = [0] * (len(self.buckets) + 2)
+        fila[bisect_left(self.buckets, valor)] += 1
+        fila[-1] += valor
+
+    def _sumar(self, destino, origen):
+        for k, fila in origen.items():
+            acc = destino.get(k)
+            if acc is None:
+                destino[k] = list(fila)
+            else:
+                for i, v in enumerate(fila):
+                    acc[i] += v
+
+    def _muestras(self):
+        for labels, fila in sorted(self._recoger().items()):
+            acumulado = 0
+            for limite, n in zip(self.buckets + (math.inf,), fila[:-1]):
+                acumulado += n
+                le = ("le", _numero(float(limite)) if limite != math.inf else "+Inf")
+                yield f"{self.nombre}_bucket{_etiquetas(self.labelnames, labels, le)} {acumulado}"
+            yield f"{self.nombre}_sum{_etiquetas(self.labelnames, labels)} {_numero(float(fila[-1]))}"
+            yield f"{self.nombre}_count{_etiquetas(self.labelnames, labels)} {acumulado}"
+
+
+class Gauge:
+    """Gauge evaluado al generar /metrics (profundidad de colas, nº de dispositivos...)"""
+
+    tipo = "gauge"
+
+    def __init__(self, nombre, ayuda, funcion, labelnames=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.funcion = funcion
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        try:
+            valor = self.funcion()
+        except Exception as e:
+            print(f"[METRICS] {self.nombre}:", repr(e))
+            return lineas
+        if isinstance(valor, dict):
+            for labels, v in sorted(valor.items()):
+                if not isinstance(labels, tuple):
+                    labels = (labels,)
+                lineas.append(f"{self.nombre}{_etiquetas(self.labelnames, labels)} {_numero(v)}")
+        elif valor is not None:
+            lineas.append(f"{self.nombre} {_numero(valor)}")
+        return lineas
+
+
+class MetricsRegistry:
+    """Conjunto de métricas expuestas en /metrics"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metricas = []
+
+    def _registrar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def counter(self, nombre, ayuda, labelnames=()):
+        return self._registrar(Counter(nombre, ayuda, labelnames))
+
+    def histogram(self, nombre, ayuda, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._registrar(Histogram(nombre, ayuda, labelnames, buckets))
+
+    def gauge(self, nombre, ayuda, funcion, labelnames=()):
+        return self._registrar(Gauge(nombre, ayuda, funcion, labelnames))
+
+    def render(self):
+        lineas = []
+        for metrica in self._metricas:
+            lineas.extend(metrica.render())
+        return "\n".join(lineas) + "\n"
@@ -0,0 +1,214 @@
+"""
+Registro de modelos River por dispositivo.
+
+Cada tracker tiene su propio RiverAnalyzer (regresión, HalfSpaceTrees y
+ADWIN independientes) y su propio lock, de modo que peticiones de
+dispositivos distintos pueden ejecutarse en paralelo sin compartir estado.
+Los dispositivos inactivos se expulsan por LRU cuando se supera el límite
+o, con idle_ttl_s, al llamar periódicamente a evict_idle(). Un dispositivo
+con una petición en curso (usar()) o con su lock tomado no se expulsa.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class DeviceEntry:
+    """Estado de un dispositivo dentro del registro"""
+    __slots__ = ("device_id", "analyzer", "lock", "last_used", "en_uso")
+
+    def __init__(self, device_id, analyzer):
+        self.device_id = device_id
+        self.analyzer = analyzer
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        # Peticiones en curso (usar()); con alguna, la entrada no se expulsa
+        self.en_uso = 0
+
+
+class ModelRegistry:
+    """
+    Registro LRU de analizadores por device_id.
+
+    Args:
+        factory: función device_id -> analizador nuevo
+        max_devices: número máximo de analizadores en memoria (tope de memoria)
+        idle_ttl_s: segundos sin uso tras los que un dispositivo puede expulsarse (None = nunca)
+        on_evict: callback opcional (device_id, analyzer) al expulsar
+    """
+
+    def __init__(self, factory, max_devices=256, idle_ttl_s=None, on_evict=None):
+        self.factory = factory
+        self.max_devices = int(max_devices)
+        self.idle_ttl_s = idle_ttl_s
+        self.on_evict = on_evict
+
+        self._entries = OrderedDict()
+        # Lock global solo para la estructura del diccionario; el trabajo
+        # pesado se hace con el lock propio de cada dispositivo
+        self._lock = threading.Lock()
+        # device_id -> Event de los expulsados cuyo on_evict aún no terminó:
+        # el dispositivo no se vuelve a crear hasta que su estado está guardado
+        self._expulsando = {}
+
+        self.created = 0
+        self.evicted = 0
+
+    def get(self, device_id):
+        """Obtiene (o crea) la entrada de un dispositivo y la marca como usada"""
+        return self._obtener(device_id, False)
+
+    @contextmanager
+    def usar(self, device_id):
+        """
+        Entrada de un dispositivo (creándola si hace falta) protegida contra la
+        expulsión mientras dura el bloque. Es la forma de usarla en una petición:
+        con get() otra petición podría expulsarla entre get() y tomar su lock.
+        """
+        entry = self._obtener(device_id, True)
+        try:
+            yield entry
+        finally:
+            expulsados = []
+            with self._lock:
+                entry.en_uso -= 1
+                # Expulsiones aplazadas mientras estaba en uso
+                if entry.en_uso == 0 and len(self._entries) > self.max_devices:
+                    expulsados = self._collect_evictions()
+            self._notify_evictions(expulsados)
+
+    def _obtener(self, device_id, en_uso):
+        while True:
+            with self._lock:
+                entry = self._entries.get(device_id)
+                if entry is not None:
+                    self._entries.move_to_end(device_id)
+                    entry.last_used = time.monotonic()
+                    if en_uso:
+                        entry.en_uso += 1
+                    return entry
+                expulsion = self._expulsando.get(device_id)
+            if expulsion is None:
+                break
+            # Recién expulsado: esperar a que on_evict guarde su estado
+            expulsion.wait()
+
+        # Crear fuera del lock global: construir los modelos puede tardar
+        nuevo = DeviceEntry(device_id, self.factory(device_id))
+
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is None:
+                entry = nuevo
+                self._entries[device_id] = entry
+                self.created += 1
+            self._entries.move_to_end(device_id)
+            entry.last_used = time.monotonic()
+            if en_uso:
+                entry.en_uso += 1
+            expulsados = self._collect_evictions()
+
+        self._notify_evictions(expulsados)
+        return entry
+
+    def peek(self, device_id):
+        """Devuelve la entrada si está en memoria, sin crearla ni alterar el orden LRU"""
+        with self._lock:
+            return self._entries.get(device_id)
+
+    def get_analyzer(self, device_id):
+        return self.get(device_id).analyzer
+
+    def evict_idle(self):
+        """
+        Expulsa los dispositivos que superan idle_ttl_s; devuelve cuántos.
+        El servidor la llama periódicamente: sin ella solo se comprueba al crear dispositivos.
+        """
+        with self._lock:
+            expulsados = self._collect_evictions()
+        self._notify_evictions(expulsados)
+        return len(expulsados)
+
+    def device_ids(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def items(self):
+        """Copia de (device_id, entry) para recorrer sin bloquear el registro"""
+        with self._lock:
+            return list(self._entries.items())
+
+    def retenido(self, device_id):
+        """En memoria o con su expulsión (on_evict) todavía en curso"""
+        with self._lock:
+            return device_id in self._entries or device_id in self._expulsando
+
+    def __contains__(self, device_id):
+        with self._lock:
+            return device_id in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get_stats(self):
+        """Retorna estadísticas actuales del registro"""
+        with self._lock:
+            return {
+                'devices': len(self._entries),
+                'max_devices': self.max_devices,
+                'created': self.created,
+                'evicted': self.evicted
+            }
+
+    # ------------------------------------------------------------------
+    def _collect_evictions(self):
+        """Debe llamarse con self._lock tomado"""
+        expulsados = []
+        ahora = time.monotonic()
+
+        # Por inactividad (los más antiguos están al principio)
+        if self.idle_ttl_s is not None:
+            for device_id, entry in list(self._entries.items()):
+                if ahora - entry.last_used < self.idle_ttl_s:
+                    break
+                if self._expulsable(entry):
+                    del self._entries[device_id]
+                    expulsados.append(entry)
+
+        # Por tope de memoria (LRU); los que están en uso se saltan y se
+        # expulsan al terminar su petición (usar())
+        exceso = len(self._entries) - self.max_devices
+        if exceso > 0:
+            for device_id, entry in list(self._entries.items()):
+                if self._expulsable(entry):
+                    del self._entries[device_id]
+                    expulsados.append(entry)
+                    exceso -= 1
+                    if exceso == 0:
+                        break
+
+        for entry in expulsados:
+            self._expulsando[entry.device_id] = threading.Event()
+        self.evicted += len(expulsados)
+        return expulsados
+
+    @staticmethod
+    def _expulsable(entry):
+        """Sin peticiones en curso ni el lock tomado (petición, aprendizaje o checkpoint)"""
+        return entry.en_uso == 0 and not entry.lock.locked()
+
+    def _notify_evictions(self, expulsados):
+        for entry in expulsados:
+            try:
+                if self.on_evict is not None:
+                    self.on_evict(entry.device_id, entry.analyzer)
+            except Exception as e:
+                print("[REGISTRY] on_evict:", repr(e))
+            finally:
+                with self._lock:
+                    expulsion = self._expulsando.pop(entry.device_id, None)
+                if expulsion is not None:
+                    expulsion.set()
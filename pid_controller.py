@@ -0,0 +1,144 @@
+"""
+Controlador PID por dispositivo para el tracker solar.
+
+Vive en su propio módulo para poder usarlo sin Flask ni InfluxDB
+(replay offline, benchmarks, simulador).
+"""
+
+
+class DevicePIDController:
+    """Controlador PID independiente para cada dispositivo ESP32"""
+    def __init__(self, device_id):
+        self.device_id = device_id
+
+        self.Kp = 0.02
+        self.Kd = 0.06
+        self.Ki = 0.0005
+        self.maxCambio = 5
+        self.tolerancia = 1
+
+        self.errorPrevH = 0
+        self.errorPrevV = 0
+        self.intErrH = 0.0
+        self.intErrV = 0.0
+        self.int_limit = 5000
+
+        self.limiteMinH = 40
+        self.limiteMaxH = 180
+        self.limiteMinV = 40
+        self.limiteMaxV = 175
+
+        self.lastPosH = 120
+        self.lastPosV = 150
+
+    # Estado dinámico que se guarda en los snapshots (las ganancias y límites son configuración)
+    _ESTADO_PERSISTENTE = ("errorPrevH", "errorPrevV", "intErrH", "intErrV", "lastPosH", "lastPosV")
+
+    def get_state(self):
+        return {k: getattr(self, k) for k in self._ESTADO_PERSISTENTE}
+
+    def set_state(self, estado):
+        for k in self._ESTADO_PERSISTENTE:
+            if k in estado:
+                setattr(self, k, estado[k])
+
+    def calcular_angulos(self, ldr_tl, ldr_tr, ldr_bl, ldr_br, current_h, current_v, at_limit_h=False, at_limit_v=False):
+        """
+        Uso de PID para determinar posicion de servos
+        """
+        self.lastPosH = current_h
+        self.lastPosV = current_v
+
+        promedioArriba = (ldr_tl + ldr_tr) / 2
+        promedioAbajo = (ldr_bl + ldr_br) / 2
+        promedioIzquierda = (ldr_tl + ldr_bl) / 2
+        promedioDerecha = (ldr_tr + ldr_br) / 2
+
+        diffV = promedioArriba - promedioAbajo
+        diffH = promedioIzquierda - promedioDerecha
+
+      #  moverV = False
+       # moverH = False
+
+        #if abs(diffV) > self.tolerancia or abs(diffH) > self.tolerancia:
+         #   if abs(diffV) > abs(diffH):
+          #      moverV = True
+           # else:
+            #    moverH = True
+
+        #cambio
+        #para que ambos ejes se puedan estar moviendo sin darle prioridad a otro
+        moverV = abs(diffV) > self.tolerancia
+        moverH = abs(diffH) > self.tolerancia
+
+
+        nuevo_h = current_h
+        nuevo_v = current_v
+        debug_info = {
+            'diffH': diffH,
+            'diffV': diffV,
+            'moverH': moverH,
+            'moverV': moverV,
+            'correccionH': 0,
+            'correccionV': 0
+        }
+
+        # Función auxiliar: tamaño de paso no lineal según magnitud de error
+        def step_from_diff(d):
+            ad = abs(d)
+            if ad > 1200:
+                return 10
+            if ad > 600:
+                return 8
+            if ad > 250:
+                return 6
+            if ad > 80:
+                return 4
+            if ad > self.tolerancia:
+                return 2
+            return 0
+
+        if moverV:
+            if at_limit_v:
+                # Eje invertido: diffV > 0 baja el ángulo, diffV < 0 lo sube
+                if (diffV > 0 and current_v <= self.limiteMinV) or (diffV < 0 and current_v >= self.limiteMaxV):
+                    moverV = False
+                    debug_info['moverV'] = False
+
+            if moverV:
+                errorV = diffV
+                derivV = errorV - self.errorPrevV
+                self.intErrV += errorV
+                self.intErrV = max(min(self.intErrV, self.int_limit), -self.int_limit)
+                correccionV = (self.Kp * errorV) + (self.Kd * derivV) + (self.Ki * self.intErrV)
+                max_step_v = step_from_diff(errorV)
+                correccionV = max(min(correccionV, max_step_v), -max_step_v)
+
+                nuevo_v = current_v - int(correccionV)  # Invertido
+                nuevo_v = max(min(nuevo_v, self.limiteMaxV), self.limiteMinV)
+
+                self.errorPrevV = errorV
+                debug_info['correccionV'] = correccionV
+
+        if moverH:
+            if at_limit_h:
+                if (diffH > 0 and current_h >= self.limiteMaxH) or (diffH < 0 and current_h <= self.limiteMinH):
+                    moverH = False
+                    debug_info['moverH'] = False
+
+            if moverH:
+                errorH = diffH
+                derivH = errorH - self.errorPrevH
+                self.intErrH += errorH
+                self.intErrH = max(min(self.intErrH, self.int_limit), -self.int_limit)
+                correccionH = (self.Kp * errorH) + (self.Kd * derivH) + (self.Ki * self.intErrH)
+                max_step_h = step_from_diff(errorH)
+                correccionH = max(min(correccionH, max_step_h), -max_step_h)
+
+                nuevo_h = current_h + int(correccionH)
+                nuevo_h = max(min(nuevo_h, self.limiteMaxH), self.limiteMinH)
+
+                self.errorPrevH = errorH
+                debug_info['correccionH'] = correccionH
+
+        return nuevo_h, nuevo_v, debug_info
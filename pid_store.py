@@ -0,0 +1,445 @@
+"""
+Almacén de controladores PID para flotas grandes.
+
+En lugar de un DevicePIDController (objeto con ~20 atributos) por tracker,
+el estado de todos los dispositivos vive en una tabla de NumPy en orden
+Fortran: cada campo es una columna contigua (structure of arrays) y un
+diccionario device_id -> fila. A 100k dispositivos la memoria es ~130
+bytes por dispositivo más la entrada del diccionario, y las filas de los
+expulsados se reutilizan. El paso escalar lee y escribe la fila entera de
+una vez (tolist / asignación), que es lo que lo mantiene tan barato como
+el objeto.
+
+- calcular_angulos: un paso de un dispositivo, mismo resultado que
+  DevicePIDController.calcular_angulos.
+- calcular_angulos_lote: un paso de muchos dispositivos a la vez con
+  operaciones vectorizadas (cada dispositivo como mucho una vez por lote).
+- evict_idle: expulsa los dispositivos sin uso durante idle_ttl_s.
+
+Solo controlador() e indice() dan de alta un dispositivo. controlador()
+devuelve una vista con la interfaz de DevicePIDController
+(calcular_angulos, get_state, set_state), así que el resto del servidor no
+distingue entre ambos. Las operaciones sobre un dispositivo expulsado
+lanzan KeyError en lugar de recrear su fila con el estado por defecto.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from pid_controller import DevicePIDController
+
+
+# Valores por defecto tomados del propio DevicePIDController (una sola fuente)
+_DEFECTO = DevicePIDController(None)
+PARAMETROS = ("Kp", "Kd", "Ki", "tolerancia", "int_limit",
+              "limiteMinH", "limiteMaxH", "limiteMinV", "limiteMaxV")
+PARAMETROS_DEFECTO = {k: getattr(_DEFECTO, k) for k in PARAMETROS}
+ESTADO_DEFECTO = _DEFECTO.get_state()
+
+# Columnas de la tabla (float64, orden Fortran: cada columna es contigua)
+COLUMNAS = PARAMETROS + tuple(ESTADO_DEFECTO)
+_J = {k: j for j, k in enumerate(COLUMNAS)}
+_ENTEROS = {"limiteMinH", "limiteMaxH", "limiteMinV", "limiteMaxV", "lastPosH", "lastPosV"}
+
+# Umbrales de step_from_diff: |error| > umbral -> paso máximo
+_UMBRALES_PASO = ((1200, 10), (600, 8), (250, 6), (80, 4))
+
+
+def _paso_maximo(ad, tolerancia):
+    """Tamaño de paso no lineal según magnitud del error (escalar)"""
+    for umbral, paso in _UMBRALES_PASO:
+        if ad > umbral:
+            return paso
+    return 2 if ad > tolerancia else 0
+
+
+def _paso_maximo_lote(ad, tolerancia):
+    """Versión vectorizada de _paso_maximo"""
+    return np.select([ad > u for u, _ in _UMBRALES_PASO] + [ad > tolerancia],
+                     [p for _, p in _UMBRALES_PASO] + [2], default=0)
+
+
+(_KP, _KD, _KI, _TOL, _ILIM, _MIN_H, _MAX_H, _MIN_V, _MAX_V,
+ _EPREV_H, _EPREV_V, _INT_H, _INT_V, _LAST_H, _LAST_V) = (_J[k] for k in COLUMNAS)
+
+
+def _paso_eje(fila, error, actual, signo, j_eprev, j_int, j_min, j_max):
+    """Paso PID de un eje sobre una fila (lista); actualiza error previo e integral"""
+    deriv = error - fila[j_eprev]
+    limite = fila[_ILIM]
+    integral = max(min(fila[j_int] + error, limite), -limite)
+    correccion = fila[_KP] * error + fila[_KD] * deriv + fila[_KI] * integral
+    paso = _paso_maximo(abs(error), fila[_TOL])
+    correccion = max(min(correccion, paso), -paso)
+
+    nuevo = actual + signo * int(correccion)
+    nuevo = max(min(nuevo, int(fila[j_max])), int(fila[j_min]))
+
+    fila[j_int] = integral
+    fila[j_eprev] = error
+    return nuevo, correccion
+
+
+def _paso(fila, ldr_tl, ldr_tr, ldr_bl, ldr_br, current_h, current_v, at_limit_h, at_limit_v):
+    """DevicePIDController.calcular_angulos sobre una fila de la tabla (lista, se modifica)"""
+    fila[_LAST_H] = current_h
+    fila[_LAST_V] = current_v
+
+    diffV = (ldr_tl + ldr_tr) / 2 - (ldr_bl + ldr_br) / 2
+    diffH = (ldr_tl + ldr_bl) / 2 - (ldr_tr + ldr_br) / 2
+
+    tolerancia = fila[_TOL]
+    moverV = abs(diffV) > tolerancia
+    moverH = abs(diffH) > tolerancia
+
+    nuevo_h = current_h
+    nuevo_v = current_v
+    debug_info = {
+        'diffH': diffH,
+        'diffV': diffV,
+        'moverH': moverH,
+        'moverV': moverV,
+        'correccionH': 0,
+        'correccionV': 0
+    }
+
+    if moverV and at_limit_v:
+        # Eje invertido: diffV > 0 baja el ángulo, diffV < 0 lo sube
+        if (diffV > 0 and current_v <= fila[_MIN_V]) or (diffV < 0 and current_v >= fila[_MAX_V]):
+            moverV = debug_info['moverV'] = False
+    if moverV:
+        # Vertical invertido
+        nuevo_v, debug_info['correccionV'] = _paso_eje(fila, diffV, current_v, -1,
+                                                       _EPREV_V, _INT_V, _MIN_V, _MAX_V)
+
+    if moverH and at_limit_h:
+        if (diffH > 0 and current_h >= fila[_MAX_H]) or (diffH < 0 and current_h <= fila[_MIN_H]):
+            moverH = debug_info['moverH'] = False
+    if moverH:
+        nuevo_h, debug_info['correccionH'] = _paso_eje(fila, diffH, current_h, 1,
+                                                       _EPREV_H, _INT_H, _MIN_H, _MAX_H)
+
+    return nuevo_h, nuevo_v, debug_info
+
+
+class _VistaPID:
+    """Vista de un dispositivo del almacén con la interfaz de DevicePIDController"""
+    __slots__ = ("_store", "device_id")
+
+    def __init__(self, store, device_id):
+        self._store = store
+        self.device_id = device_id
+
+    def calcular_angulos(self, ldr_tl, ldr_tr, ldr_bl, ldr_br, current_h, current_v,
+                         at_limit_h=False, at_limit_v=False):
+        return self._store.calcular_angulos(self.device_id, ldr_tl, ldr_tr, ldr_bl, ldr_br,
+                                            current_h, current_v, at_limit_h, at_limit_v)
+
+    def get_state(self):
+        return self._store.get_state(self.device_id)
+
+    def set_state(self, estado):
+        self._store.set_state(self.device_id, estado)
+
+
+class PIDControllerStore:
+    """
+    Estado PID de todos los dispositivos en arrays de NumPy.
+
+    Args:
+        capacidad_inicial: filas reservadas al crear el almacén (crece x2)
+        idle_ttl_s: segundos sin uso tras los que evict_idle expulsa (None = nunca)
+        parametros: ganancias/límites por defecto para dispositivos nuevos
+    """
+
+    def __init__(self, capacidad_inicial=1024, idle_ttl_s=None, **parametros):
+        desconocidos = set(parametros) - set(PARAMETROS)
+        if desconocidos:
+            raise ValueError(f"parámetros PID desconocidos: {sorted(desconocidos)}")
+        self.idle_ttl_s = idle_ttl_s
+        self.defecto = {**PARAMETROS_DEFECTO, **parametros}
+        self._fila_defecto = [float({**self.defecto, **ESTADO_DEFECTO}[k]) for k in COLUMNAS]
+
+        self._capacidad = 0
+        self._tabla = np.zeros((0, len(COLUMNAS)), dtype=np.float64, order="F")
+        self._col = {}
+        self.last_used = np.zeros(0, dtype=np.float64)
+        self.activo = np.zeros(0, dtype=bool)
+        self._ids = []
+        self._crecer(max(1, int(capacidad_inicial)))
+
+        self._indices = {}
+        self._libres = []
+        self._siguiente = 0
+        # Altas, bajas y crecimiento reemplazan arrays e índices: cada paso
+        # se hace con el lock tomado (un paso escalar dura unos µs)
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.evicted = 0
+
+    # ------------------------------------------------------------------
+    # Estructura
+    # ------------------------------------------------------------------
+    def _crecer(self, capacidad):
+        tabla = np.zeros((capacidad, len(COLUMNAS)), dtype=np.float64, order="F")
+        tabla[:self._capacidad] = self._tabla
+        self._tabla = tabla
+        # Vistas por columna (contiguas) para el paso vectorizado
+        self._col = {k: tabla[:, j] for k, j in _J.items()}
+        last_used = np.zeros(capacidad, dtype=np.float64)
+        last_used[:self._capacidad] = self.last_used
+        activo = np.zeros(capacidad, dtype=bool)
+        activo[:self._capacidad] = self.activo
+        self.last_used, self.activo = last_used, activo
+        self._ids.extend([None] * (capacidad - self._capacidad))
+        self._capacidad = capacidad
+
+    def _inicializar(self, i):
+        self._tabla[i] = self._fila_defecto
+        self.activo[i] = True
+        self.last_used[i] = time.monotonic()
+
+    def columna(self, nombre):
+        """Vista (N,) de un campo para todas las filas (incluye filas libres; ver activo)"""
+        return self._col[nombre][:self._siguiente]
+
+    def _fila(self, device_id):
+        """Índice de un dispositivo en memoria. Con self._lock tomado"""
+        i = self._indices.get(device_id)
+        if i is None:
+            raise KeyError(f"el dispositivo {device_id!r} no está en el almacén PID (¿expulsado?)")
+        return i
+
+    def _alta(self, device_id):
+        """Índice de un dispositivo, dándolo de alta si no existe. Con self._lock tomado"""
+        i = self._indices.get(device_id)
+        if i is not None:
+            return i
+        if self._libres:
+            i = self._libres.pop()
+        else:
+            if self._siguiente >= self._capacidad:
+                self._crecer(self._capacidad * 2)
+            i = self._siguiente
+            self._siguiente += 1
+        self._inicializar(i)
+        self._ids[i] = device_id
+        self._indices[device_id] = i
+        self.created += 1
+        return i
+
+    def indice(self, device_id):
+        """Índice de un dispositivo, dándolo de alta si no existe"""
+        with self._lock:
+            return self._alta(device_id)
+
+    def controlador(self, device_id, estado_inicial=None):
+        """
+        Vista con la interfaz de DevicePIDController, dando de alta el
+        dispositivo si hace falta. `estado_inicial` (p. ej. de un snapshot)
+        solo se aplica si el alta la hace esta llamada.
+        """
+        with self._lock:
+            nuevo = device_id not in self._indices
+            i = self._alta(device_id)
+            if nuevo and estado_inicial:
+                for k in ESTADO_DEFECTO:
+                    if k in estado_inicial:
+                        self._tabla[i, _J[k]] = estado_inicial[k]
+        return _VistaPID(self, device_id)
+
+    def get(self, device_id):
+        """Vista si el dispositivo está en memoria, None si no"""
+        return _VistaPID(self, device_id) if device_id in self._indices else None
+
+    def expulsar(self, device_id):
+        """Da de baja un dispositivo; devuelve su estado o None si no estaba"""
+        with self._lock:
+            return self._baja(device_id)
+
+    def _baja(self, device_id):
+        """Con self._lock tomado"""
+        i = self._indices.pop(device_id, None)
+        if i is None:
+            return None
+        estado = self._estado(i)
+        self.activo[i] = False
+        self._ids[i] = None
+        self._libres.append(i)
+        self.evicted += 1
+        return estado
+
+    def evict_idle(self, ahora=None, conservar=None):
+        """
+        Expulsa los dispositivos sin uso durante idle_ttl_s.
+
+        Args:
+            ahora: instante de referencia (time.monotonic()); por defecto el actual
+            conservar: función device_id -> bool opcional; los que devuelven True
+                se mantienen aunque estén inactivos (se llama sin el lock tomado)
+
+        Returns:
+            list: (device_id, estado) de los expulsados, para guardarlos si hace falta
+        """
+        if self.idle_ttl_s is None:
+            return []
+        if ahora is None:
+            ahora = time.monotonic()
+        with self._lock:
+            n = self._siguiente
+            vencidos = np.flatnonzero(self.activo[:n] & (ahora - self.last_used[:n] >= self.idle_ttl_s))
+            candidatos = [self._ids[i] for i in vencidos]
+        if conservar is not None:
+            candidatos = [d for d in candidatos if not conservar(d)]
+        expulsados = []
+        with self._lock:
+            for device_id in candidatos:
+                i = self._indices.get(device_id)
+                # Usado (o dado de baja) mientras se consultaba conservar
+                if i is None or ahora - self.last_used[i] < self.idle_ttl_s:
+                    continue
+                expulsados.append((device_id, self._baja(device_id)))
+        return expulsados
+
+    def __contains__(self, device_id):
+        return device_id in self._indices
+
+    def __len__(self):
+        return len(self._indices)
+
+    # ------------------------------------------------------------------
+    # Estado (mismo formato que DevicePIDController.get_state)
+    # ------------------------------------------------------------------
+    def _estado(self, i):
+        fila = self._tabla[i].tolist()
+        return {k: int(fila[_J[k]]) if k in _ENTEROS else fila[_J[k]] for k in ESTADO_DEFECTO}
+
+    def get_state(self, device_id):
+        with self._lock:
+            return self._estado(self._fila(device_id))
+
+    def set_state(self, device_id, estado):
+        with self._lock:
+            i = self._fila(device_id)
+            for k in ESTADO_DEFECTO:
+                if k in estado:
+                    self._tabla[i, _J[k]] = estado[k]
+
+    def set_params(self, device_id, **parametros):
+        """Ajusta ganancias o límites de un dispositivo (Kp, Ki, limiteMaxV, ...)"""
+        desconocidos = set(parametros) - set(PARAMETROS)
+        if desconocidos:
+            raise ValueError(f"parámetros PID desconocidos: {sorted(desconocidos)}")
+        with self._lock:
+            i = self._fila(device_id)
+            for k, v in parametros.items():
+                self._tabla[i, _J[k]] = v
+
+    # ------------------------------------------------------------------
+    # Paso del controlador
+    # ------------------------------------------------------------------
+    def calcular_angulos(self, device_id, ldr_tl, ldr_tr, ldr_bl, ldr_br, current_h, current_v,
+                         at_limit_h=False, at_limit_v=False):
+        """Un paso PID de un dispositivo; mismo resultado que DevicePIDController"""
+        with self._lock:
+            i = self._fila(device_id)
+            self.last_used[i] = time.monotonic()
+            # Una lectura y una escritura de la fila por paso
+            fila = self._tabla[i].tolist()
+            resultado = _paso(fila, ldr_tl, ldr_tr, ldr_bl, ldr_br, current_h, current_v,
+                              at_limit_h, at_limit_v)
+            self._tabla[i] = fila
+        return resultado
+
+    def calcular_angulos_lote(self, device_ids, ldr, current_h, current_v, at_limit_h=None, at_limit_v=None,
+                              detalle=False):
+        """
+        Un paso PID de muchos dispositivos a la vez (todos deben estar dados de alta).
+
+        Args:
+            device_ids: secuencia de device_id (sin repetidos)
+            ldr: array (N, 4) de LDRs [tl, tr, bl, br]
+            current_h, current_v: posiciones actuales, arrays (N,)
+            at_limit_h, at_limit_v: arrays booleanos (N,) o None
+            detalle: devolver el resultado de cada dispositivo como calcular_angulos
+
+        Returns:
+            tuple: (nuevo_h, nuevo_v, diffH, diffV) como arrays (N,); con
+            detalle=True, lista de (nuevo_h, nuevo_v, debug_info) por dispositivo
+        """
+        with self._lock:
+            idx = np.fromiter((self._fila(d) for d in device_ids), dtype=np.intp, count=len(device_ids))
+            if len(np.unique(idx)) != len(idx):
+                raise ValueError("cada dispositivo puede aparecer una sola vez por lote")
+            nuevo_h, nuevo_v, diffH, diffV, ejes_h, ejes_v = self._calcular_lote(
+                idx, ldr, current_h, current_v, at_limit_h, at_limit_v)
+        if not detalle:
+            return nuevo_h, nuevo_v, diffH, diffV
+        return [
+            (h, v, {'diffH': dh, 'diffV': dv, 'moverH': mh, 'moverV': mv,
+                    'correccionH': ch, 'correccionV': cv})
+            for h, v, dh, dv, mh, mv, ch, cv in zip(
+                nuevo_h.tolist(), nuevo_v.tolist(), diffH.tolist(), diffV.tolist(),
+                ejes_h[0].tolist(), ejes_v[0].tolist(), ejes_h[1].tolist(), ejes_v[1].tolist())
+        ]
+
+    def _calcular_lote(self, idx, ldr, current_h, current_v, at_limit_h, at_limit_v):
+        ldr = np.asarray(ldr, dtype=np.float64)
+        current_h = np.asarray(current_h, dtype=np.int64)
+        current_v = np.asarray(current_v, dtype=np.int64)
+        n = len(idx)
+        at_limit_h = np.zeros(n, dtype=bool) if at_limit_h is None else np.asarray(at_limit_h, dtype=bool)
+        at_limit_v = np.zeros(n, dtype=bool) if at_limit_v is None else np.asarray(at_limit_v, dtype=bool)
+
+        self.last_used[idx] = time.monotonic()
+        self._col["lastPosH"][idx] = current_h
+        self._col["lastPosV"][idx] = current_v
+
+        tl, tr, bl, br = ldr[:, 0], ldr[:, 1], ldr[:, 2], ldr[:, 3]
+        diffV = (tl + tr) / 2 - (bl + br) / 2
+        diffH = (tl + bl) / 2 - (tr + br) / 2
+
+        nuevo_v, mover_v, correccion_v = self._paso_eje_lote(idx, diffV, current_v, at_limit_v, "V", -1)
+        nuevo_h, mover_h, correccion_h = self._paso_eje_lote(idx, diffH, current_h, at_limit_h, "H", 1)
+        return nuevo_h, nuevo_v, diffH, diffV, (mover_h, correccion_h), (mover_v, correccion_v)
+
+    def _paso_eje_lote(self, idx, error, actual, at_limit, eje, signo):
+        """Paso de un eje para las filas idx; devuelve (nuevo, mover, corrección aplicada o 0)"""
+        c = self._col
+        tolerancia = c["tolerancia"][idx]
+        lim_min = c["limiteMin" + eje][idx]
+        lim_max = c["limiteMax" + eje][idx]
+
+        mover = np.abs(error) > tolerancia
+        # Un error positivo mueve en el sentido de `signo` (el vertical está invertido)
+        hacia_arriba = error * signo > 0
+        bloqueado = at_limit & ((hacia_arriba & (actual >= lim_max)) | (~hacia_arriba & (error != 0) & (actual <= lim_min)))
+        mover &= ~bloqueado
+
+        deriv = error - c["errorPrev" + eje][idx]
+        limite = c["int_limit"][idx]
+        integral = np.clip(c["intErr" + eje][idx] + error, -limite, limite)
+        correccion = c["Kp"][idx] * error + c["Kd"][idx] * deriv + c["Ki"][idx] * integral
+        paso = _paso_maximo_lote(np.abs(error), tolerancia)
+        correccion = np.clip(correccion, -paso, paso)
+
+        nuevo = np.clip(actual + signo * np.trunc(correccion).astype(np.int64), lim_min, lim_max)
+
+        c["intErr" + eje][idx] = np.where(mover, integral, c["intErr" + eje][idx])
+        c["errorPrev" + eje][idx] = np.where(mover, error, c["errorPrev" + eje][idx])
+        return np.where(mover, nuevo, actual).astype(np.int64), mover, np.where(mover, correccion, 0.0)
+
+    def get_stats(self):
+        """Retorna estadísticas actuales del almacén"""
+        with self._lock:
+            return {
+                'devices': len(self._indices),
+                'capacity': self._capacidad,
+                'free_slots': len(self._libres),
+                'bytes': int(self._tabla.nbytes + self.last_used.nbytes + self.activo.nbytes),
+                'created': self.created,
+                'evicted': self.evicted
+            }
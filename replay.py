@@ -0,0 +1,415 @@
+"""
+Replay offline y backtesting sobre capturas JSONL.
+
+Reproduce tráfico grabado de /sensor_values a través de DevicePIDController
+y RiverAnalyzer sin Flask ni InfluxDB, para ajustar Kp/Kd/Ki, umbrales e
+hiperparámetros de los modelos con datos reales en lugar de esperar al sol.
+
+Formato de entrada (una línea JSON por muestra):
+    - el cuerpo tal cual se envía a /sensor_values
+    - o un envoltorio {"ts_ms": ..., "body": {...}} (también "data" o "json")
+    - o un lote {"device_id": ..., "readings": [...]} como /sensor_values/batch
+
+La lectura es un generador: la memoria no crece con el número de muestras,
+solo con el número de dispositivos.
+
+Uso:
+    python replay.py captura.jsonl [--kp 0.02 --kd 0.06 --ki 0.0005] [--sin-river]
+                     [--anomaly-engine hst|hst_subsample|zscore]
+                     [--solar-lat 40.4 --solar-lon -3.7]
+                     [--trayectorias salida.csv] [--json]
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import math
+import sys
+import time
+
+from anomaly_engines import MOTORES as MOTORES_ANOMALIAS
+from ephemeris import AvanceSolar, Montaje
+from features import caracteristicas_muestra
+from pid_controller import DevicePIDController
+from river_analysis import RiverAnalyzer
+
+
+TRACKER_KEYS = ("servo_h", "servo_v", "ldr_tl", "ldr_tr", "ldr_bl", "ldr_br")
+
+
+def _abrir(path):
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def leer_capturas(path, intervalo_ms=5000):
+    """
+    Genera (ts_ms, lectura) para cada muestra del tracker en la captura.
+
+    Las muestras sin timestamp reciben uno sintético separado `intervalo_ms`
+    del anterior, para que la hora del día avance como en producción.
+    """
+    ts_sintetico = int(time.time() * 1000)
+    f = _abrir(path)
+    try:
+        for raw in f:
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                obj = json.loads(raw)
+            except ValueError:
+                continue
+            if not isinstance(obj, dict):
+                continue
+
+            ts_envoltorio = obj.get("ts_ms")
+            for clave in ("body", "data", "json"):
+                if isinstance(obj.get(clave), dict):
+                    obj = obj[clave]
+                    break
+
+            if isinstance(obj.get("readings"), list):
+                device_defecto = obj.get("device_id", "unknown")
+                lecturas = [dict(l, device_id=l.get("device_id", device_defecto))
+                            for l in obj["readings"] if isinstance(l, dict)]
+            else:
+                lecturas = [obj]
+
+            for lectura in lecturas:
+                if not any(k in lectura for k in TRACKER_KEYS):
+                    continue
+                ts = lectura.get("ts_ms", ts_envoltorio)
+                if ts is None:
+                    ts_sintetico += intervalo_ms
+                    ts = ts_sintetico
+                else:
+                    ts = int(ts)
+                    ts_sintetico = ts
+                yield ts, lectura
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+class _Etapas:
+    """Acumula tiempo total y número de llamadas por etapa"""
+
+    def __init__(self):
+        self.total = {}
+        self.llamadas = {}
+
+    def __call__(self, etapa, segundos):
+        self.total[etapa] = self.total.get(etapa, 0.0) + segundos
+        self.llamadas[etapa] = self.llamadas.get(etapa, 0) + 1
+
+    def resumen(self):
+        return {
+            etapa: {
+                'calls': self.llamadas[etapa],
+                'total_s': round(self.total[etapa], 6),
+                'mean_us': round(self.total[etapa] / self.llamadas[etapa] * 1e6, 3)
+            }
+            for etapa in self.total
+        }
+
+
+class _ResumenDispositivo:
+    __slots__ = ("muestras", "primer_cmd", "ultimo_cmd", "recorrido_h", "recorrido_v", "fast_hints")
+
+    def __init__(self):
+        self.muestras = 0
+        self.primer_cmd = None
+        self.ultimo_cmd = None
+        self.recorrido_h = 0
+        self.recorrido_v = 0
+        self.fast_hints = 0
+
+    def to_dict(self):
+        return {
+            'samples': self.muestras,
+            'first_command': self.primer_cmd,
+            'last_command': self.ultimo_cmd,
+            'servo_travel_h': self.recorrido_h,
+            'servo_travel_v': self.recorrido_v,
+            'fast_hints': self.fast_hints
+        }
+
+
+def reproducir(lecturas, pid_params=None, analyzer_params=None, con_river=True,
+               trayectorias=None, max_eventos=100, avance=None):
+    """
+    Reproduce un flujo de lecturas y devuelve el informe de backtesting.
+
+    Args:
+        lecturas: iterable de (ts_ms, dict) como el de leer_capturas
+        pid_params: atributos a sobrescribir en cada DevicePIDController (Kp, Kd, Ki, ...)
+        analyzer_params: kwargs para RiverAnalyzer
+        con_river: False para medir solo el PID
+        trayectorias: csv.writer opcional donde volcar cada paso
+        max_eventos: número máximo de eventos de anomalía/drift guardados en el informe
+        avance: AvanceSolar opcional combinado con el PID como en el servidor. La
+            captura es lazo abierto (las posiciones no siguen a los comandos): los
+            desvíos aprendidos indican el error del montaje configurado
+    """
+    pid_params = pid_params or {}
+    analyzer_params = analyzer_params or {}
+    etapas = _Etapas()
+    reloj = time.perf_counter
+
+    controladores = {}
+    analizadores = {}
+    dispositivos = {}
+
+    eventos = []
+    n_anomalias = 0
+    n_drifts = 0
+    n_pred = 0
+    suma_err = 0.0
+    suma_err2 = 0.0
+    n_baja_eficiencia = 0
+    estados_ambiente = {}
+
+    inicio = reloj()
+    total = 0
+
+    for ts_ms, data in lecturas:
+        device_id = data.get("device_id", "unknown")
+        controller = controladores.get(device_id)
+        if controller is None:
+            controller = DevicePIDController(device_id)
+            for k, v in pid_params.items():
+                setattr(controller, k, v)
+            controladores[device_id] = controller
+            dispositivos[device_id] = _ResumenDispositivo()
+            if con_river:
+                analyzer = RiverAnalyzer(**analyzer_params)
+                analyzer.stage_observer = etapas
+                analizadores[device_id] = analyzer
+
+        t0 = reloj()
+        servo_h = int(data.get("servo_h", 0))
+        servo_v = int(data.get("servo_v", 0))
+        ldr_tl = int(data.get("ldr_tl", 0))
+        ldr_tr = int(data.get("ldr_tr", 0))
+        ldr_bl = int(data.get("ldr_bl", 0))
+        ldr_br = int(data.get("ldr_br", 0))
+        panel_voltage = float(data.get("panel_voltage", float("nan")))
+        t1 = reloj()
+        etapas('parse', t1 - t0)
+
+        nuevo_h, nuevo_v, debug = controller.calcular_angulos(
+            ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v,
+            data.get("at_limit_h", False), data.get("at_limit_v", False)
+        )
+        etapas('pid', reloj() - t1)
+        if avance is not None:
+            t1 = reloj()
+            nuevo_h, nuevo_v, _ = avance.ajustar(device_id, ts_ms, servo_h, servo_v, nuevo_h, nuevo_v,
+                                                 debug['diffH'], debug['diffV'],
+                                                 (ldr_tl + ldr_tr + ldr_bl + ldr_br) / 4.0)
+            etapas('feedforward', reloj() - t1)
+
+        resumen = dispositivos[device_id]
+        resumen.muestras += 1
+        if resumen.primer_cmd is None:
+            resumen.primer_cmd = [nuevo_h, nuevo_v]
+        resumen.ultimo_cmd = [nuevo_h, nuevo_v]
+        resumen.recorrido_h += abs(nuevo_h - servo_h)
+        resumen.recorrido_v += abs(nuevo_v - servo_v)
+        if max(abs(nuevo_h - servo_h), abs(nuevo_v - servo_v)) >= 2:
+            resumen.fast_hints += 1
+
+        anom = drift_res = amb = None
+        if con_river:
+            analyzer = analizadores[device_id]
+            car = caracteristicas_muestra(ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v, ts=ts_ms / 1000.0)
+            res = analyzer.ejecutar_analisis_completo(
+                ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v, panel_voltage,
+                bme_temp_c=data.get("bme_temp_c"), bme_press_hpa=data.get("bme_press_hpa"),
+                bme_hum_pct=data.get("bme_hum_pct"), caracteristicas=car
+            )
+            efic, anom, drift_res, amb = res['eficiencia'], res['anomalias'], res['drift'], res['ambiente']
+
+            if efic['voltage_predicted'] is not None and not math.isnan(efic['error']):
+                n_pred += 1
+                suma_err += efic['error']
+                suma_err2 += efic['error'] ** 2
+                if efic['status'] != 'OK':
+                    n_baja_eficiencia += 1
+
+            estados_ambiente[amb['state']] = estados_ambiente.get(amb['state'], 0) + 1
+
+            if anom['is_anomaly']:
+                n_anomalias += 1
+                if len(eventos) < max_eventos:
+                    eventos.append({'type': 'anomaly', 'device_id': device_id, 'ts_ms': ts_ms,
+                                    'score': round(anom['score'], 4)})
+            if drift_res['drift_detected']:
+                n_drifts += 1
+                if len(eventos) < max_eventos:
+                    eventos.append({'type': 'drift', 'device_id': device_id, 'ts_ms': ts_ms})
+
+        if trayectorias is not None:
+            trayectorias.writerow([
+                device_id, ts_ms, servo_h, servo_v, nuevo_h, nuevo_v,
+                '' if anom is None else round(anom['score'], 4),
+                '' if anom is None else int(anom['is_anomaly']),
+                '' if drift_res is None else int(drift_res['drift_detected']),
+                '' if amb is None else amb['state']
+            ])
+
+        total += 1
+
+    duracion = reloj() - inicio
+
+    return {
+        'samples': total,
+        'devices': len(dispositivos),
+        'elapsed_s': round(duracion, 3),
+        'samples_per_min': round(total / duracion * 60) if duracion > 0 else None,
+        'prediction': {
+            'n': n_pred,
+            'mae': suma_err / n_pred if n_pred else None,
+            'rmse': math.sqrt(suma_err2 / n_pred) if n_pred else None,
+            'low_efficiency_ratio': n_baja_eficiencia / n_pred if n_pred else None
+        },
+        'anomalies': n_anomalias,
+        'drifts': n_drifts,
+        'retrains': {
+            'started': sum(a.reentrenos_iniciados for a in analizadores.values()),
+            'accepted': sum(a.reentrenos_aceptados for a in analizadores.values()),
+            'discarded': sum(a.reentrenos_descartados for a in analizadores.values())
+        },
+        'environment_states': estados_ambiente,
+        'events': eventos,
+        'stages': etapas.resumen(),
+        'per_device': {d: r.to_dict() for d, r in dispositivos.items()},
+        **({'solar': {**avance.get_stats(),
+                      'offsets': {d: avance.get_state(d) for d in dispositivos}}} if avance is not None else {})
+    }
+
+
+def _imprimir(informe):
+    print(f"Muestras: {informe['samples']}  dispositivos: {informe['devices']}  "
+          f"tiempo: {informe['elapsed_s']} s  ({informe['samples_per_min']} muestras/min)")
+    pred = informe['prediction']
+    if pred['n']:
+        print(f"Predicción de voltaje: n={pred['n']} MAE={pred['mae']:.4f} RMSE={pred['rmse']:.4f} "
+              f"LOW_EFFICIENCY={pred['low_efficiency_ratio']:.1%}")
+    print(f"Anomalías: {informe['anomalies']}  drifts: {informe['drifts']}  ambiente: {informe['environment_states']}")
+    reentrenos = informe['retrains']
+    if reentrenos['started']:
+        print(f"Reentrenos tras drift: {reentrenos['started']} iniciados, {reentrenos['accepted']} aceptados, "
+              f"{reentrenos['discarded']} descartados")
+    print("Etapas (media por llamada):")
+    for etapa, st in informe['stages'].items():
+        print(f"  {etapa:<12} {st['mean_us']:>10.1f} us  x{st['calls']}")
+    if 'solar' in informe:
+        solar = informe['solar']
+        print(f"Avance solar: {solar['solar_applied']} aplicados, {solar['solar_jumps']} saltos, "
+              f"{solar['solar_follows']} siguiendo la consigna")
+        for device_id, estado in solar['offsets'].items():
+            if estado:
+                print(f"  {device_id}: desvío aprendido H={estado['desvio_h']:+.1f}° V={estado['desvio_v']:+.1f}°")
+    print("Dispositivos:")
+    for device_id, st in informe['per_device'].items():
+        print(f"  {device_id}: {st['samples']} muestras, recorrido H={st['servo_travel_h']} "
+              f"V={st['servo_travel_v']}, fast={st['fast_hints']}, último cmd={st['last_command']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay offline de capturas de /sensor_values")
+    parser.add_argument("captura", help="fichero JSONL (o .jsonl.gz, o '-' para stdin)")
+    parser.add_argument("--intervalo-ms", type=int, default=5000,
+                        help="separación sintética entre muestras sin timestamp")
+    parser.add_argument("--limite", type=int, default=None, help="procesar como mucho N muestras")
+
+    pid = parser.add_argument_group("PID")
+    pid.add_argument("--kp", type=float)
+    pid.add_argument("--kd", type=float)
+    pid.add_argument("--ki", type=float)
+    pid.add_argument("--tolerancia", type=float)
+
+    modelos = parser.add_argument_group("River")
+    modelos.add_argument("--sin-river", action="store_true", help="solo PID")
+    modelos.add_argument("--sgd-lr", type=float)
+    modelos.add_argument("--hst-trees", type=int)
+    modelos.add_argument("--hst-height", type=int)
+    modelos.add_argument("--hst-window", type=int)
+    modelos.add_argument("--adwin-delta", type=float)
+    modelos.add_argument("--efficiency-threshold", type=float)
+    modelos.add_argument("--anomaly-threshold", type=float)
+    modelos.add_argument("--anomaly-engine", choices=MOTORES_ANOMALIAS)
+    modelos.add_argument("--hst-learn-every", type=int)
+    modelos.add_argument("--zscore-max", type=float)
+    modelos.add_argument("--sin-reentreno", action="store_true",
+                         help="no reentrenar el modelo de eficiencia tras un concept drift")
+    modelos.add_argument("--reentreno-ventana", type=int)
+    modelos.add_argument("--reentreno-margen", type=float)
+
+    solar = parser.add_argument_group("Avance solar (ephemeris.py)")
+    solar.add_argument("--solar-lat", type=float)
+    solar.add_argument("--solar-lon", type=float)
+    solar.add_argument("--solar-azimuth-center", type=float)
+    solar.add_argument("--solar-h-center", type=float, default=110)
+    solar.add_argument("--solar-h-scale", type=float, default=1.0)
+    solar.add_argument("--solar-v-horizon", type=float, default=180)
+    solar.add_argument("--solar-v-scale", type=float, default=-1.0)
+
+    parser.add_argument("--trayectorias", help="CSV donde volcar la trayectoria de servos paso a paso")
+    parser.add_argument("--json", action="store_true", help="imprimir el informe en JSON")
+    args = parser.parse_args(argv)
+
+    pid_params = {k: v for k, v in (("Kp", args.kp), ("Kd", args.kd), ("Ki", args.ki),
+                                    ("tolerancia", args.tolerancia)) if v is not None}
+    analyzer_params = {k: v for k, v in (("sgd_lr", args.sgd_lr), ("hst_n_trees", args.hst_trees),
+                                         ("hst_height", args.hst_height), ("hst_window", args.hst_window),
+                                         ("adwin_delta", args.adwin_delta),
+                                         ("efficiency_threshold", args.efficiency_threshold),
+                                         ("anomaly_threshold", args.anomaly_threshold),
+                                         ("anomaly_engine", args.anomaly_engine),
+                                         ("hst_learn_every", args.hst_learn_every),
+                                         ("zscore_max", args.zscore_max),
+                                         ("reentreno_drift", False if args.sin_reentreno else None),
+                                         ("ventana_reentreno", args.reentreno_ventana),
+                                         ("margen_reentreno", args.reentreno_margen)) if v is not None}
+
+    avance = None
+    if args.solar_lat is not None and args.solar_lon is not None:
+        montaje = Montaje(args.solar_lat, args.solar_lon, acimut_centro=args.solar_azimuth_center,
+                          h_centro=args.solar_h_center, escala_h=args.solar_h_scale,
+                          v_horizonte=args.solar_v_horizon, escala_v=args.solar_v_scale)
+        avance = AvanceSolar(lambda _: montaje)
+
+    lecturas = leer_capturas(args.captura, intervalo_ms=args.intervalo_ms)
+    if args.limite is not None:
+        lecturas = (x for i, x in zip(range(args.limite), lecturas))
+
+    f_tray = None
+    writer = None
+    if args.trayectorias:
+        f_tray = open(args.trayectorias, "w", newline="", encoding="utf-8")
+        writer = csv.writer(f_tray)
+        writer.writerow(["device_id", "ts_ms", "servo_h", "servo_v", "cmd_h", "cmd_v",
+                         "anomaly_score", "is_anomaly", "drift_detected", "env_state"])
+    try:
+        informe = reproducir(lecturas, pid_params, analyzer_params,
+                             con_river=not args.sin_river, trayectorias=writer, avance=avance)
+    finally:
+        if f_tray is not None:
+            f_tray.close()
+
+    if args.json:
+        print(json.dumps(informe, indent=2, ensure_ascii=False))
+    else:
+        _imprimir(informe)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
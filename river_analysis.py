@@ -4,43 +4,87 @@ Módulo de análisis con River ML para el tracker solar.
 Funciones:
 - Predicción de eficiencia del panel solar
 - Detección de anomalías en sensores
-- Detección de concept drift
+- Detección de concept drift y reentrenamiento del modelo de eficiencia
 //prediccion de voltaje
 //indica estado de clima, sirve para un sistema a mayor escala
 """
 
-import time
 import math
-from river import linear_model, preprocessing, anomaly, drift, optim, compose
+import pickle
+import time
+from river import linear_model, preprocessing, drift, optim, compose
 from collections import deque
+from anomaly_engines import crear_detector
+from features import MODEL_KEYS, caracteristicas_muestra, features_modelo
 
 
 class RiverAnalyzer:
     """Analizador de Machine Learning para tracker solar usando River"""
 
-    def __init__(self):
+    # Valores por defecto a nivel de clase: los snapshots antiguos los heredan
+    efficiency_threshold = 0.5
+    anomaly_threshold = 0.7
+    min_training_samples = 10
+    anomaly_engine = "hst"
+    stage_observer = None
+    # Con True las peticiones solo predicen y puntúan; el aprendizaje lo
+    # aplica learner_pool.LearnerPool mediante aprender_diferido
+    aprendizaje_diferido = False
+    _sombra = None
+    publicaciones = 0
+    # Ciclo de vida del modelo de eficiencia (configurar_reentreno)
+    sgd_lr = 0.001
+    l2 = 0.001
+    model_version = 1
+    reentreno_drift = True
+    ventana_reentreno = 300
+    evaluacion_reentreno = 100
+    max_evaluacion_reentreno = 1000
+    margen_reentreno = 0.1
+    _ventana_reciente = None
+    _candidato = None
+    _drift_pendiente = False
+    reentrenos_iniciados = 0
+    reentrenos_aceptados = 0
+    reentrenos_descartados = 0
+    ultimo_reentreno = None
+
+    def __init__(self, sgd_lr=0.001, l2=0.001, hst_n_trees=10, hst_height=8, hst_window=250,
+                 adwin_delta=0.002, efficiency_threshold=0.5, anomaly_threshold=0.7,
+                 min_training_samples=10, anomaly_engine="hst", hst_learn_every=4, zscore_max=4.0,
+                 reentreno_drift=True, ventana_reentreno=300, evaluacion_reentreno=100,
+                 max_evaluacion_reentreno=1000, margen_reentreno=0.1):
+        self.efficiency_threshold = efficiency_threshold
+        self.anomaly_threshold = anomaly_threshold
+        self.min_training_samples = min_training_samples
+
+        # Callback opcional (etapa, segundos) para medir cada etapa del análisis
+        self.stage_observer = None
+
         # 1. PREDICCIÓN DE EFICIENCIA
         # Modelo de regresión adaptativa que predice el voltaje esperado según la luz recibida
         # Características: promedio de LDRs, hora del día, posiciones de servos
-        self.efficiency_model = preprocessing.StandardScaler() | linear_model.LinearRegression(
-            optimizer=optim.SGD(0.001),
-            l2=0.001
-        )
+        self.sgd_lr = sgd_lr
+        self.l2 = l2
+        self.efficiency_model = self._nuevo_modelo_eficiencia()
 
         # 2. DETECCIÓN DE ANOMALÍAS
         # Detecta lecturas fuera de lo normal
-        # HalfSpaceTrees es eficiente para streaming y detecta outliers en tiempo real
-        self.anomaly_detector = anomaly.HalfSpaceTrees(
-            n_trees=10,
-            height=8,
-            window_size=250,
-            seed=42
+        # Por defecto HalfSpaceTrees; anomaly_engines.py tiene motores más baratos
+        self.anomaly_engine = anomaly_engine
+        self.anomaly_detector = crear_detector(
+            anomaly_engine,
+            hst_n_trees=hst_n_trees,
+            hst_height=hst_height,
+            hst_window=hst_window,
+            hst_learn_every=hst_learn_every,
+            zscore_max=zscore_max
         )
 
         # 3. DETECCIÓN DE CONCEPT DRIFT
         # Monitorea cambios en la distribución de datos (cambios estacionales/climáticos)
         # ADWIN detecta cuándo el modelo debe "reaprender" el entorno
-        self.drift_detector = drift.ADWIN(delta=0.002)
+        self.drift_detector = drift.ADWIN(delta=adwin_delta)
 
         # Métricas y contadores
         self.model_predictions_count = 0
@@ -49,6 +93,62 @@ class RiverAnalyzer:
 
         self.avg_light_hist = deque(maxlen=30)
 
+        self.configurar_reentreno(reentreno_drift, ventana_reentreno, evaluacion_reentreno,
+                                  max_evaluacion_reentreno, margen_reentreno)
+
+    def __getstate__(self):
+        # El observador de etapas es configuración del proceso, no del modelo;
+        # la copia de aprendizaje diferido se reconstruye desde los modelos publicados.
+        # La ventana reciente y el candidato los modifica el hilo de aprendizaje
+        # sin el lock del dispositivo: un analizador restaurado empieza sin ellos
+        estado = self.__dict__.copy()
+        estado.pop('stage_observer', None)
+        estado.pop('_sombra', None)
+        estado.pop('_ventana_reciente', None)
+        estado.pop('_candidato', None)
+        return estado
+
+    def configurar_reentreno(self, activo=True, ventana=300, evaluacion=100, max_evaluacion=1000, margen=0.1):
+        """
+        Configura el reentrenamiento del modelo de eficiencia tras un concept drift.
+
+        Al detectar drift se entrena un modelo candidato desde cero con las
+        últimas `ventana` muestras. Desde entonces cada muestra se predice con
+        el modelo vigente y con el candidato antes de aprenderla; cuando el
+        error absoluto medio del candidato en las últimas `evaluacion` muestras
+        es menor que el del vigente en más de `margen` (fracción), lo sustituye
+        y model_version aumenta. Tras `max_evaluacion` muestras sin ganar se
+        descarta. Los drifts que llegan con un candidato en evaluación se ignoran.
+        """
+        self.reentreno_drift = bool(activo)
+        self.ventana_reentreno = max(1, int(ventana))
+        self.evaluacion_reentreno = max(1, int(evaluacion))
+        self.max_evaluacion_reentreno = max(self.evaluacion_reentreno, int(max_evaluacion))
+        self.margen_reentreno = float(margen)
+        if not self.reentreno_drift:
+            self._candidato = None
+            self._ventana_reciente = None
+        else:
+            reciente = self._ventana_reciente
+            if reciente is not None and reciente.maxlen != self.ventana_reentreno:
+                self._ventana_reciente = deque(reciente, maxlen=self.ventana_reentreno)
+
+    def _nuevo_modelo_eficiencia(self):
+        return preprocessing.StandardScaler() | linear_model.LinearRegression(
+            optimizer=optim.SGD(self.sgd_lr),
+            l2=self.l2
+        )
+
+    def cambiar_motor_anomalias(self, motor, **params):
+        """
+        Sustituye el detector de anomalías por uno nuevo del motor indicado
+        (p. ej. al restaurar un snapshot creado con otra configuración).
+        El detector nuevo empieza sin historial.
+        """
+        self.anomaly_detector = crear_detector(motor, **params)
+        self.anomaly_engine = motor
+        self._sombra = None
+
     def calcular_caracteristicas(self, ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v):
         """
         Calcula características derivadas de las lecturas de sensores.
@@ -56,22 +156,10 @@ class RiverAnalyzer:
         Returns:
             tuple: (features_dict, avg_light, light_variance)
         """
-        avg_light = (ldr_tl + ldr_tr + ldr_bl + ldr_br) / 4.0
-        max_light = max(ldr_tl, ldr_tr, ldr_bl, ldr_br)
-        min_light = min(ldr_tl, ldr_tr, ldr_bl, ldr_br)
-        light_variance = ((ldr_tl - avg_light)**2 + (ldr_tr - avg_light)**2 +
-                        (ldr_bl - avg_light)**2 + (ldr_br - avg_light)**2) / 4.0
-
-        features = {
-            'avg_light': avg_light,
-            'max_light': max_light,
-            'min_light': min_light,
-            'light_variance': light_variance,
-            'servo_h': servo_h,
-            'servo_v': servo_v,
-            'hour': time.localtime().tm_hour,
-            'minute': time.localtime().tm_min
-        }
+        caracteristicas = caracteristicas_muestra(ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v)
+        features = features_modelo(caracteristicas)
+        avg_light = features['avg_light']
+        light_variance = features['light_variance']
 
         return features, avg_light, light_variance
 
@@ -92,15 +180,15 @@ class RiverAnalyzer:
             'voltage_real': voltage_real,
             'voltage_predicted': None,
             'error': None,
-            'status': 'TRAINING'
+            'status': 'TRAINING',
+            'model_version': self.model_version
         }
 
-        if self.model_predictions_count > 10:
+        if self.model_predictions_count > self.min_training_samples:
             voltage_predicted = self.efficiency_model.predict_one(features)
             voltage_error = abs(voltage_real - voltage_predicted)
 
-            efficiency_threshold = 0.5
-            efficiency_status = "OK" if voltage_error < efficiency_threshold else "LOW_EFFICIENCY"
+            efficiency_status = "OK" if voltage_error < self.efficiency_threshold else "LOW_EFFICIENCY"
 
             resultado.update({
                 'voltage_predicted': voltage_predicted,
@@ -108,8 +196,12 @@ class RiverAnalyzer:
                 'status': efficiency_status
             })
 
-        # Entrenar el modelo con los datos actuales
-        self.efficiency_model.learn_one(features, voltage_real)
+        # Entrenar el modelo con los datos actuales (en diferido lo hace el LearnerPool)
+        if not self.aprendizaje_diferido:
+            modelo = self._aprender_eficiencia(self.efficiency_model, features, voltage_real)
+            if modelo is not self.efficiency_model:
+                self.efficiency_model = modelo
+                self.model_version += 1
         self.model_predictions_count += 1
 
         return resultado
@@ -129,9 +221,10 @@ class RiverAnalyzer:
         }
 
         anomaly_score = self.anomaly_detector.score_one(anomaly_features)
-        self.anomaly_detector.learn_one(anomaly_features)
+        if not self.aprendizaje_diferido:
+            self.anomaly_detector.learn_one(anomaly_features)
 
-        anomaly_threshold = 0.7
+        anomaly_threshold = self.anomaly_threshold
         is_anomaly = anomaly_score > anomaly_threshold
 
         if is_anomaly:
@@ -140,7 +233,8 @@ class RiverAnalyzer:
         return {
             'score': anomaly_score,
             'is_anomaly': is_anomaly,
-            'threshold': anomaly_threshold
+            'threshold': anomaly_threshold,
+            'features': anomaly_features
         }
 
     def detectar_concept_drift(self, light_variance):
@@ -160,6 +254,10 @@ class RiverAnalyzer:
         if self.drift_detector.drift_detected:
             self.drift_detected_count += 1
             resultado['drift_count'] = self.drift_detected_count
+            # El candidato se crea al aprender la próxima muestra; en diferido
+            # el aviso viaja con el evento de aprendizaje
+            if not self.aprendizaje_diferido:
+                self._drift_pendiente = self.reentreno_drift
 
         return resultado
 
@@ -224,7 +322,7 @@ class RiverAnalyzer:
 
 
 
-    def ejecutar_analisis_completo(self, ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v, panel_voltage, bme_temp_c=None, bme_press_hpa=None, bme_hum_pct=None):
+    def ejecutar_analisis_completo(self, ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v, panel_voltage, bme_temp_c=None, bme_press_hpa=None, bme_hum_pct=None, caracteristicas=None):
         """
         Ejecuta todos los análisis de Machine Learning con River.
 
@@ -232,13 +330,24 @@ class RiverAnalyzer:
             ldr_tl, ldr_tr, ldr_bl, ldr_br: Lecturas de los 4 sensores LDR
             servo_h, servo_v: Posiciones actuales de los servos
             panel_voltage: Voltaje real medido del panel
+            caracteristicas: salida ya calculada de features.caracteristicas_muestra
+                (o una fila de un lote); evita recalcularla
 
         Returns:
             dict: Resultados de todos los análisis
         """
-        features, avg_light, light_variance = self.calcular_caracteristicas(
-            ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v
-        )
+        if self.stage_observer is not None:
+            return self._analisis_medido(ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v, panel_voltage,
+                                         bme_temp_c, bme_press_hpa, bme_hum_pct, caracteristicas)
+
+        if caracteristicas is None:
+            features, avg_light, light_variance = self.calcular_caracteristicas(
+                ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v
+            )
+        else:
+            features = features_modelo(caracteristicas)
+            avg_light = features['avg_light']
+            light_variance = features['light_variance']
 
         eficiencia = self.analizar_eficiencia(features, panel_voltage)
 
@@ -259,14 +368,211 @@ class RiverAnalyzer:
             'eficiencia': eficiencia,
             'anomalias': anomalias,
             'drift': drift,
-            'ambiente': ambiente
+            'ambiente': ambiente,
+            'aprendizaje': (features, panel_voltage, anomalias['features'], drift['drift_detected'])
+                           if self.aprendizaje_diferido else None
         }
 
+    def _analisis_medido(self, ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v, panel_voltage,
+                         bme_temp_c, bme_press_hpa, bme_hum_pct, caracteristicas):
+        """Igual que ejecutar_analisis_completo, informando la duración de cada etapa"""
+        observar = self.stage_observer
+        reloj = time.perf_counter
+
+        t0 = reloj()
+        if caracteristicas is None:
+            features, avg_light, light_variance = self.calcular_caracteristicas(
+                ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v
+            )
+        else:
+            features = features_modelo(caracteristicas)
+            avg_light = features['avg_light']
+            light_variance = features['light_variance']
+        t1 = reloj()
+        observar('features', t1 - t0)
+
+        eficiencia = self.analizar_eficiencia(features, panel_voltage)
+        t2 = reloj()
+        observar('efficiency', t2 - t1)
+
+        anomalias = self.detectar_anomalias(avg_light, light_variance, servo_h, servo_v)
+        t3 = reloj()
+        observar('anomaly', t3 - t2)
+
+        drift = self.detectar_concept_drift(light_variance)
+        t4 = reloj()
+        observar('drift', t4 - t3)
+
+        ambiente = self.clasificar_condicion_ambiental(
+            avg_light, light_variance,
+            bme_temp_c=bme_temp_c,
+            bme_press_hpa=bme_press_hpa,
+            bme_hum_pct=bme_hum_pct,
+            panel_voltage=panel_voltage
+        )
+        observar('environment', reloj() - t4)
+
+        return {
+            'eficiencia': eficiencia,
+            'anomalias': anomalias,
+            'drift': drift,
+            'ambiente': ambiente,
+            'aprendizaje': (features, panel_voltage, anomalias['features'], drift['drift_detected'])
+                           if self.aprendizaje_diferido else None
+        }
+
+    def aprender_diferido(self, eventos, lock):
+        """
+        Aplica eventos de aprendizaje ('aprendizaje' de ejecutar_analisis_completo)
+        fuera de la petición y publica los modelos actualizados.
+
+        Se mantienen dos copias de los modelos: las peticiones leen la
+        publicada y los eventos se aprenden en la otra. Tras aprenderlos se
+        intercambian bajo `lock` (el del dispositivo, que las peticiones tienen
+        tomado mientras predicen) y la copia retirada aprende la misma tanda,
+        de modo que ambas quedan iguales sin copiar árboles en cada tanda.
+        La primera tanda (analizador nuevo o restaurado) parte de una copia,
+        y también la siguiente a un reemplazo del modelo de eficiencia.
+        Solo debe llamarse desde un hilo a la vez por analizador.
+        """
+        primera = self._sombra is None
+        nuevo = self._copiar_modelos() if primera else self._sombra
+        nuevo, reemplazado = self._aprender_en(nuevo, eventos, ciclo=True)
+        with lock:
+            retirado = (self.efficiency_model, self.anomaly_detector)
+            self.efficiency_model, self.anomaly_detector = nuevo
+            if reemplazado:
+                self.model_version += 1
+            self.publicaciones += 1
+        if primera or reemplazado:
+            # HalfSpaceTrees construye sus árboles al aprender la primera muestra:
+            # copiar los ya construidos es más barato que construirlos otra vez
+            self._sombra = self._copiar_modelos()
+        else:
+            # Ninguna petición puede estar leyendo ya la copia retirada
+            self._aprender_en(retirado, eventos)
+            self._sombra = retirado
+
+    def _copiar_modelos(self):
+        """Copia de los modelos publicados (las peticiones solo los leen); pickle es ~3x más rápido que deepcopy"""
+        return pickle.loads(pickle.dumps((self.efficiency_model, self.anomaly_detector),
+                                         protocol=pickle.HIGHEST_PROTOCOL))
+
+    def _aprender_en(self, modelos, eventos, ciclo=False):
+        """
+        Aprende `eventos` en la pareja (modelo de eficiencia, detector).
+        Con `ciclo` pasan además por el reentrenamiento por drift.
+
+        Returns:
+            tuple: (pareja resultante, True si el modelo de eficiencia se reemplazó)
+        """
+        efficiency_model, anomaly_detector = modelos
+        inicial = efficiency_model
+        for features, panel_voltage, anomaly_features, drift_detectado in eventos:
+            if ciclo:
+                efficiency_model = self._aprender_eficiencia(efficiency_model, features, panel_voltage)
+                if drift_detectado:
+                    self._drift_pendiente = self.reentreno_drift
+            else:
+                efficiency_model.learn_one(features, panel_voltage)
+            anomaly_detector.learn_one(anomaly_features)
+        return (efficiency_model, anomaly_detector), efficiency_model is not inicial
+
+    def _aprender_eficiencia(self, modelo, features, panel_voltage):
+        """
+        Aprende una muestra en el modelo de eficiencia `modelo` pasando por el
+        reentrenamiento por drift (configurar_reentreno).
+
+        Returns:
+            el modelo vigente tras la muestra: `modelo` o el candidato que lo reemplaza
+        """
+        if not self.reentreno_drift:
+            modelo.learn_one(features, panel_voltage)
+            return modelo
+
+        ventana = self._ventana_reciente
+        if ventana is None:
+            ventana = self._ventana_reciente = deque(maxlen=self.ventana_reentreno)
+
+        if self._drift_pendiente:
+            self._drift_pendiente = False
+            if self._candidato is None and len(ventana) >= self.min_training_samples:
+                candidato = self._nuevo_modelo_eficiencia()
+                for valores, y in ventana:
+                    candidato.learn_one(dict(zip(MODEL_KEYS, valores)), y)
+                self._candidato = _Candidato(candidato, self.evaluacion_reentreno)
+                self.reentrenos_iniciados += 1
+
+        c = self._candidato
+        if c is not None:
+            # Evaluación prequential: ambos predicen la muestra antes de aprenderla
+            c.evaluar(abs(panel_voltage - modelo.predict_one(features)),
+                      abs(panel_voltage - c.modelo.predict_one(features)))
+            if c.completa():
+                error_vigente, error_candidato = c.errores()
+                if error_candidato < error_vigente * (1.0 - self.margen_reentreno):
+                    self._candidato = None
+                    self.reentrenos_aceptados += 1
+                    self.ultimo_reentreno = {
+                        'ts': time.time(), 'version': self.model_version + 1, 'accepted': True,
+                        'evaluated': c.evaluadas, 'live_mae': error_vigente, 'candidate_mae': error_candidato
+                    }
+                    modelo = c.modelo
+                elif c.evaluadas >= self.max_evaluacion_reentreno:
+                    self._candidato = None
+                    self.reentrenos_descartados += 1
+                    self.ultimo_reentreno = {
+                        'ts': time.time(), 'version': self.model_version, 'accepted': False,
+                        'evaluated': c.evaluadas, 'live_mae': error_vigente, 'candidate_mae': error_candidato
+                    }
+            if modelo is not c.modelo:
+                c.modelo.learn_one(features, panel_voltage)
+
+        modelo.learn_one(features, panel_voltage)
+        # Solo los valores (en el orden de MODEL_KEYS): un dict por muestra ocupa el triple
+        ventana.append((tuple(features.values()), panel_voltage))
+        return modelo
+
     def get_stats(self):
         """Retorna estadísticas actuales del analizador"""
+        # El hilo de aprendizaje cambia el candidato sin el lock del dispositivo: una sola lectura
+        candidato = self._candidato
         return {
             'predictions_count': self.model_predictions_count,
             'anomalies_detected': self.anomalies_detected,
-            'drift_detected_count': self.drift_detected_count
-
+            'drift_detected_count': self.drift_detected_count,
+            'anomaly_engine': self.anomaly_engine,
+            'learning': 'deferred' if self.aprendizaje_diferido else 'inline',
+            'published_models': self.publicaciones,
+            'model_version': self.model_version,
+            'retrain_on_drift': self.reentreno_drift,
+            'retrains_started': self.reentrenos_iniciados,
+            'retrains_accepted': self.reentrenos_aceptados,
+            'retrains_discarded': self.reentrenos_descartados,
+            'retrain_candidate_evaluated': candidato.evaluadas if candidato is not None else None,
+            'last_retrain': self.ultimo_reentreno
         }
+
+
+class _Candidato:
+    """Modelo de eficiencia candidato y sus errores recientes frente al vigente"""
+    __slots__ = ("modelo", "errores_vigente", "errores_candidato", "evaluadas")
+
+    def __init__(self, modelo, evaluacion):
+        self.modelo = modelo
+        self.errores_vigente = deque(maxlen=evaluacion)
+        self.errores_candidato = deque(maxlen=evaluacion)
+        self.evaluadas = 0
+
+    def evaluar(self, error_vigente, error_candidato):
+        self.errores_vigente.append(error_vigente)
+        self.errores_candidato.append(error_candidato)
+        self.evaluadas += 1
+
+    def completa(self):
+        return len(self.errores_vigente) == self.errores_vigente.maxlen
+
+    def errores(self):
+        """Error absoluto medio (vigente, candidato) en la ventana de evaluación"""
+        n = len(self.errores_vigente)
+        return sum(self.errores_vigente) / n, sum(self.errores_candidato) / n
@@ -0,0 +1,185 @@
+"""
+Planificador de muestreo dirigido por el servidor.
+
+En cada respuesta el servidor indica al tracker cada cuánto debe volver a
+informar (campo "fast": fast_interval_ms durante fast_duration_ms; pasado
+ese tiempo el firmware vuelve a su HTTP_SEND_INTERVAL). El intervalo se
+elige por dispositivo a partir de:
+
+    - el error del PID y si los servos se están moviendo (seguimiento activo)
+    - el estado de clasificar_condicion_ambiental (UNSTABLE, SUNNY, ...)
+    - día/noche: poca luz fuera de la franja diurna
+    - la carga del servidor frente a un presupuesto global de peticiones/s
+
+El presupuesto se aplica sobre la tasa proyectada de la flota (suma de
+1000 / intervalo asignado a cada dispositivo activo) y sobre la tasa
+observada; si alguna lo supera, el intervalo se estira en esa proporción.
+"""
+
+import threading
+import time
+
+
+def error_seguimiento(debug_info):
+    """
+    Error del PID que justifica el modo rápido: max(|diffH|, |diffV|) de los
+    ejes que el PID puede mover. Un eje parado en su límite con el sol más
+    allá no se va a corregir por muestrear más deprisa.
+    """
+    return max(abs(debug_info['diffH']) if debug_info['moverH'] else 0.0,
+               abs(debug_info['diffV']) if debug_info['moverV'] else 0.0)
+
+
+class SamplingScheduler:
+    """
+    Intervalos de envío por dispositivo con presupuesto global.
+
+    Args:
+        budget_rps: peticiones/s que puede recibir el servidor de toda la flota
+        fast_ms: intervalo con los servos en movimiento o error grande del PID
+        unstable_ms, cloudy_ms, sunny_ms, night_ms: intervalos por condición
+        min_ms, max_ms: límites absolutos del intervalo
+        error_rapido: error del PID (diferencia LDR) a partir del cual se usa fast_ms
+        luz_noche: luz media por debajo de la cual, fuera de la franja diurna, es de noche
+        hora_amanecer, hora_anochecer: franja diurna (horas locales)
+    """
+
+    RAZONES = ("tracking", "unstable", "cloudy", "sunny", "night")
+
+    def __init__(self, budget_rps=200.0, fast_ms=400, unstable_ms=500, cloudy_ms=1000,
+                 sunny_ms=2000, night_ms=30000, min_ms=200, max_ms=60000,
+                 error_rapido=250, luz_noche=150, hora_amanecer=6, hora_anochecer=21):
+        self.budget_rps = float(budget_rps)
+        self.intervalos = {
+            "tracking": int(fast_ms),
+            "unstable": int(unstable_ms),
+            "cloudy": int(cloudy_ms),
+            "sunny": int(sunny_ms),
+            "night": int(night_ms),
+        }
+        self.min_ms = int(min_ms)
+        self.max_ms = int(max_ms)
+        self.error_rapido = float(error_rapido)
+        self.luz_noche = float(luz_noche)
+        self.hora_amanecer = int(hora_amanecer)
+        self.hora_anochecer = int(hora_anochecer)
+
+        # device_id -> (intervalo_ms, razón, expira_en monotonic)
+        self._asignados = {}
+        self._tasa_proyectada = 0.0
+        self._lock = threading.Lock()
+
+        # Tasa observada: peticiones contadas por ventanas de 1 s, suavizada
+        self._ventana_inicio = time.monotonic()
+        self._ventana_cuenta = 0
+        self.tasa_observada = 0.0
+
+        self._ultima_purga = time.monotonic()
+        self.estiramientos = 0
+
+    def _razon(self, error_pid, en_movimiento, estado, luz_media, hora):
+        if en_movimiento or error_pid >= self.error_rapido:
+            return "tracking"
+        diurno = self.hora_amanecer <= hora < self.hora_anochecer
+        if luz_media <= self.luz_noche and not diurno:
+            return "night"
+        if estado == "UNSTABLE":
+            return "unstable"
+        if estado == "SUNNY":
+            return "sunny"
+        return "cloudy"
+
+    def siguiente(self, device_id, error_pid, en_movimiento, estado, luz_media, hora, ahora=None):
+        """
+        Elige el próximo intervalo de envío de un dispositivo.
+
+        Args:
+            error_pid: max(|diffH|, |diffV|) del PID
+            en_movimiento: el comando mueve algún servo
+            estado: estado ambiental ("SUNNY", "CLOUDY", "UNSTABLE", "HUMID_HAZY") o None
+            luz_media: media de los 4 LDR
+            hora: hora local de la lectura (0-23)
+
+        Returns:
+            dict: {"fast_interval_ms", "fast_duration_ms", "reason"}
+        """
+        if ahora is None:
+            ahora = time.monotonic()
+        razon = self._razon(error_pid, en_movimiento, estado, luz_media, hora)
+        deseado = self.intervalos[razon]
+
+        with self._lock:
+            self._contar(ahora)
+            if ahora - self._ultima_purga >= 1.0:
+                self._purgar(ahora)
+
+            previo = self._asignados.get(device_id)
+            otros = self._tasa_proyectada - (1000.0 / previo[0] if previo else 0.0)
+            proyectada = otros + 1000.0 / deseado
+            factor = max(1.0, proyectada / self.budget_rps, self.tasa_observada / self.budget_rps)
+            intervalo = int(min(self.max_ms, max(self.min_ms, deseado * factor)))
+            if intervalo > deseado:
+                self.estiramientos += 1
+
+            # El tracker vuelve a su intervalo por defecto si no recibe otra
+            # indicación en ~4 intervalos (p. ej. respuestas perdidas)
+            duracion = max(3000, intervalo * 4)
+            self._asignados[device_id] = (intervalo, razon, ahora + duracion / 1000.0)
+            self._tasa_proyectada = otros + 1000.0 / intervalo
+
+        return {"fast_interval_ms": intervalo, "fast_duration_ms": duracion, "reason": razon}
+
+    def _contar(self, ahora):
+        """Con self._lock tomado"""
+        transcurrido = ahora - self._ventana_inicio
+        if transcurrido >= 1.0:
+            tasa = self._ventana_cuenta / transcurrido
+            # Media móvil exponencial: reacciona en pocos segundos sin oscilar
+            self.tasa_observada = 0.7 * self.tasa_observada + 0.3 * tasa
+            self._ventana_inicio = ahora
+            self._ventana_cuenta = 0
+        self._ventana_cuenta += 1
+
+    def _purgar(self, ahora):
+        """Olvida dispositivos cuya indicación expiró (dejaron de informar). Con self._lock tomado"""
+        vencidos = [d for d, (_, _, expira) in self._asignados.items() if expira < ahora]
+        for d in vencidos:
+            del self._asignados[d]
+        self._tasa_proyectada = sum(1000.0 / i for i, _, _ in self._asignados.values())
+        self._ultima_purga = ahora
+
+    def olvidar(self, device_id):
+        with self._lock:
+            previo = self._asignados.pop(device_id, None)
+            if previo:
+                self._tasa_proyectada -= 1000.0 / previo[0]
+
+    def intervalo(self, device_id):
+        """(intervalo_ms, razón) asignados a un dispositivo, o None"""
+        with self._lock:
+            previo = self._asignados.get(device_id)
+        return previo[:2] if previo else None
+
+    def tasa_proyectada(self):
+        return self._tasa_proyectada
+
+    def get_stats(self, por_dispositivo=False):
+        """Retorna el estado del planificador (presupuesto, tasas e intervalos)"""
+        with self._lock:
+            asignados = dict(self._asignados)
+            proyectada = self._tasa_proyectada
+        por_razon = dict.fromkeys(self.RAZONES, 0)
+        for _, razon, _ in asignados.values():
+            por_razon[razon] += 1
+        stats = {
+            'budget_rps': self.budget_rps,
+            'projected_rps': round(proyectada, 3),
+            'observed_rps': round(self.tasa_observada, 3),
+            'devices': len(asignados),
+            'devices_by_reason': por_razon,
+            'stretched': self.estiramientos,
+            'intervals_ms': dict(self.intervalos)
+        }
+        if por_dispositivo:
+            stats['assigned'] = {d: {'interval_ms': i, 'reason': r} for d, (i, r, _) in asignados.items()}
+        return stats
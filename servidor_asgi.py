@@ -0,0 +1,333 @@
+"""
+Servidor asyncio (ASGI) con el mismo contrato que servidor_flask.
+
+Con Flask cada petición ocupa un hilo mientras dura; con cientos de trackers
+en modo rápido (una lectura cada 400 ms) el número de hilos limita la
+concurrencia. Aquí las conexiones las atiende un único event loop:
+
+    - El trabajo de CPU (PID y modelos River) va a un ThreadPoolExecutor
+      acotado (ASGI_EXECUTOR_THREADS), reutilizando los handlers de
+      servidor_flask con sus locks por dispositivo.
+    - Un asyncio.Lock por dispositivo ordena sus lecturas antes de entrar al
+      executor, de modo que un tracker muy activo no deja hilos del pool
+      bloqueados esperando su propio lock.
+    - InfluxDB se escribe con AsyncInfluxBatchWriter (influx_async.py), un
+      cliente aiohttp no bloqueante con el mismo spool y circuit breaker.
+
+El estado por dispositivo sigue viviendo en memoria del proceso, así que se
+ejecuta con un único worker:
+
+    uvicorn servidor_asgi:app --host 0.0.0.0 --port 6000 --workers 1 --backlog 4096
+    python servidor_asgi.py
+"""
+
+import asyncio
+import json
+import os
+import time
+import traceback
+import weakref
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+# Debe fijarse antes de importar servidor_flask: selecciona el escritor asyncio
+os.environ["SERVER_MODE"] = "asgi"
+
+import line_protocol
+import servidor_flask as sf
+from influx_writer import CircuitOpenError
+from metrics import MetricsRegistry
+
+
+ASGI_EXECUTOR_THREADS = int(os.environ.get('ASGI_EXECUTOR_THREADS', str(min(32, (os.cpu_count() or 1) + 4))))
+ASGI_MAX_BODY_BYTES = int(os.environ.get('ASGI_MAX_BODY_BYTES', str(4 * 1024 * 1024)))
+
+_executor = ThreadPoolExecutor(max_workers=ASGI_EXECUTOR_THREADS, thread_name_prefix="river")
+
+# Un lock asyncio por dispositivo mientras haya peticiones que lo usen
+_locks_dispositivo = weakref.WeakValueDictionary()
+
+
+def _lock_dispositivo(device_id):
+    lock = _locks_dispositivo.get(device_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _locks_dispositivo[device_id] = lock
+    return lock
+
+
+async def _en_executor(funcion, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, funcion, *args)
+
+
+def _compacto(cabeceras, consulta):
+    return sf.pide_compacto(consulta.get("format", [None])[0], cabeceras.get("x-response-format"))
+
+
+# ----------------------------------------------------------------------
+# Handlers
+# ----------------------------------------------------------------------
+async def sensor_values(cuerpo, cabeceras, consulta):
+    obs = sf.stage_observer
+    if obs:
+        t0 = time.perf_counter()
+    if sf.es_binario(cabeceras.get("content-type")):
+        try:
+            data = sf.decodificar_lectura_binaria(cuerpo)
+        except ValueError as e:
+            return {"status": "error", "msg": str(e)}, 400
+        if obs:
+            obs('binary_decode', time.perf_counter() - t0)
+        async with _lock_dispositivo(data["device_id"]):
+            return await _en_executor(sf.atender_lectura_tracker, data, _compacto(cabeceras, consulta))
+
+    try:
+        data = json.loads(cuerpo) if cuerpo else {}
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    if obs:
+        obs('json_parse', time.perf_counter() - t0)
+
+    # Caso: datos del tracker solar
+    if sf.es_lectura_tracker(data):
+        async with _lock_dispositivo(data.get("device_id", "unknown")):
+            return await _en_executor(sf.atender_lectura_tracker, data, _compacto(cabeceras, consulta))
+
+    # pruebas iniciales con el pot
+    try:
+        pot_value = int(data.get("pot_value", 0))
+        voltage = float(data.get("voltage", float("nan")))
+    except (TypeError, ValueError) as e:
+        return {"status": "error", "msg": str(e)}, 500
+
+    ts_ms = int(time.time() * 1000)
+    line = line_protocol.POTENTIOMETER.codificar(("esp32",), (pot_value, voltage), ts_ms)
+
+    try:
+        r = await sf.influx_client.write(line)
+        ok = (204 == r.status_code)
+        return {
+            "status": "ok" if ok else "error",
+            "influx_status_code": r.status_code,
+            "received": data
+        }, (200 if ok else 500)
+    except (CircuitOpenError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # InfluxDB caído: la lectura pasa por el escritor y, si sigue caído, al spool
+        if sf.influx_spool is not None and sf.influx_writer.put(line):
+            return {"status": "queued", "msg": str(e), "received": data}, 202
+        return {"status": "error", "msg": str(e) or repr(e)}, 500
+
+
+async def sensor_values_batch(cuerpo, cabeceras, consulta):
+    mimetype = cabeceras.get("content-type", "").split(";")[0].strip().lower()
+    try:
+        lecturas = sf.interpretar_lote(cuerpo, mimetype)
+    except ValueError as e:
+        return {"status": "error", "msg": str(e)}, 400
+
+    # Lock asyncio de todos los dispositivos del lote, en orden fijo para no cruzarse
+    locks = [_lock_dispositivo(d) for d in sorted({l["device_id"] for l in lecturas}, key=str)]
+    for lock in locks:
+        await lock.acquire()
+    try:
+        return await _en_executor(sf.atender_lote, lecturas, _compacto(cabeceras, consulta))
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+
+async def influx_stats(cuerpo, cabeceras, consulta):
+    return sf.estadisticas_influx(), 200
+
+
+async def registry_stats(cuerpo, cabeceras, consulta):
+    stats = sf.model_registry.get_stats()
+    stats['pid'] = sf.pid_store.get_stats()
+    stats['anomaly_engine'] = {'default': sf.ANOMALY_ENGINE, 'devices': sf.ANOMALY_ENGINE_DEVICES}
+    if sf.avance_solar is not None:
+        stats.update(sf.avance_solar.get_stats())
+    if sf.learner_pool is not None:
+        stats.update(sf.learner_pool.get_stats())
+    if sf.historial is not None:
+        stats.update(sf.historial.get_stats())
+    if sf.snapshot_store:
+        stats['snapshots'] = sf.snapshot_store.get_stats()
+    stats['asgi_executor_threads'] = ASGI_EXECUTOR_THREADS
+    return stats, 200
+
+
+async def scheduler_stats(cuerpo, cabeceras, consulta):
+    por_dispositivo = consulta.get("devices", ["0"])[0] in ("1", "true", "True")
+    return sf.planificador.get_stats(por_dispositivo), 200
+
+
+async def ready(cuerpo, cabeceras, consulta):
+    return sf.estado_arranque()
+
+
+async def metrics(cuerpo, cabeceras, consulta):
+    return sf.metricas.render(), 200
+
+
+async def device_analysis(device_id, consulta):
+    cuerpo = sf.ultima_respuesta(device_id)
+    if cuerpo is None:
+        return {"status": "error", "msg": f"sin lecturas de {device_id}"}, 404
+    return cuerpo, 200
+
+
+async def device_recent(device_id, consulta):
+    return sf.historial_dispositivo(device_id, consulta)
+
+
+async def device_stats(device_id, consulta):
+    return sf.estadisticas_dispositivo(device_id, consulta)
+
+
+async def devices(cuerpo, cabeceras, consulta):
+    return sf.listar_dispositivos()
+
+
+# (método, ruta) -> (nombre del endpoint para /metrics, handler)
+RUTAS = {
+    ("POST", "/sensor_values"): ("sensor_values", sensor_values),
+    ("POST", "/sensor_values/batch"): ("sensor_values_batch", sensor_values_batch),
+    ("GET", "/influx_stats"): ("influx_stats", influx_stats),
+    ("GET", "/registry_stats"): ("registry_stats", registry_stats),
+    ("GET", "/scheduler_stats"): ("scheduler_stats", scheduler_stats),
+    ("GET", "/metrics"): ("metrics", metrics),
+    ("GET", "/ready"): ("ready", ready),
+    ("GET", "/devices"): ("devices", devices),
+}
+
+# GET /devices/<id>/<vista> -> (endpoint, handler(device_id, consulta))
+RUTAS_DISPOSITIVO = {
+    "analysis": ("device_analysis", device_analysis),
+    "recent": ("device_recent", device_recent),
+    "stats": ("device_stats", device_stats),
+}
+
+
+# ----------------------------------------------------------------------
+# Aplicación ASGI
+# ----------------------------------------------------------------------
+class CuerpoDemasiadoGrande(Exception):
+    """El cuerpo supera ASGI_MAX_BODY_BYTES"""
+
+
+async def _leer_cuerpo(receive):
+    partes = []
+    total = 0
+    while True:
+        mensaje = await receive()
+        if mensaje["type"] == "http.disconnect":
+            return None
+        trozo = mensaje.get("body", b"")
+        total += len(trozo)
+        if total > ASGI_MAX_BODY_BYTES:
+            raise CuerpoDemasiadoGrande(f"cuerpo mayor que {ASGI_MAX_BODY_BYTES} bytes")
+        partes.append(trozo)
+        if not mensaje.get("more_body", False):
+            return b"".join(partes)
+
+
+async def _responder(send, codigo, contenido, content_type):
+    await send({
+        "type": "http.response.start",
+        "status": codigo,
+        "headers": [(b"content-type", content_type.encode("latin-1")),
+                    (b"content-length", str(len(contenido)).encode("latin-1"))],
+    })
+    await send({"type": "http.response.body", "body": contenido})
+
+
+async def _bucle_mantenimiento():
+    # Equivalente al hilo "mantenimiento" de servidor_flask (no se arranca en modo ASGI)
+    while True:
+        await asyncio.sleep(sf.MAINTENANCE_INTERVAL_S)
+        await _en_executor(sf.mantenimiento)
+
+
+async def _lifespan(receive, send):
+    mantenimiento = None
+    while True:
+        mensaje = await receive()
+        if mensaje["type"] == "lifespan.startup":
+            try:
+                await sf.influx_writer.start()
+                if sf.rollup_writer is not sf.influx_writer:
+                    await sf.rollup_writer.start()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": repr(e)})
+                return
+            mantenimiento = asyncio.ensure_future(_bucle_mantenimiento())
+            await send({"type": "lifespan.startup.complete"})
+        elif mensaje["type"] == "lifespan.shutdown":
+            if mantenimiento is not None:
+                mantenimiento.cancel()
+                try:
+                    await mantenimiento
+                except asyncio.CancelledError:
+                    pass
+            if sf.agregador is not None:
+                sf.agregador.cerrar_todo()
+            if sf.rollup_writer is not sf.influx_writer:
+                await sf.rollup_writer.stop()
+            await sf.influx_writer.stop()
+            _executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    inicio = time.perf_counter()
+    ruta = RUTAS.get((scope["method"], scope["path"]))
+    # /devices/<id>/<vista> (scope["path"] ya viene decodificado)
+    partes = scope["path"].strip("/").split("/")
+    if ruta is None and scope["method"] == "GET" and len(partes) == 3 \
+            and partes[0] == "devices" and partes[2] in RUTAS_DISPOSITIVO:
+        endpoint, handler = RUTAS_DISPOSITIVO[partes[2]]
+        consulta = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+        contenido, codigo = await handler(partes[1], consulta)
+    elif ruta is None:
+        endpoint = "unknown"
+        codigo, contenido = 404, {"status": "error", "msg": "ruta no encontrada"}
+    else:
+        endpoint, handler = ruta
+        cabeceras = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        consulta = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        try:
+            cuerpo = await _leer_cuerpo(receive)
+            if cuerpo is None:
+                return
+            contenido, codigo = await handler(cuerpo, cabeceras, consulta)
+        except CuerpoDemasiadoGrande as e:
+            codigo, contenido = 413, {"status": "error", "msg": str(e)}
+        except Exception as e:
+            print("[EXCEPTION] asgi:", repr(e))
+            traceback.print_exc()
+            codigo, contenido = 500, {"status": "error", "msg": str(e)}
+
+    if isinstance(contenido, str):
+        await _responder(send, codigo, contenido.encode("utf-8"), MetricsRegistry.CONTENT_TYPE)
+    else:
+        await _responder(send, codigo, json.dumps(contenido).encode("utf-8"), "application/json")
+
+    if sf.METRICS_ENABLED:
+        sf.m_request_seconds.observe(time.perf_counter() - inicio, (endpoint, str(codigo)))
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=6000, workers=1, backlog=4096,
+                log_level="debug" if sf.DEBUG_MODE else "warning")
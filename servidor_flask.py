@@ -1,150 +1,35 @@
-from flask import Flask, request, jsonify
-import requests
+from flask import Flask, request, jsonify, g, Response
 import time
-import math
 import os
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS
-from river_analysis import RiverAnalyzer
+import json
+import atexit
+import threading
+from contextlib import ExitStack
+from anomaly_engines import MOTORES as MOTORES_ANOMALIAS
+import binary_format
+from pid_store import PIDControllerStore
+from requests import RequestException
+from influx_writer import InfluxBatchWriter, InfluxHTTPClient, CircuitBreaker, CircuitOpenError
+from spool import WriteAheadSpool
+import line_protocol
+from model_registry import ModelRegistry
+from learner_pool import LearnerPool
+from snapshots import SnapshotStore
+from aggregates import AgregadorTracker
+from history import HistorialReciente
+from features import caracteristicas_muestra, calcular_caracteristicas_lote, filas
+from metrics import MetricsRegistry
+from sampling import SamplingScheduler, error_seguimiento
+from ephemeris import AvanceSolar, Montaje, TablaSolar
 
 
 DEBUG_MODE = os.environ.get("FLASK_DEBUG", "0") in ("1", "true", "True")
 
 app = Flask("servidor_flask")
 
-device_states = {}
-
-class DevicePIDController:
-    """Controlador PID independiente para cada dispositivo ESP32"""
-    def __init__(self, device_id):
-        self.device_id = device_id
-
-        self.Kp = 0.02
-        self.Kd = 0.06
-        self.Ki = 0.0005
-        self.maxCambio = 5
-        self.tolerancia = 1
-
-        self.errorPrevH = 0
-        self.errorPrevV = 0
-        self.intErrH = 0.0
-        self.intErrV = 0.0
-        self.int_limit = 5000
-
-        self.limiteMinH = 40
-        self.limiteMaxH = 180
-        self.limiteMinV = 40
-        self.limiteMaxV = 175
-
-        self.lastPosH = 120
-        self.lastPosV = 150
-
-
-
-    def calcular_angulos(self, ldr_tl, ldr_tr, ldr_bl, ldr_br, current_h, current_v, at_limit_h=False, at_limit_v=False):
-        """
-        Uso de PID para determinar posicion de servos
-        """
-        self.lastPosH = current_h
-        self.lastPosV = current_v
-
-        promedioArriba = (ldr_tl + ldr_tr) / 2
-        promedioAbajo = (ldr_bl + ldr_br) / 2
-        promedioIzquierda = (ldr_tl + ldr_bl) / 2
-        promedioDerecha = (ldr_tr + ldr_br) / 2
-
-        diffV = promedioArriba - promedioAbajo
-        diffH = promedioIzquierda - promedioDerecha
-
-      #  moverV = False
-       # moverH = False
-
-        #if abs(diffV) > self.tolerancia or abs(diffH) > self.tolerancia:
-         #   if abs(diffV) > abs(diffH):
-          #      moverV = True
-           # else:
-            #    moverH = True
-
-        #cambio
-        #para que ambos ejes se puedan estar moviendo sin darle prioridad a otro
-        moverV = abs(diffV) > self.tolerancia
-        moverH = abs(diffH) > self.tolerancia
-
-
-        nuevo_h = current_h
-        nuevo_v = current_v
-        debug_info = {
-            'diffH': diffH,
-            'diffV': diffV,
-            'moverH': moverH,
-            'moverV': moverV,
-            'correccionH': 0,
-            'correccionV': 0
-        }
-
-        # Función auxiliar: tamaño de paso no lineal según magnitud de error
-        def step_from_diff(d):
-            ad = abs(d)
-            if ad > 1200:
-                return 10
-            if ad > 600:
-                return 8
-            if ad > 250:
-                return 6
-            if ad > 80:
-                return 4
-            if ad > self.tolerancia:
-                return 2
-            return 0
-
-        if moverV:
-            if at_limit_v:
-                if (diffV > 0 and current_v >= self.limiteMaxV) or (diffV < 0 and current_v <= self.limiteMinV):
-                    moverV = False
-
-            if moverV:
-                errorV = diffV
-                derivV = errorV - self.errorPrevV
-                self.intErrV += errorV
-                self.intErrV = max(min(self.intErrV, self.int_limit), -self.int_limit)
-                correccionV = (self.Kp * errorV) + (self.Kd * derivV) + (self.Ki * self.intErrV)
-                max_step_v = step_from_diff(errorV)
-                correccionV = max(min(correccionV, max_step_v), -max_step_v)
-
-                nuevo_v = current_v - int(correccionV)  # Invertido
-                nuevo_v = max(min(nuevo_v, self.limiteMaxV), self.limiteMinV)
-
-                self.errorPrevV = errorV
-                debug_info['correccionV'] = correccionV
-
-        if moverH:
-            if at_limit_h:
-                if (diffH > 0 and current_h >= self.limiteMaxH) or (diffH < 0 and current_h <= self.limiteMinH):
-                    moverH = False
-
-            if moverH:
-                errorH = diffH
-                derivH = errorH - self.errorPrevH
-                self.intErrH += errorH
-                self.intErrH = max(min(self.intErrH, self.int_limit), -self.int_limit)
-                correccionH = (self.Kp * errorH) + (self.Kd * derivH) + (self.Ki * self.intErrH)
-                max_step_h = step_from_diff(errorH)
-                correccionH = max(min(correccionH, max_step_h), -max_step_h)
-
-                nuevo_h = current_h + int(correccionH)
-                nuevo_h = max(min(nuevo_h, self.limiteMaxH), self.limiteMinH)
-
-                self.errorPrevH = errorH
-                debug_info['correccionH'] = correccionH
-
-        return nuevo_h, nuevo_v, debug_info
-
-
-def get_device_controller(device_id):
-    """Obtiene o crea el controlador PID para un dispositivo"""
-    if device_id not in device_states:
-        device_states[device_id] = DevicePIDController(device_id)
-    return device_states[device_id]
+# Callback opcional (etapa, segundos) para medir el hot path de /sensor_values
+# (benchmarks e instrumentación). None = sin coste adicional.
+stage_observer = None
 
 def _load_env_file(path: str = ".env"):
     try:
@@ -169,198 +54,1249 @@ INFLUX_URL_BASE = os.environ.get('INFLUX_URL_BASE', '127.0.0.1')
 INFLUX_TOKEN    = os.environ.get('INFLUX_TOKEN', 'NtZ58sLCY9fxPHq5yzC5qOr8iXVGHq81XWZs5wqu4JrN8EFgPLpFb7h96IrxCoJSSrJH85SilSxO0rrgH9VAIA==')
 INFLUX_ORG      = os.environ.get('INFLUX_ORG', 'UC3M')
 INFLUX_BUCKET   = os.environ.get('INFLUX_BUCKET', 'Pot_pruebas')
+INFLUX_PORT     = int(os.environ.get('INFLUX_PORT', '8086'))
 
-WRITE_URL = 'http://{}:8086/api/v2/write?org={}&bucket={}&precision=ms'.format(INFLUX_URL_BASE,INFLUX_ORG,INFLUX_BUCKET)
+WRITE_URL = 'http://{}:{}/api/v2/write?org={}&bucket={}&precision=ms'.format(INFLUX_URL_BASE,INFLUX_PORT,INFLUX_ORG,INFLUX_BUCKET)
 HEADERS = {
     "Authorization": f"Token {INFLUX_TOKEN}",
     "Content-Type": "text/plain; charset=utf-8"
 }
 
-river_analyzer = RiverAnalyzer()
+# Con SERVER_MODE=asgi (servidor_asgi.py) el envío a InfluxDB lo hace una
+# tarea del event loop con un cliente aiohttp; la arranca el propio servidor
+ASGI_MODE = os.environ.get('SERVER_MODE', 'wsgi') == 'asgi'
+
+_cliente_kwargs = dict(
+    pool_size=int(os.environ.get('INFLUX_POOL_SIZE', '16')),
+    connect_timeout=float(os.environ.get('INFLUX_CONNECT_TIMEOUT_S', '2')),
+    read_timeout=float(os.environ.get('INFLUX_READ_TIMEOUT_S', '5')),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.environ.get('INFLUX_BREAKER_FAILURES', '5')),
+        reset_timeout_s=float(os.environ.get('INFLUX_BREAKER_RESET_S', '30'))
+    )
+)
+
+# Cliente HTTP compartido: pool keep-alive dimensionado a los hilos del servidor,
+# timeouts separados y circuit breaker para no insistir con InfluxDB caído
+if ASGI_MODE:
+    from influx_async import AsyncInfluxHTTPClient, AsyncInfluxBatchWriter
+    influx_client = AsyncInfluxHTTPClient(WRITE_URL, HEADERS, **_cliente_kwargs)
+else:
+    influx_client = InfluxHTTPClient(WRITE_URL, HEADERS, **_cliente_kwargs)
+
+# Codificación a line protocol (esquemas precompilados). Opcionalmente se
+# omiten los campos que no cambiaron desde el punto anterior del dispositivo
+if os.environ.get('LP_SKIP_UNCHANGED', '0') in ("1", "true", "True"):
+    codificador_tracker = line_protocol.OmitirSinCambios(
+        line_protocol.TRACKER, refresco_cada=int(os.environ.get('LP_REFRESH_EVERY', '60')))
+else:
+    codificador_tracker = line_protocol.TRACKER
+
+# Spool en disco: con InfluxDB caído los lotes se guardan y se reenvían al volver
+SPOOL_ENABLED = os.environ.get('SPOOL_ENABLED', '1') in ("1", "true", "True")
+
+
+def _crear_spool(subdirectorio=None):
+    directorio = os.environ.get('SPOOL_DIR', 'spool')
+    if os.environ.get('CLUSTER_WORKER_ID'):
+        # Cada backend del cluster tiene su propio spool (un único escritor por directorio)
+        directorio = os.path.join(directorio, f"worker-{os.environ['CLUSTER_WORKER_ID']}")
+    if subdirectorio:
+        directorio = os.path.join(directorio, subdirectorio)
+    return WriteAheadSpool(
+        directorio,
+        segment_max_bytes=int(os.environ.get('SPOOL_SEGMENT_MAX_BYTES', str(8 * 1024 * 1024))),
+        max_total_bytes=int(os.environ.get('SPOOL_MAX_BYTES', str(512 * 1024 * 1024))),
+        fsync_policy=os.environ.get('SPOOL_FSYNC_POLICY', 'interval'),
+        fsync_interval_s=float(os.environ.get('SPOOL_FSYNC_INTERVAL_S', '1.0'))
+    )
+
+
+influx_spool = _crear_spool() if SPOOL_ENABLED else None
+
+# Escritura por lotes en segundo plano: el handler solo encola la línea
+_escritor_kwargs = dict(
+    batch_size=int(os.environ.get('INFLUX_BATCH_SIZE', '500')),
+    flush_interval_s=float(os.environ.get('INFLUX_FLUSH_INTERVAL_S', '1.0')),
+    max_queue=int(os.environ.get('INFLUX_QUEUE_MAX', '10000')),
+    overflow_policy=os.environ.get('INFLUX_OVERFLOW_POLICY', 'drop_oldest'),
+    max_retries=int(os.environ.get('INFLUX_MAX_RETRIES', '3')),
+    gzip_enabled=os.environ.get('INFLUX_GZIP', '1') in ("1", "true", "True"),
+    replay_batch_size=int(os.environ.get('SPOOL_REPLAY_BATCH', '5000'))
+)
+
+
+def _crear_escritor(cliente, spool):
+    if ASGI_MODE:
+        return AsyncInfluxBatchWriter(cliente, spool=spool, **_escritor_kwargs)
+    escritor = InfluxBatchWriter(cliente, spool=spool, **_escritor_kwargs).start()
+    atexit.register(escritor.stop)
+    return escritor
+
+
+influx_writer = _crear_escritor(influx_client, influx_spool)
+
+# Rollups de 1 min y 1 h por dispositivo (aggregates.py). Con INFLUX_ROLLUP_BUCKET
+# van a otro bucket (retención larga) y el de datos crudos puede tener una
+# retención corta; INFLUX_RAW_WRITES=0 deja de escribir los puntos crudos
+ROLLUPS_ENABLED = os.environ.get('ROLLUPS_ENABLED', '1') in ("1", "true", "True")
+INFLUX_RAW_WRITES = os.environ.get('INFLUX_RAW_WRITES', '1') in ("1", "true", "True")
+INFLUX_ROLLUP_BUCKET = os.environ.get('INFLUX_ROLLUP_BUCKET') or None
+
+rollup_writer = influx_writer
+if ROLLUPS_ENABLED and INFLUX_ROLLUP_BUCKET and INFLUX_ROLLUP_BUCKET != INFLUX_BUCKET:
+    _rollup_url = 'http://{}:{}/api/v2/write?org={}&bucket={}&precision=ms'.format(
+        INFLUX_URL_BASE, INFLUX_PORT, INFLUX_ORG, INFLUX_ROLLUP_BUCKET)
+    # Mismo servidor InfluxDB: comparte el circuit breaker (_cliente_kwargs)
+    if ASGI_MODE:
+        _rollup_client = AsyncInfluxHTTPClient(_rollup_url, HEADERS, **_cliente_kwargs)
+    else:
+        _rollup_client = InfluxHTTPClient(_rollup_url, HEADERS, **_cliente_kwargs)
+    rollup_writer = _crear_escritor(_rollup_client, _crear_spool("rollups") if SPOOL_ENABLED else None)
+
+agregador = None
+if ROLLUPS_ENABLED:
+    agregador = AgregadorTracker(
+        rollup_writer.put_many,
+        carga_ohm=float(os.environ['PANEL_LOAD_OHMS']) if os.environ.get('PANEL_LOAD_OHMS') else None,
+        max_hueco_s=float(os.environ.get('ROLLUP_MAX_GAP_S', '300')),
+        gracia_s=float(os.environ.get('ROLLUP_GRACE_S', '30'))
+    )
+    if not ASGI_MODE:
+        # atexit en orden inverso: las ventanas abiertas se emiten antes de parar los escritores
+        atexit.register(agregador.cerrar_todo)
+
+# Snapshots en disco del PID y de los modelos River (arranque en caliente)
+snapshot_store = None
+if os.environ.get('SNAPSHOTS_ENABLED', '1') in ("1", "true", "True"):
+    snapshot_store = SnapshotStore(
+        directory=os.environ.get('SNAPSHOT_DIR', 'state'),
+        interval_s=float(os.environ.get('SNAPSHOT_INTERVAL_S', '60'))
+    )
+
+
+# Estado PID de todos los trackers en una tabla de NumPy (pid_store.py); un
+# dispositivo sale de memoria junto con su analizador River (_al_expulsar)
+# PID_IDLE_TTL_S: las filas sin uso durante ese tiempo cuyo dispositivo ya no
+# está en el registro se barren en el mantenimiento periódico (red de seguridad)
+pid_store = PIDControllerStore(capacidad_inicial=int(os.environ.get('RIVER_MAX_DEVICES', '256')),
+                               idle_ttl_s=float(os.environ.get('PID_IDLE_TTL_S', '3600')))
 
-@app.route("/sensor_values", methods=["POST"])
-def sensor_values():
-    data = request.get_json(force=True, silent=True) or {}
 
-    # Caso: datos del tracker solar
-    if any(k in data for k in ("servo_h", "servo_v", "ldr_tl", "ldr_tr", "ldr_bl", "ldr_br")):
-        try:
-            device_id = data.get("device_id", "unknown")
-            servo_h = int(data.get("servo_h", 0))
-            servo_v = int(data.get("servo_v", 0))
-            ldr_tl  = int(data.get("ldr_tl", 0))
-            ldr_tr  = int(data.get("ldr_tr", 0))
-            ldr_bl  = int(data.get("ldr_bl", 0))
-            ldr_br  = int(data.get("ldr_br", 0))
-            panel_voltage = float(data.get("panel_voltage", float("nan")))
-
-            bme_temp_c    = data.get("bme_temp_c", None)
-            bme_press_hpa = data.get("bme_press_hpa", None)
-            bme_hum_pct   = data.get("bme_hum_pct", None)
-            bme_alt_m     = data.get("bme_alt_m", None)
-            # Reportes de límites desde el ESP32
-            at_limit_h = data.get("at_limit_h", False)
-            at_limit_v = data.get("at_limit_v", False)
-
-            promedioArriba = (ldr_tl + ldr_tr) / 2.0
-            promedioAbajo = (ldr_bl + ldr_br) / 2.0
-            promedioIzquierda = (ldr_tl + ldr_bl) / 2.0
-            promedioDerecha = (ldr_tr + ldr_br) / 2.0
-
-            # Normalizar lecturas LDR a escala 0-100
-            # 50 = promedio, <50 = más oscuro, >50 = más brillante
-            # Útiles para visualizar desbalances en dashboard y analizar errores de posicionamiento
-            avg_all = (ldr_tl + ldr_tr + ldr_bl + ldr_br) / 4.0
-
-            if avg_all > 0:
-                norm_tl = 50 + (ldr_tl - avg_all) / avg_all * 50
-                norm_tr = 50 + (ldr_tr - avg_all) / avg_all * 50
-                norm_bl = 50 + (ldr_bl - avg_all) / avg_all * 50
-                norm_br = 50 + (ldr_br - avg_all) / avg_all * 50
-            else:
-                norm_tl = norm_tr = norm_bl = norm_br = 50.0
+def get_device_controller(device_id):
+    """
+    Obtiene el controlador PID de un dispositivo. Normalmente ya lo dio de
+    alta _crear_analizador con el mismo snapshot; si no, se crea aquí.
+    """
+    controller = pid_store.get(device_id)
+    if controller is None:
+        snap = snapshot_store.cargar(device_id) if snapshot_store else None
+        # Alta atómica: el estado del snapshot solo se aplica si no lo creó otro hilo
+        controller = pid_store.controlador(device_id, snap.get('pid') if snap else None)
+        if avance_solar is not None and snap:
+            avance_solar.set_state(device_id, snap.get('solar'))
+    return controller
+
+
+# Avance solar (ephemeris.py): con SOLAR_LAT/SOLAR_LON el comando del PID se
+# combina con la posición calculada del sol. SOLAR_DEVICES_FILE (JSON
+# {device_id: {"lat": ..., "lon": ..., "h_center": ...}}) fija sitio y
+# montaje por dispositivo; los que no aparecen usan la configuración global.
+_CLAVES_MONTAJE = {
+    'lat': 'lat', 'lon': 'lon', 'azimuth_center': 'acimut_centro', 'h_center': 'h_centro',
+    'h_scale': 'escala_h', 'v_horizon': 'v_horizonte', 'v_scale': 'escala_v'
+}
 
-            norm_tl = max(0, min(100, norm_tl))
-            norm_tr = max(0, min(100, norm_tr))
-            norm_bl = max(0, min(100, norm_bl))
-            norm_br = max(0, min(100, norm_br))
 
-            controller = get_device_controller(device_id)
-            nuevo_h, nuevo_v, debug_info = controller.calcular_angulos(
-                ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v, at_limit_h, at_limit_v
-            )
-
-            analisis_resultados = river_analyzer.ejecutar_analisis_completo(ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v, panel_voltage, bme_temp_c=bme_temp_c, bme_press_hpa=bme_press_hpa, bme_hum_pct=bme_hum_pct)
-            ts_ms = int(time.time() * 1000)
-
-            fields = [
-                f"servo_h={servo_h}", f"servo_v={servo_v}",
-                f"ldr_tl={ldr_tl}", f"ldr_tr={ldr_tr}",
-                f"ldr_bl={ldr_bl}", f"ldr_br={ldr_br}",
-                f"ldr_arriba={promedioArriba:.1f}", f"ldr_abajo={promedioAbajo:.1f}",
-                f"ldr_izquierda={promedioIzquierda:.1f}", f"ldr_derecha={promedioDerecha:.1f}",
-                f"ldr_norm_tl={norm_tl:.1f}", f"ldr_norm_tr={norm_tr:.1f}",
-                f"ldr_norm_bl={norm_bl:.1f}", f"ldr_norm_br={norm_br:.1f}",
-                f"limit_hit_h={'1' if at_limit_h else '0'}", f"limit_hit_v={'1' if at_limit_v else '0'}",
-                f"cmd_h={nuevo_h}", f"cmd_v={nuevo_v}"
-            ]
-
-            #bme
-            if bme_temp_c is not None:
-                fields.append(f"bme_temp_c={float(bme_temp_c):.2f}")
-
-            if bme_press_hpa is not None:
-               fields.append(f"bme_press_hpa={float(bme_press_hpa):.2f}")
-
-            if bme_hum_pct is not None:
-              fields.append(f"bme_hum_pct={float(bme_hum_pct):.2f}")
-
-            if bme_alt_m is not None:
-                   fields.append(f"bme_alt_m={float(bme_alt_m):.2f}")
-            if not math.isnan(panel_voltage):
-                fields.append(f"panel_voltage={panel_voltage:.4f}")
-
-            # Agregar resultados del análisis con River
-            efic = analisis_resultados['eficiencia']
-            anom = analisis_resultados['anomalias']
-            drift_res = analisis_resultados['drift']
-
-            amb = analisis_resultados.get('ambiente', {})
-            if amb:
-                # para influx
-                fields.append(f"env_state=\"{amb.get('state','NA')}\"")
-                fields.append(f"env_confidence={float(amb.get('confidence',0.0)):.2f}")
-                fields.append(f"env_rel_light_change={float(amb.get('rel_light_change',0.0)):.4f}")
-
-                fields.append(f"env_state_id={int(amb.get('state_id', -1))}")
-
-
-            if efic['voltage_predicted'] is not None:
-                fields.append(f"voltage_predicted={efic['voltage_predicted']:.4f}")
-                fields.append(f"voltage_error={efic['error']:.4f}")
-                fields.append(f"efficiency_ok={'1' if efic['status'] == 'OK' else '0'}")
-
-            fields.append(f"anomaly_score={anom['score']:.4f}")
-            fields.append(f"is_anomaly={'1' if anom['is_anomaly'] else '0'}")
-            fields.append(f"drift_detected={'1' if drift_res['drift_detected'] else '0'}")
-
-            fieldset = ",".join(fields)
-            line = f"tracker,device={device_id} {fieldset} {ts_ms}"
-
-            r = requests.post(WRITE_URL, data=line, headers=HEADERS, timeout=5)
-            ok = (204 == r.status_code)
-
-            delta_h = abs(nuevo_h - servo_h)
-            delta_v = abs(nuevo_v - servo_v)
-            fast_hint = {"fast_interval_ms": 400, "fast_duration_ms": 3000} if max(delta_h, delta_v) >= 2 else None
-
-            return jsonify({
-                "status": "ok" if ok else "error",
-                "device_id": device_id,
-                "command": {
-                    "servo_h": nuevo_h,
-                    "servo_v": nuevo_v
-                },
-                **({"fast": fast_hint} if fast_hint else {}),
-                "limit_aware": {
-                    "at_limit_h": at_limit_h,
-                    "at_limit_v": at_limit_v,
-                    "respected": True
-                },
-                "debug": {
-                    "diffH": debug_info['diffH'],
-                    "diffV": debug_info['diffV'],
-                    "correccionH": debug_info['correccionH'],
-                    "correccionV": debug_info['correccionV']
-                },
-                "analysis": {
-                    "efficiency": {
-                        "status": efic['status'],
-                        "voltage_real": efic['voltage_real'],
-                        "voltage_predicted": efic['voltage_predicted'],
-                        "error": efic['error']
-                    },
-                    "anomaly": {
-                        "detected": anom['is_anomaly'],
-                        "score": anom['score']
-                    },
-                    "drift": {
-                        "detected": drift_res['drift_detected'],
-                        "count": drift_res['drift_count']
-                    }
-                }
-            }), 200
+def _montaje(config):
+    return Montaje(**{_CLAVES_MONTAJE[k]: v for k, v in config.items() if k in _CLAVES_MONTAJE})
+
+
+_montaje_global = None
+if os.environ.get('SOLAR_LAT') and os.environ.get('SOLAR_LON'):
+    _montaje_global = _montaje({
+        clave: float(os.environ[f'SOLAR_{clave.upper()}'])
+        for clave in _CLAVES_MONTAJE if os.environ.get(f'SOLAR_{clave.upper()}')
+    })
+_montajes = {}
+if os.environ.get('SOLAR_DEVICES_FILE'):
+    with open(os.environ['SOLAR_DEVICES_FILE'], encoding='utf-8') as f:
+        _montajes = {device_id: _montaje(config) for device_id, config in json.load(f).items()}
+
+avance_solar = None
+if _montaje_global is not None or _montajes:
+    avance_solar = AvanceSolar(
+        lambda device_id: _montajes.get(device_id, _montaje_global),
+        tabla=TablaSolar(),
+        elevacion_min=float(os.environ.get('SOLAR_MIN_ELEVATION', '3')),
+        salto_min=float(os.environ.get('SOLAR_JUMP_MIN_DEG', '8')),
+        error_alineado=float(os.environ.get('SOLAR_ALIGNED_ERROR', '80')),
+        luz_alineado=float(os.environ.get('SOLAR_ALIGNED_LIGHT', '800'))
+    )
+
+
+# Motor de anomalías (anomaly_engines.py): uno global y excepciones por
+# dispositivo, p. ej. ANOMALY_ENGINE_DEVICES="tracker_1=zscore,tracker_2=hst_subsample"
+ANOMALY_ENGINE = os.environ.get('ANOMALY_ENGINE', 'hst')
+ANOMALY_ENGINE_DEVICES = dict(
+    par.strip().split('=', 1) for par in os.environ.get('ANOMALY_ENGINE_DEVICES', '').split(',') if '=' in par
+)
+_motor_kwargs = dict(
+    hst_learn_every=int(os.environ.get('ANOMALY_HST_LEARN_EVERY', '4')),
+    zscore_max=float(os.environ.get('ANOMALY_ZSCORE_MAX', '4.0'))
+)
+for _motor in {ANOMALY_ENGINE, *ANOMALY_ENGINE_DEVICES.values()}:
+    if _motor not in MOTORES_ANOMALIAS:
+        raise ValueError(f"motor de anomalías desconocido: {_motor!r} (opciones: {', '.join(MOTORES_ANOMALIAS)})")
+
+
+def motor_anomalias(device_id):
+    return ANOMALY_ENGINE_DEVICES.get(device_id, ANOMALY_ENGINE)
+
+
+# Reentrenamiento del modelo de eficiencia tras un concept drift
+# (RiverAnalyzer.configurar_reentreno); también a los restaurados de snapshot
+_reentreno_kwargs = dict(
+    activo=os.environ.get('RIVER_RETRAIN_ON_DRIFT', '1') in ("1", "true", "True"),
+    ventana=int(os.environ.get('RIVER_RETRAIN_WINDOW', '300')),
+    evaluacion=int(os.environ.get('RIVER_RETRAIN_EVAL', '100')),
+    max_evaluacion=int(os.environ.get('RIVER_RETRAIN_MAX_EVAL', '1000')),
+    margen=float(os.environ.get('RIVER_RETRAIN_MARGIN', '0.1'))
+)
+
+
+# River (y con él scipy y pandas) es la mayor parte del tiempo de arranque.
+# Con LAZY_INIT=1 se importa en un hilo de calentamiento (o en el primer
+# analizador si WARMUP=0) y el servidor acepta conexiones enseguida;
+# /ready indica cuándo ya no hay que pagar ese coste en una petición.
+LAZY_INIT = os.environ.get('LAZY_INIT', '0') in ("1", "true", "True")
+WARMUP_ENABLED = os.environ.get('WARMUP', '1') in ("1", "true", "True")
+
+arranque = {
+    'state': 'cold',
+    'lazy': LAZY_INIT,
+    'started_ts': time.time(),
+    'import_s': None,
+    'warmup_s': None,
+    'error': None
+}
+_RiverAnalyzer = None
+_lock_arranque = threading.Lock()
+
+
+def _clase_analizador():
+    """RiverAnalyzer, importándolo la primera vez"""
+    global _RiverAnalyzer
+    if _RiverAnalyzer is None:
+        with _lock_arranque:
+            if _RiverAnalyzer is None:
+                t0 = time.perf_counter()
+                from river_analysis import RiverAnalyzer
+                arranque['import_s'] = round(time.perf_counter() - t0, 3)
+                _RiverAnalyzer = RiverAnalyzer
+                if arranque['state'] == 'cold':
+                    # WARMUP=0: lo cargó la primera petición
+                    arranque['state'] = 'ready'
+    return _RiverAnalyzer
+
+
+def calentar():
+    """
+    Importa River y ejecuta un análisis completo con un analizador desechable,
+    para que la primera lectura real no pague importaciones ni inicializaciones.
+    """
+    arranque['state'] = 'warming'
+    t0 = time.perf_counter()
+    try:
+        analizador = _clase_analizador()(anomaly_engine=ANOMALY_ENGINE, **_motor_kwargs)
+        analizador.ejecutar_analisis_completo(1000, 1000, 1000, 1000, 90, 90, 1.0)
+    except Exception as e:
+        arranque['state'] = 'failed'
+        arranque['error'] = repr(e)
+        print("[WARMUP] error:", repr(e))
+        return False
+    arranque['warmup_s'] = round(time.perf_counter() - t0, 3)
+    arranque['state'] = 'ready'
+    return True
+
+
+def estado_arranque():
+    """
+    Cuerpo de /ready: 200 cuando River está cargado (o se cargará en el primer
+    uso con WARMUP=0), 503 mientras calienta o si falló.
+    """
+    listo = arranque['state'] == 'ready' or (arranque['state'] == 'cold' and not WARMUP_ENABLED)
+    return {'ready': listo, **arranque, 'uptime_s': round(time.time() - arranque['started_ts'], 3)}, \
+        (200 if listo else 503)
+
+
+if not LAZY_INIT:
+    calentar()
+elif WARMUP_ENABLED:
+    arranque['state'] = 'warming'
+    threading.Thread(target=calentar, name="warmup", daemon=True).start()
+
+
+def _crear_analizador(device_id):
+    """
+    Restaura el dispositivo desde su snapshot si existe; si no, un analizador
+    nuevo. El snapshot se lee una sola vez: de él salen también el estado PID
+    y el del avance solar.
+    """
+    motor = motor_anomalias(device_id)
+    snap = snapshot_store.cargar(device_id) if snapshot_store else None
+    # Alta atómica: el estado PID solo se aplica si la fila no existía
+    pid_store.controlador(device_id, snap.get('pid') if snap else None)
+    if avance_solar is not None and snap:
+        avance_solar.set_state(device_id, snap.get('solar'))
+    if snap and snap.get('analyzer') is not None:
+        analyzer = snap['analyzer']
+        if analyzer.anomaly_engine != motor:
+            # La configuración cambió desde el snapshot: el resto de modelos se conserva
+            analyzer.cambiar_motor_anomalias(motor, **_motor_kwargs)
+    else:
+        analyzer = _clase_analizador()(anomaly_engine=motor, **_motor_kwargs)
+    analyzer.aprendizaje_diferido = learner_pool is not None
+    analyzer.configurar_reentreno(**_reentreno_kwargs)
+    return analyzer
+
+
+def _estado_dispositivo(device_id, analyzer):
+    controller = pid_store.get(device_id)
+    return {
+        'device_id': device_id,
+        'ts': time.time(),
+        'pid': controller.get_state() if controller else None,
+        'solar': avance_solar.get_state(device_id) if avance_solar is not None else None,
+        'analyzer': analyzer
+    }
+
+
+def _al_expulsar(device_id, analyzer):
+    # Ya no está en el registro: se guarda en el próximo checkpoint
+    if snapshot_store:
+        snapshot_store.retener(device_id, _estado_dispositivo(device_id, analyzer))
+    pid_store.expulsar(device_id)
+    if avance_solar is not None:
+        avance_solar.olvidar(device_id)
+
+
+def _capturar_snapshot(device_id):
+    """Serializa el estado de un dispositivo bajo su lock (hilo de checkpoint)"""
+    entry = model_registry.peek(device_id)
+    if entry is None:
+        return None
+    with entry.lock:
+        # Expulsado entre peek() y tomar el lock: on_evict ya retuvo su estado
+        if model_registry.peek(device_id) is not entry:
+            return None
+        return snapshot_store.serializar(_estado_dispositivo(device_id, entry.analyzer))
+
+
+# Un RiverAnalyzer por dispositivo, con LRU y lock propio
+model_registry = ModelRegistry(
+    _crear_analizador,
+    max_devices=int(os.environ.get('RIVER_MAX_DEVICES', '256')),
+    idle_ttl_s=float(os.environ['RIVER_IDLE_TTL_S']) if os.environ.get('RIVER_IDLE_TTL_S') else None,
+    on_evict=_al_expulsar
+)
+
+if snapshot_store:
+    snapshot_store.start(_capturar_snapshot)
+    atexit.register(snapshot_store.stop)
+
+# Aprendizaje de River en segundo plano (learner_pool.py): la petición solo
+# predice y puntúa; learn_one se aplica después, en orden por dispositivo
+learner_pool = None
+if os.environ.get('RIVER_ASYNC_LEARNING', '1') in ("1", "true", "True"):
+    learner_pool = LearnerPool(
+        model_registry.peek,
+        hilos=int(os.environ.get('RIVER_LEARN_THREADS', '2')),
+        max_pendientes=int(os.environ.get('RIVER_LEARN_MAX_PENDING', '256')),
+        intervalo_s=float(os.environ.get('RIVER_LEARN_INTERVAL_S', '0.05')),
+        overflow_policy=os.environ.get('RIVER_LEARN_OVERFLOW', 'drop_oldest'),
+        espera_max_s=float(os.environ.get('RIVER_LEARN_BLOCK_TIMEOUT_S', '1.0'))
+    ).start()
+    # Registrado después de los snapshots: el último checkpoint ya incluye lo pendiente
+    atexit.register(learner_pool.stop)
+
+
+# Tareas periódicas del proceso: un hilo en Flask y una tarea asyncio en
+# servidor_asgi.py llaman a mantenimiento() cada MAINTENANCE_INTERVAL_S
+MAINTENANCE_INTERVAL_S = float(os.environ.get('MAINTENANCE_INTERVAL_S', '5'))
+tareas_mantenimiento = []
+if model_registry.idle_ttl_s is not None:
+    # Sin esto RIVER_IDLE_TTL_S solo se comprobaría al crear dispositivos nuevos
+    tareas_mantenimiento.append(("registry_idle", model_registry.evict_idle))
+# Las filas de los dispositivos del registro las gestiona _al_expulsar
+tareas_mantenimiento.append(("pid_idle", lambda: pid_store.evict_idle(conservar=model_registry.retenido)))
+if agregador is not None:
+    # Ventanas de trackers que dejaron de enviar: se emiten ROLLUP_GRACE_S después de terminar
+    tareas_mantenimiento.append(("rollups", agregador.cerrar_vencidas))
+
+
+def mantenimiento():
+    """Una pasada de las tareas periódicas; un error en una no impide las demás"""
+    for nombre, tarea in tareas_mantenimiento:
+        try:
+            tarea()
         except Exception as e:
-            print("[EXCEPTION] sensor_values:", repr(e))
-            import traceback
-            traceback.print_exc()
-            return jsonify({"status": "error", "msg": str(e)}), 500
+            print(f"[MANTENIMIENTO] {nombre}:", repr(e))
+
+
+_parar_mantenimiento = threading.Event()
+
+
+def _bucle_mantenimiento():
+    while not _parar_mantenimiento.wait(MAINTENANCE_INTERVAL_S):
+        mantenimiento()
+
+
+if not ASGI_MODE:
+    threading.Thread(target=_bucle_mantenimiento, name="mantenimiento", daemon=True).start()
+    atexit.register(_parar_mantenimiento.set)
+
+
+# Últimas muestras y resultados de cada tracker en memoria (history.py) para
+# /devices, /devices/<id>/recent y /devices/<id>/stats sin consultar InfluxDB
+historial = None
+if os.environ.get('HISTORY_ENABLED', '1') in ("1", "true", "True"):
+    historial = HistorialReciente(
+        capacidad=int(os.environ.get('HISTORY_SIZE', '512')),
+        max_dispositivos=int(os.environ.get('HISTORY_MAX_DEVICES', os.environ.get('RIVER_MAX_DEVICES', '256')))
+    )
+
+
+# Intervalo de envío de cada tracker según error del PID, condición ambiental,
+# día/noche y un presupuesto global de peticiones/s
+planificador = SamplingScheduler(
+    budget_rps=float(os.environ.get('SCHED_BUDGET_RPS', '200')),
+    fast_ms=int(os.environ.get('SCHED_FAST_MS', '400')),
+    unstable_ms=int(os.environ.get('SCHED_UNSTABLE_MS', '500')),
+    cloudy_ms=int(os.environ.get('SCHED_CLOUDY_MS', '1000')),
+    sunny_ms=int(os.environ.get('SCHED_SUNNY_MS', '2000')),
+    night_ms=int(os.environ.get('SCHED_NIGHT_MS', '30000')),
+    luz_noche=float(os.environ.get('SCHED_NIGHT_LIGHT', '150')),
+    hora_amanecer=int(os.environ.get('SCHED_DAWN_HOUR', '6')),
+    hora_anochecer=int(os.environ.get('SCHED_DUSK_HOUR', '21'))
+)
+
+
+def get_device_analyzer(device_id):
+    """Obtiene o crea el analizador River (y su lock) para un dispositivo"""
+    return model_registry.get(device_id)
+
+
+def _procesar_lectura_tracker(data, controller, analyzer, ts_ms=None, caracteristicas=None,
+                              planificar=True, pid=None):
+    """
+    Procesa una lectura del tracker: normalización, PID y análisis River.
+    El llamador debe tener tomado el lock del dispositivo. En lotes,
+    `caracteristicas` y el paso PID (`pid`, como calcular_angulos) llegan
+    ya calculados por los motores vectorizados y solo la última lectura de
+    cada dispositivo pide intervalo al planificador.
+
+    Returns:
+        tuple: (línea de line protocol o None con INFLUX_RAW_WRITES=0,
+                dict de respuesta sin 'status')
+    """
+    # `data` ya pasó por normalizar_lectura: tipos resueltos y todas las claves presentes
+    device_id = data["device_id"]
+    servo_h = data["servo_h"]
+    servo_v = data["servo_v"]
+    ldr_tl  = data["ldr_tl"]
+    ldr_tr  = data["ldr_tr"]
+    ldr_bl  = data["ldr_bl"]
+    ldr_br  = data["ldr_br"]
+    panel_voltage = data["panel_voltage"]
+
+    bme_temp_c    = data["bme_temp_c"]
+    bme_press_hpa = data["bme_press_hpa"]
+    bme_hum_pct   = data["bme_hum_pct"]
+    bme_alt_m     = data["bme_alt_m"]
+    # Reportes de límites desde el ESP32
+    at_limit_h = data["at_limit_h"]
+    at_limit_v = data["at_limit_v"]
+
+    if ts_ms is None:
+        ts_ms = int(time.time() * 1000)
+
+    # Promedios por cuadrante, LDR normalizados 0-100, varianza y hora en una sola pasada
+    car = caracteristicas
+    if car is None:
+        car = caracteristicas_muestra(ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v, ts=ts_ms / 1000.0)
+
+    obs = stage_observer
+    analyzer.stage_observer = obs
+    if pid is not None:
+        nuevo_h, nuevo_v, debug_info = pid
+    else:
+        if obs:
+            t0 = time.perf_counter()
+        nuevo_h, nuevo_v, debug_info = controller.calcular_angulos(
+            ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v, at_limit_h, at_limit_v
+        )
+        if obs:
+            obs('pid', time.perf_counter() - t0)
+
+    solar = None
+    if avance_solar is not None:
+        if obs:
+            t0 = time.perf_counter()
+        nuevo_h, nuevo_v, solar = avance_solar.ajustar(
+            device_id, ts_ms, servo_h, servo_v, nuevo_h, nuevo_v,
+            debug_info['diffH'], debug_info['diffV'], car['avg_light'])
+        if obs:
+            obs('feedforward', time.perf_counter() - t0)
+
+    analisis_resultados = analyzer.ejecutar_analisis_completo(ldr_tl, ldr_tr, ldr_bl, ldr_br, servo_h, servo_v, panel_voltage, bme_temp_c=bme_temp_c, bme_press_hpa=bme_press_hpa, bme_hum_pct=bme_hum_pct, caracteristicas=car)
+    if obs:
+        t0 = time.perf_counter()
+    if analisis_resultados['aprendizaje'] is not None:
+        learner_pool.encolar(device_id, analisis_resultados['aprendizaje'])
+        if obs:
+            t1 = time.perf_counter()
+            obs('learn_enqueue', t1 - t0)
+            t0 = t1
+
+    # Agregar resultados del análisis con River
+    efic = analisis_resultados['eficiencia']
+    anom = analisis_resultados['anomalias']
+    drift_res = analisis_resultados['drift']
+    amb = analisis_resultados.get('ambiente', {})
+    con_prediccion = efic['voltage_predicted'] is not None
+
+    # Valores en el orden de line_protocol.TRACKER; None = campo ausente
+    valores = (
+        servo_h, servo_v, ldr_tl, ldr_tr, ldr_bl, ldr_br,
+        car['ldr_arriba'], car['ldr_abajo'], car['ldr_izquierda'], car['ldr_derecha'],
+        car['norm_tl'], car['norm_tr'], car['norm_bl'], car['norm_br'],
+        1 if at_limit_h else 0, 1 if at_limit_v else 0,
+        nuevo_h, nuevo_v,
+        #bme
+        bme_temp_c, bme_press_hpa, bme_hum_pct, bme_alt_m,
+        panel_voltage,
+        amb.get('state', 'NA') if amb else None,
+        float(amb.get('confidence', 0.0)) if amb else None,
+        float(amb.get('rel_light_change', 0.0)) if amb else None,
+        int(amb.get('state_id', -1)) if amb else None,
+        efic['voltage_predicted'] if con_prediccion else None,
+        efic['error'] if con_prediccion else None,
+        (1 if efic['status'] == 'OK' else 0) if con_prediccion else None,
+        anom['score'],
+        1 if anom['is_anomaly'] else 0,
+        1 if drift_res['drift_detected'] else 0
+    )
+    line = codificador_tracker.codificar((device_id, efic['model_version']), valores, ts_ms) \
+        if INFLUX_RAW_WRITES else None
+    if obs:
+        t1 = time.perf_counter()
+        obs('line_protocol', t1 - t0)
+
+    if agregador is not None:
+        agregador.observar(device_id, ts_ms, ldr_tl, ldr_tr, ldr_bl, ldr_br, panel_voltage,
+                           amb.get('state') if amb else None, anom['is_anomaly'],
+                           drift_res['drift_detected'], servo_h, servo_v)
+        if obs:
+            obs('rollup', time.perf_counter() - t1)
+
+    fast_hint = None
+    if planificar:
+        if obs:
+            t0 = time.perf_counter()
+        delta_h = abs(nuevo_h - servo_h)
+        delta_v = abs(nuevo_v - servo_v)
+        fast_hint = planificador.siguiente(
+            device_id,
+            error_pid=error_seguimiento(debug_info),
+            en_movimiento=max(delta_h, delta_v) >= 2,
+            estado=amb.get('state') if amb else None,
+            luz_media=car['avg_light'],
+            hora=car['hour']
+        )
+        if obs:
+            obs('scheduler', time.perf_counter() - t0)
+
+    if historial is not None:
+        if obs:
+            t0 = time.perf_counter()
+        historial.agregar(device_id, (
+            ts_ms, servo_h, servo_v, ldr_tl, ldr_tr, ldr_bl, ldr_br,
+            car['avg_light'], panel_voltage, nuevo_h, nuevo_v,
+            efic['voltage_predicted'] if con_prediccion else None,
+            efic['error'] if con_prediccion else None,
+            anom['score'], 1 if anom['is_anomaly'] else 0, 1 if drift_res['drift_detected'] else 0,
+            amb.get('state_id') if amb else None,
+            fast_hint['fast_interval_ms'] if fast_hint else None
+        ))
+        if obs:
+            obs('history', time.perf_counter() - t0)
+
+    return line, {
+        "device_id": device_id,
+        "command": {
+            "servo_h": nuevo_h,
+            "servo_v": nuevo_v
+        },
+        **({"fast": fast_hint} if fast_hint else {}),
+        "limit_aware": {
+            "at_limit_h": at_limit_h,
+            "at_limit_v": at_limit_v,
+            "respected": True
+        },
+        "debug": {
+            "diffH": debug_info['diffH'],
+            "diffV": debug_info['diffV'],
+            "correccionH": debug_info['correccionH'],
+            "correccionV": debug_info['correccionV'],
+            **({"solar": solar} if solar else {})
+        },
+        "analysis": {
+            "efficiency": {
+                "status": efic['status'],
+                "voltage_real": efic['voltage_real'],
+                "voltage_predicted": efic['voltage_predicted'],
+                "error": efic['error']
+            },
+            "anomaly": {
+                "detected": anom['is_anomaly'],
+                "score": anom['score']
+            },
+            "drift": {
+                "detected": drift_res['drift_detected'],
+                "count": drift_res['drift_count']
+            }
+        }
+    }
+
+
+# ----------------------------------------------------------------------
+# Métricas (/metrics)
+# ----------------------------------------------------------------------
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') in ("1", "true", "True")
+
+metricas = MetricsRegistry()
+m_request_seconds = metricas.histogram(
+    "solar_http_request_seconds", "Latencia de las peticiones HTTP", ("endpoint", "status"))
+m_device_requests = metricas.counter(
+    "solar_device_requests_total", "Lecturas procesadas por dispositivo", ("device",))
+m_stage_seconds = metricas.histogram(
+    "solar_stage_seconds", "Duración de cada etapa del hot path (PID, modelos River, line protocol...)", ("stage",))
+m_anomalies = metricas.counter(
+    "solar_anomalies_total", "Anomalías detectadas por dispositivo", ("device",))
+m_drifts = metricas.counter(
+    "solar_drifts_total", "Concept drifts detectados por dispositivo", ("device",))
+m_influx_seconds = metricas.histogram(
+    "solar_influx_write_seconds", "Latencia de cada escritura por lotes a InfluxDB", ("ok",))
+m_influx_lines = metricas.counter(
+    "solar_influx_lines_total", "Líneas enviadas a InfluxDB por resultado", ("ok",))
+metricas.gauge("solar_influx_queue_depth", "Líneas pendientes en la cola de escritura",
+               lambda: influx_writer.queue_depth())
+metricas.gauge("solar_influx_dropped_lines", "Líneas descartadas por cola llena",
+               lambda: influx_writer.dropped)
+metricas.gauge("solar_influx_failed_lines", "Líneas descartadas tras agotar reintentos",
+               lambda: influx_writer.failed)
+metricas.gauge("solar_influx_spool_bytes", "Bytes pendientes de reenvío en el spool en disco",
+               lambda: influx_spool.get_stats()['spool_bytes'] if influx_spool is not None else 0)
+metricas.gauge("solar_influx_spool_dropped_lines", "Líneas descartadas por el límite de tamaño del spool",
+               lambda: influx_spool.lines_dropped if influx_spool is not None else 0)
+m_sampling_interval = metricas.histogram(
+    "solar_sampling_interval_seconds", "Intervalo de envío asignado a los trackers por motivo", ("reason",),
+    buckets=(0.2, 0.4, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0))
+metricas.gauge("solar_sampling_projected_rps", "Peticiones/s proyectadas con los intervalos asignados",
+               lambda: planificador.tasa_proyectada())
+metricas.gauge("solar_sampling_observed_rps", "Peticiones/s observadas por el planificador",
+               lambda: planificador.tasa_observada)
+metricas.gauge("solar_sampling_budget_rps", "Presupuesto global de peticiones/s",
+               lambda: planificador.budget_rps)
+metricas.gauge("solar_devices", "Controladores PID en memoria (pid_store)",
+               lambda: len(pid_store))
+metricas.gauge("solar_ready", "1 cuando River está cargado y calentado (/ready)",
+               lambda: 1 if estado_arranque()[1] == 200 else 0)
+metricas.gauge("solar_river_models", "Analizadores River en memoria",
+               lambda: len(model_registry))
+metricas.gauge("solar_river_evicted", "Analizadores River expulsados del registro",
+               lambda: model_registry.evicted)
+if learner_pool is not None:
+    m_learn_lag = metricas.histogram(
+        "solar_river_learn_lag_seconds", "Antigüedad del evento más antiguo de cada tanda de aprendizaje",
+        buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+    metricas.gauge("solar_river_learn_pending", "Eventos de aprendizaje River pendientes",
+                   lambda: learner_pool.pendientes())
+    metricas.gauge("solar_river_learn_applied", "Eventos de aprendizaje River aplicados",
+                   lambda: learner_pool.applied)
+    metricas.gauge("solar_river_learn_dropped", "Eventos de aprendizaje descartados por retraso máximo",
+                   lambda: learner_pool.dropped)
+
+
+def _observar_etapa(etapa, segundos):
+    m_stage_seconds.observe(segundos, (etapa,))
+
+
+def _observar_escritura(n_lineas, segundos, ok):
+    etiqueta = ("1" if ok else "0",)
+    m_influx_seconds.observe(segundos, etiqueta)
+    m_influx_lines.inc(n_lineas, etiqueta)
+
+
+def _registrar_lectura(respuesta):
+    device = (respuesta["device_id"],)
+    m_device_requests.inc(1, device)
+    fast = respuesta.get("fast")
+    if fast:
+        m_sampling_interval.observe(fast["fast_interval_ms"] / 1000.0, (fast["reason"],))
+    analisis = respuesta["analysis"]
+    if analisis["anomaly"]["detected"]:
+        m_anomalies.inc(1, device)
+    if analisis["drift"]["detected"]:
+        m_drifts.inc(1, device)
+
+
+if METRICS_ENABLED:
+    stage_observer = _observar_etapa
+    influx_writer.flush_observer = _observar_escritura
+    if learner_pool is not None:
+        learner_pool.lag_observer = lambda n_eventos, retraso: m_learn_lag.observe(retraso)
+
+    @app.before_request
+    def _inicio_peticion():
+        g.t_inicio = time.perf_counter()
+
+    @app.after_request
+    def _fin_peticion(response):
+        inicio = g.get("t_inicio")
+        if inicio is not None:
+            m_request_seconds.observe(time.perf_counter() - inicio,
+                                      (request.endpoint or "unknown", str(response.status_code)))
+        return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(metricas.render(), mimetype=None, content_type=MetricsRegistry.CONTENT_TYPE)
+
+
+TRACKER_KEYS = ("servo_h", "servo_v", "ldr_tl", "ldr_tr", "ldr_bl", "ldr_br")
+
+# Última respuesta completa (analysis, debug, limit_aware...) por dispositivo,
+# para servirla en /devices/<id>/analysis cuando el tracker pide el modo compacto
+ultimas_respuestas = {}
+
+
+def es_lectura_tracker(data):
+    return any(k in data for k in TRACKER_KEYS)
+
+
+# Rangos válidos: ADC hasta 16 bits (el ESP32 usa 12) y ángulo de servo
+LDR_MAX = 65535
+SERVO_MAX = 180
+_BME_KEYS = ("bme_temp_c", "bme_press_hpa", "bme_hum_pct", "bme_alt_m")
+
+
+def normalizar_lectura(data):
+    """
+    Tipos y rangos de una lectura del tracker, comunes a JSON y al formato
+    binario (binary_format.py): int en LDR y servos, float en panel_voltage
+    (NaN si no viene) y BME280 (None si no viene), bool en los límites.
+    Las demás claves (ts_ms, age_ms...) se conservan.
+
+    Returns:
+        dict: lectura con device_id, LDR, servos, límites, voltaje y bme_* presentes
+
+    Raises:
+        ValueError: valor no numérico o fuera de rango
+    """
+    lectura = dict(data)
+    try:
+        lectura["device_id"] = str(data.get("device_id", "unknown"))
+        for k in ("ldr_tl", "ldr_tr", "ldr_bl", "ldr_br"):
+            v = lectura[k] = int(data.get(k, 0))
+            if not 0 <= v <= LDR_MAX:
+                raise ValueError(f"{k} fuera de rango: {v}")
+        for k in ("servo_h", "servo_v"):
+            v = lectura[k] = int(data.get(k, 0))
+            if not 0 <= v <= SERVO_MAX:
+                raise ValueError(f"{k} fuera de rango: {v}")
+        v = data.get("panel_voltage")
+        lectura["panel_voltage"] = float("nan") if v is None else float(v)
+        for k in _BME_KEYS:
+            v = data.get(k)
+            lectura[k] = None if v is None else float(v)
+        lectura["at_limit_h"] = bool(data.get("at_limit_h", False))
+        lectura["at_limit_v"] = bool(data.get("at_limit_v", False))
+    except (TypeError, OverflowError) as e:
+        # OverflowError: int() de Infinity o 1e400 (JSON los acepta como float)
+        raise ValueError(str(e)) from None
+    return lectura
+
+
+def es_binario(mimetype):
+    """True si el Content-Type es el formato binario compacto"""
+    return (mimetype or "").split(";")[0].strip().lower() == binary_format.CONTENT_TYPE
+
+
+def decodificar_lectura_binaria(cuerpo):
+    """
+    Lectura única de /sensor_values en formato binario.
+
+    Raises:
+        ValueError: cuerpo mal formado o con más de un registro
+    """
+    lecturas = binary_format.decodificar(cuerpo)
+    if len(lecturas) != 1:
+        raise ValueError(f"{len(lecturas)} registros: usar /sensor_values/batch para varios")
+    return lecturas[0]
+
+
+def pide_compacto(formato, cabecera):
+    """True si la petición negocia la respuesta compacta (?format=compact o X-Response-Format: compact)"""
+    return (formato or cabecera or "").strip().lower() == "compact"
+
+
+def respuesta_compacta(cuerpo):
+    """
+    Respuesta mínima de posición fija para el ESP32:
+        [ok, servo_h, servo_v, fast_interval_ms, fast_duration_ms]
+    con ok en 1/0 y 0, 0 en los dos últimos si no hay modo rápido.
+    """
+    command = cuerpo["command"]
+    fast = cuerpo.get("fast") or {}
+    return [
+        1 if cuerpo["status"] == "ok" else 0,
+        command["servo_h"], command["servo_v"],
+        fast.get("fast_interval_ms", 0), fast.get("fast_duration_ms", 0)
+    ]
+
+
+def atender_lectura_tracker(data, compacto=False):
+    """
+    Cuerpo de /sensor_values para una lectura del tracker, sin depender del
+    framework (lo comparten Flask y servidor_asgi.py). Bloquea en el lock del
+    dispositivo y ejecuta PID y River: en asyncio debe ir a un executor.
+
+    Args:
+        compacto: devolver respuesta_compacta(); la completa queda en ultimas_respuestas
+
+    Returns:
+        tuple: (dict o lista de respuesta, código HTTP)
+    """
+    try:
+        data = normalizar_lectura(data)
+    except ValueError as e:
+        return {"status": "error", "msg": str(e)}, 400
+    try:
+        device_id = data["device_id"]
+        # En uso hasta responder: el registro no lo expulsa (ni su fila PID) a mitad de petición
+        with model_registry.usar(device_id) as entry:
+            controller = get_device_controller(device_id)
+            # El lock del dispositivo protege su PID y sus modelos River;
+            # otros dispositivos siguen en paralelo
+            with entry.lock:
+                line, respuesta = _procesar_lectura_tracker(data, controller, entry.analyzer)
+
+        if snapshot_store:
+            snapshot_store.marcar(device_id)
+
+        ok = influx_writer.put(line) if line is not None else True
+        if METRICS_ENABLED:
+            _registrar_lectura(respuesta)
+        cuerpo = {"status": "ok" if ok else "error", **respuesta}
+        ultimas_respuestas[device_id] = (time.time(), cuerpo)
+        return (respuesta_compacta(cuerpo) if compacto else cuerpo), 200
+    except Exception as e:
+        print("[EXCEPTION] sensor_values:", repr(e))
+        import traceback
+        traceback.print_exc()
+        return {"status": "error", "msg": str(e)}, 500
 
 
+@app.route("/sensor_values", methods=["POST"])
+def sensor_values():
+    obs = stage_observer
+    if obs:
+        t0 = time.perf_counter()
+    if es_binario(request.mimetype):
+        try:
+            data = decodificar_lectura_binaria(request.get_data())
+        except ValueError as e:
+            return jsonify({"status": "error", "msg": str(e)}), 400
+        if obs:
+            obs('binary_decode', time.perf_counter() - t0)
+        compacto = pide_compacto(request.args.get("format"), request.headers.get("X-Response-Format"))
+        cuerpo, codigo = atender_lectura_tracker(data, compacto)
+        return jsonify(cuerpo), codigo
 
+    data = request.get_json(force=True, silent=True) or {}
+    if obs:
+        obs('json_parse', time.perf_counter() - t0)
+
+    # Caso: datos del tracker solar
+    if es_lectura_tracker(data):
+        compacto = pide_compacto(request.args.get("format"), request.headers.get("X-Response-Format"))
+        cuerpo, codigo = atender_lectura_tracker(data, compacto)
+        return jsonify(cuerpo), codigo
 
     # pruebas iniciales con el pot
     pot_value = int(data.get("pot_value", 0))
     voltage   = float(data.get("voltage", float("nan")))
 
     ts_ms = int(time.time() * 1000)
-    fields = [f"value={pot_value}"]
-    if not math.isnan(voltage):
-        fields.append(f"voltage={voltage}")
-    fieldset = ",".join(fields)
-    line = f"potentiometer,device=esp32 {fieldset} {ts_ms}"
+    line = line_protocol.POTENTIOMETER.codificar(("esp32",), (pot_value, voltage), ts_ms)
 
     try:
-        r = requests.post(WRITE_URL, data=line, headers=HEADERS, timeout=5)
+        r = influx_client.write(line)
         ok = (204 == r.status_code)
         return jsonify({
             "status": "ok" if ok else "error",
             "influx_status_code": r.status_code,
             "received": data
         }), (200 if ok else 500)
+    except (CircuitOpenError, RequestException) as e:
+        # InfluxDB caído: la lectura pasa por el escritor y, si sigue caído, al spool
+        if influx_spool is not None and influx_writer.put(line):
+            return jsonify({"status": "queued", "msg": str(e), "received": data}), 202
+        return jsonify({"status": "error", "msg": str(e)}), 500
     except Exception as e:
         return jsonify({"status": "error", "msg": str(e)}), 500
 
 
+BATCH_MAX_READINGS = int(os.environ.get('BATCH_MAX_READINGS', '1000'))
+# Rondas de un lote con al menos tantos dispositivos usan el paso PID vectorizado
+PID_BATCH_MIN_DEVICES = int(os.environ.get('PID_BATCH_MIN_DEVICES', '8'))
+
+
+def interpretar_lote(raw, mimetype):
+    """
+    Interpreta el cuerpo de /sensor_values/batch.
+
+    Formatos aceptados:
+        - JSON: lista de lecturas, o {"device_id": ..., "readings": [...]}
+        - NDJSON (application/x-ndjson): una lectura por línea
+        - binario (binary_format.CONTENT_TYPE): registros seguidos
+
+    Cada lectura puede traer "ts_ms" (epoch en ms) o "age_ms" (antigüedad
+    respecto a la recepción, útil si el ESP32 no tiene hora real).
+
+    Args:
+        raw: cuerpo en bytes (o str en los formatos JSON)
+
+    Returns:
+        list: lecturas normalizadas (normalizar_lectura) con "ts_ms" resuelto
+
+    Raises:
+        ValueError: cuerpo mal formado o lectura inválida
+    """
+    recibido_ms = int(time.time() * 1000)
+    device_defecto = "unknown"
+
+    if es_binario(mimetype):
+        lecturas = binary_format.decodificar(raw)
+    elif mimetype in ("application/x-ndjson", "application/jsonl"):
+        lecturas = [json.loads(l) for l in raw.splitlines() if l.strip()]
+    else:
+        cuerpo = json.loads(raw) if raw.strip() else []
+        if isinstance(cuerpo, dict):
+            device_defecto = cuerpo.get("device_id", device_defecto)
+            lecturas = cuerpo.get("readings", [])
+        else:
+            lecturas = cuerpo
+
+    if not isinstance(lecturas, list) or not all(isinstance(l, dict) for l in lecturas):
+        raise ValueError("el lote debe ser una lista de objetos JSON")
+
+    normalizadas = []
+    for lectura in lecturas:
+        lectura.setdefault("device_id", device_defecto)
+        lectura = normalizar_lectura(lectura)
+        try:
+            if "ts_ms" in lectura:
+                lectura["ts_ms"] = int(lectura["ts_ms"])
+            else:
+                lectura["ts_ms"] = recibido_ms - int(lectura.get("age_ms", 0))
+        except (TypeError, ValueError, OverflowError) as e:
+            raise ValueError(f"ts_ms/age_ms inválido: {e}") from None
+        normalizadas.append(lectura)
+    return normalizadas
+
+
+def _pasos_pid_lote(por_dispositivo):
+    """
+    Pasos PID de un lote agrupado por dispositivo, en rondas: la r-ésima
+    lectura de cada dispositivo va en un único paso vectorizado
+    (pid_store.calcular_angulos_lote) si la ronda tiene al menos
+    PID_BATCH_MIN_DEVICES dispositivos; si no, paso escalar. El estado PID
+    no depende del resto del procesado, así que se adelanta entero.
+    El llamador tiene tomados los locks de los dispositivos.
+
+    Returns:
+        dict: device_id -> lista de (nuevo_h, nuevo_v, debug_info) en el orden del grupo
+    """
+    pasos = {device_id: [] for device_id in por_dispositivo}
+    rondas = max(len(grupo) for grupo in por_dispositivo.values())
+    for r in range(rondas):
+        ronda = [(device_id, grupo[r]) for device_id, grupo in por_dispositivo.items() if r < len(grupo)]
+        if len(ronda) < PID_BATCH_MIN_DEVICES:
+            for device_id, l in ronda:
+                pasos[device_id].append(pid_store.calcular_angulos(
+                    device_id, l["ldr_tl"], l["ldr_tr"], l["ldr_bl"], l["ldr_br"],
+                    l["servo_h"], l["servo_v"], l["at_limit_h"], l["at_limit_v"]))
+            continue
+        resultados = pid_store.calcular_angulos_lote(
+            [device_id for device_id, _ in ronda],
+            [[l["ldr_tl"], l["ldr_tr"], l["ldr_bl"], l["ldr_br"]] for _, l in ronda],
+            [l["servo_h"] for _, l in ronda],
+            [l["servo_v"] for _, l in ronda],
+            [l["at_limit_h"] for _, l in ronda],
+            [l["at_limit_v"] for _, l in ronda],
+            detalle=True
+        )
+        for (device_id, _), resultado in zip(ronda, resultados):
+            pasos[device_id].append(resultado)
+    return pasos
+
+
+def atender_lote(lecturas, compacto=False):
+    """
+    Procesa PID y River en orden para un lote ya interpretado, escribe todas
+    las líneas juntas y devuelve solo el último comando de servos.
+    Como atender_lectura_tracker, es independiente del framework.
+
+    Returns:
+        tuple: (dict o lista de respuesta, código HTTP)
+    """
+    if not lecturas:
+        return {"status": "error", "msg": "lote vacío"}, 400
+    if len(lecturas) > BATCH_MAX_READINGS:
+        return {"status": "error", "msg": f"máximo {BATCH_MAX_READINGS} lecturas por lote"}, 413
+
+    try:
+        # Agrupar por dispositivo conservando el orden de llegada
+        por_dispositivo = {}
+        for lectura in lecturas:
+            por_dispositivo.setdefault(lectura["device_id"], []).append(lectura)
+
+        lines = []
+        respuesta = None
+        ultimas = {}
+        with ExitStack() as pila:
+            # Todos los dispositivos del lote en uso (no se expulsan) y con su
+            # lock tomado, en orden fijo para no interbloquearse con otro lote
+            entradas = {d: pila.enter_context(model_registry.usar(d)) for d in por_dispositivo}
+            controladores = {d: get_device_controller(d) for d in por_dispositivo}
+            for device_id in sorted(entradas):
+                pila.enter_context(entradas[device_id].lock)
+
+            pasos = _pasos_pid_lote(por_dispositivo)
+            for device_id, grupo in por_dispositivo.items():
+                # Características de todo el grupo en una pasada vectorizada
+                lote = calcular_caracteristicas_lote(
+                    [[l["ldr_tl"], l["ldr_tr"], l["ldr_bl"], l["ldr_br"]] for l in grupo],
+                    [l["servo_h"] for l in grupo],
+                    [l["servo_v"] for l in grupo],
+                    ts=[l["ts_ms"] / 1000.0 for l in grupo]
+                )
+                ultima = len(grupo) - 1
+                analyzer = entradas[device_id].analyzer
+                for i, (lectura, car, pid) in enumerate(zip(grupo, filas(lote), pasos[device_id])):
+                    line, respuesta = _procesar_lectura_tracker(lectura, controladores[device_id], analyzer,
+                                                                ts_ms=lectura["ts_ms"], caracteristicas=car,
+                                                                planificar=i == ultima, pid=pid)
+                    if line is not None:
+                        lines.append(line)
+                    if METRICS_ENABLED:
+                        _registrar_lectura(respuesta)
+                ultimas[device_id] = respuesta
+                if snapshot_store:
+                    snapshot_store.marcar(device_id)
+
+        aceptadas = influx_writer.put_many(lines)
+        status = "ok" if aceptadas == len(lines) else "error"
+        ahora = time.time()
+        for device_id, r in ultimas.items():
+            ultimas_respuestas[device_id] = (ahora, {"status": status, **r})
+
+        cuerpo = {
+            "status": status,
+            "device_id": respuesta["device_id"],
+            "processed": len(lecturas),
+            "command": respuesta["command"],
+            **({"fast": respuesta["fast"]} if "fast" in respuesta else {})
+        }
+        return (respuesta_compacta(cuerpo) if compacto else cuerpo), 200
+    except Exception as e:
+        print("[EXCEPTION] sensor_values_batch:", repr(e))
+        import traceback
+        traceback.print_exc()
+        return {"status": "error", "msg": str(e)}, 500
+
+
+@app.route("/sensor_values/batch", methods=["POST"])
+def sensor_values_batch():
+    """
+    Ingesta de lecturas acumuladas por el ESP32 (p. ej. durante cortes WiFi).
+    Procesa PID y River en orden, escribe todas las líneas juntas y devuelve
+    solo el último comando de servos.
+    """
+    try:
+        lecturas = interpretar_lote(request.get_data(), request.mimetype)
+    except ValueError as e:
+        return jsonify({"status": "error", "msg": str(e)}), 400
+
+    compacto = pide_compacto(request.args.get("format"), request.headers.get("X-Response-Format"))
+    cuerpo, codigo = atender_lote(lecturas, compacto)
+    return jsonify(cuerpo), codigo
+
+
+def ultima_respuesta(device_id):
+    """
+    Última respuesta completa calculada para un dispositivo (también en modo
+    compacto), con su antigüedad.
+
+    Returns:
+        dict o None si el dispositivo aún no ha enviado lecturas
+    """
+    guardada = ultimas_respuestas.get(device_id)
+    if guardada is None:
+        return None
+    ts, cuerpo = guardada
+    return {**cuerpo, "ts": ts, "age_s": round(time.time() - ts, 3)}
+
+
+@app.route("/devices/<device_id>/analysis", methods=["GET"])
+def device_analysis(device_id):
+    cuerpo = ultima_respuesta(device_id)
+    if cuerpo is None:
+        return jsonify({"status": "error", "msg": f"sin lecturas de {device_id}"}), 404
+    return jsonify(cuerpo), 200
+
+
+def _entero(consulta, clave):
+    valor = consulta.get(clave)
+    return int(valor) if valor not in (None, "") else None
+
+
+def listar_dispositivos():
+    """Dispositivos con historial en memoria, con su última muestra e intervalo asignado"""
+    if historial is None:
+        return {"status": "error", "msg": "historial desactivado (HISTORY_ENABLED=0)"}, 404
+    dispositivos = {}
+    for device_id, (muestras, ultima_ts) in historial.dispositivos().items():
+        asignado = planificador.intervalo(device_id)
+        dispositivos[device_id] = {
+            "samples": muestras,
+            "last_ts_ms": ultima_ts,
+            "models_in_memory": model_registry.peek(device_id) is not None,
+            "interval_ms": asignado[0] if asignado else None
+        }
+    return {"count": len(dispositivos), "devices": dispositivos}, 200
+
+
+def historial_dispositivo(device_id, consulta):
+    """
+    Cuerpo de /devices/<id>/recent. `consulta` es un mapping de parámetros:
+    since_ms, limit, fields (separados por comas), every, bucket_ms.
+    """
+    if historial is None:
+        return {"status": "error", "msg": "historial desactivado (HISTORY_ENABLED=0)"}, 404
+    try:
+        campos = [c.strip() for c in consulta.get("fields", "").split(",") if c.strip()] or None
+        datos = historial.recientes(
+            device_id,
+            desde_ms=_entero(consulta, "since_ms"),
+            limite=_entero(consulta, "limit"),
+            campos=campos,
+            cada=_entero(consulta, "every"),
+            bucket_ms=_entero(consulta, "bucket_ms")
+        )
+    except ValueError as e:
+        return {"status": "error", "msg": f"parámetro inválido: {e}"}, 400
+    except KeyError as e:
+        return {"status": "error", "msg": f"campo desconocido: {e.args[0]}"}, 400
+    if datos is None:
+        return {"status": "error", "msg": f"sin lecturas de {device_id}"}, 404
+    return {"device_id": device_id, "samples": len(datos["ts_ms"]), "data": datos}, 200
+
+
+def estadisticas_dispositivo(device_id, consulta):
+    """Cuerpo de /devices/<id>/stats: resumen del historial, modelos River e intervalo"""
+    if historial is None:
+        return {"status": "error", "msg": "historial desactivado (HISTORY_ENABLED=0)"}, 404
+    try:
+        resumen = historial.resumen(device_id, desde_ms=_entero(consulta, "since_ms"))
+    except ValueError as e:
+        return {"status": "error", "msg": f"parámetro inválido: {e}"}, 400
+    if resumen is None:
+        return {"status": "error", "msg": f"sin lecturas de {device_id}"}, 404
+    entry = model_registry.peek(device_id)
+    asignado = planificador.intervalo(device_id)
+    return {
+        "device_id": device_id,
+        "history": resumen,
+        "analyzer": entry.analyzer.get_stats() if entry is not None else None,
+        "sampling": {"interval_ms": asignado[0], "reason": asignado[1]} if asignado else None
+    }, 200
+
+
+@app.route("/devices", methods=["GET"])
+def devices():
+    cuerpo, codigo = listar_dispositivos()
+    return jsonify(cuerpo), codigo
+
+
+@app.route("/devices/<device_id>/recent", methods=["GET"])
+def device_recent(device_id):
+    cuerpo, codigo = historial_dispositivo(device_id, request.args)
+    return jsonify(cuerpo), codigo
+
+
+@app.route("/devices/<device_id>/stats", methods=["GET"])
+def device_stats(device_id):
+    cuerpo, codigo = estadisticas_dispositivo(device_id, request.args)
+    return jsonify(cuerpo), codigo
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    cuerpo, codigo = estado_arranque()
+    return jsonify(cuerpo), codigo
+
+
+def estadisticas_influx():
+    """Escritor principal, agregador de rollups y, si escribe a otro bucket, su escritor"""
+    stats = influx_writer.get_stats()
+    if agregador is not None:
+        stats.update(agregador.get_stats())
+    if rollup_writer is not influx_writer:
+        stats['rollup_writer'] = rollup_writer.get_stats()
+    return stats
+
+
+@app.route("/influx_stats", methods=["GET"])
+def influx_stats():
+    return jsonify(estadisticas_influx()), 200
+
+
+@app.route("/scheduler_stats", methods=["GET"])
+def scheduler_stats():
+    por_dispositivo = request.args.get("devices", "0") in ("1", "true", "True")
+    return jsonify(planificador.get_stats(por_dispositivo)), 200
+
+
+@app.route("/registry_stats", methods=["GET"])
+def registry_stats():
+    stats = model_registry.get_stats()
+    stats['pid'] = pid_store.get_stats()
+    stats['anomaly_engine'] = {'default': ANOMALY_ENGINE, 'devices': ANOMALY_ENGINE_DEVICES}
+    if avance_solar is not None:
+        stats.update(avance_solar.get_stats())
+    if learner_pool is not None:
+        stats.update(learner_pool.get_stats())
+    if historial is not None:
+        stats.update(historial.get_stats())
+    if snapshot_store:
+        stats['snapshots'] = snapshot_store.get_stats()
+    return jsonify(stats), 200
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=6000, debug=DEBUG_MODE, use_reloader=False)
@@ -0,0 +1,212 @@
+"""
+Checkpoints persistentes del estado por dispositivo (PID + modelos River).
+
+Cada dispositivo se guarda en su propio fichero binario (pickle comprimido
+con zlib) dentro de un directorio de estado. Solo se reescriben los
+dispositivos marcados como modificados desde el último checkpoint, y la
+escritura es atómica (fichero temporal + os.replace) para que un corte a
+mitad de escritura nunca deje un snapshot corrupto. La carga es perezosa:
+un dispositivo se restaura la primera vez que vuelve a reportar.
+"""
+
+import os
+import pickle
+import threading
+import time
+import zlib
+from urllib.parse import quote
+
+
+SNAPSHOT_VERSION = 1
+_MAGIC = b"STRK"
+
+
+class SnapshotStore:
+    """Almacén de snapshots en disco, con hilo de checkpoint periódico"""
+
+    def __init__(self, directory="state", interval_s=60.0, compress_level=1):
+        self.directory = directory
+        self.interval_s = float(interval_s)
+        self.compress_level = int(compress_level)
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._dirty = set()
+        # Estados de dispositivos expulsados de memoria pendientes de escribir
+        self._retenidos = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._capturar = None
+
+        # Métricas
+        self.saved = 0
+        self.loaded = 0
+        self.errors = 0
+        self.last_checkpoint_ts = None
+        self.last_checkpoint_s = None
+
+    # ------------------------------------------------------------------
+    # Serialización
+    # ------------------------------------------------------------------
+    def path_for(self, device_id):
+        # quote() evita que un device_id con '/' o '..' escape del directorio
+        return os.path.join(self.directory, quote(str(device_id), safe="") + ".snap")
+
+    def serializar(self, estado):
+        """dict -> bytes (cabecera + versión + pickle comprimido)"""
+        payload = pickle.dumps(estado, protocol=pickle.HIGHEST_PROTOCOL)
+        return _MAGIC + bytes([SNAPSHOT_VERSION]) + zlib.compress(payload, self.compress_level)
+
+    def deserializar(self, blob):
+        if blob[:4] != _MAGIC:
+            raise ValueError("cabecera de snapshot inválida")
+        version = blob[4]
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"versión de snapshot no soportada: {version}")
+        return pickle.loads(zlib.decompress(blob[5:]))
+
+    def guardar_bytes(self, device_id, blob):
+        """Escritura atómica de un snapshot ya serializado"""
+        path = self.path_for(device_id)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self.saved += 1
+
+    def guardar(self, device_id, estado):
+        self.guardar_bytes(device_id, self.serializar(estado))
+
+    def cargar(self, device_id):
+        """
+        Lee el snapshot de un dispositivo.
+
+        Returns:
+            dict | None: estado guardado, o None si no existe o es ilegible
+        """
+        with self._lock:
+            estado = self._retenidos.get(device_id)
+            if estado is not None:
+                # Vuelve a estar vivo: el próximo checkpoint lo captura bajo su lock
+                self._dirty.add(device_id)
+        if estado is not None:
+            return estado
+
+        try:
+            with open(self.path_for(device_id), "rb") as f:
+                estado = self.deserializar(f.read())
+            self.loaded += 1
+            return estado
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.errors += 1
+            print(f"[SNAPSHOT] no se pudo cargar {device_id}:", repr(e))
+            return None
+
+    # ------------------------------------------------------------------
+    # Checkpoint incremental
+    # ------------------------------------------------------------------
+    def marcar(self, device_id):
+        """Marca un dispositivo como modificado (barato, llamado en cada petición)"""
+        with self._lock:
+            self._dirty.add(device_id)
+
+    def retener(self, device_id, estado):
+        """Guarda en el próximo checkpoint el estado de un dispositivo ya fuera de memoria"""
+        with self._lock:
+            self._retenidos[device_id] = estado
+            self._dirty.discard(device_id)
+
+    def start(self, capturar):
+        """
+        Arranca el hilo de checkpoint.
+
+        Args:
+            capturar: función device_id -> bytes | None que serializa el
+                estado del dispositivo bajo su propio lock
+        """
+        self._capturar = capturar
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="snapshot-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Detiene el hilo y hace un último checkpoint"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval_s + 5)
+            self._thread = None
+        self.checkpoint()
+
+    def checkpoint(self):
+        """Guarda todos los dispositivos marcados; devuelve cuántos se escribieron"""
+        if self._capturar is None:
+            return 0
+
+        with self._lock:
+            pendientes = self._dirty
+            self._dirty = set()
+            # Copia: cada retenido sigue visible para cargar() hasta que su
+            # fichero está escrito y renombrado
+            retenidos = dict(self._retenidos)
+
+        inicio = time.perf_counter()
+        escritos = 0
+        for device_id, estado in retenidos.items():
+            if device_id in pendientes:
+                continue
+            try:
+                self.guardar(device_id, estado)
+                escritos += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"[SNAPSHOT] no se pudo guardar {device_id}:", repr(e))
+                continue
+            self._soltar(device_id, estado)
+
+        for device_id in pendientes:
+            try:
+                blob = self._capturar(device_id)
+                if blob is None:
+                    continue
+                self.guardar_bytes(device_id, blob)
+                escritos += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"[SNAPSHOT] no se pudo guardar {device_id}:", repr(e))
+                continue
+            if device_id in retenidos:
+                # Volvió a memoria (cargar) y su estado vivo ya está en disco
+                self._soltar(device_id, retenidos[device_id])
+
+        self.last_checkpoint_ts = time.time()
+        self.last_checkpoint_s = time.perf_counter() - inicio
+        return escritos
+
+    def _soltar(self, device_id, estado):
+        """Olvida un retenido ya en disco, salvo que otra expulsión lo haya sustituido"""
+        with self._lock:
+            if self._retenidos.get(device_id) is estado:
+                del self._retenidos[device_id]
+
+    def get_stats(self):
+        """Retorna estadísticas actuales del almacén"""
+        return {
+            'directory': self.directory,
+            'dirty': len(self._dirty),
+            'saved': self.saved,
+            'loaded': self.loaded,
+            'errors': self.errors,
+            'last_checkpoint_ts': self.last_checkpoint_ts,
+            'last_checkpoint_s': self.last_checkpoint_s
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self.checkpoint()
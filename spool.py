@@ -0,0 +1,223 @@
+"""
+Spool en disco (write-ahead, solo append) para las escrituras a InfluxDB.
+
+Cuando InfluxDB no está disponible, los lotes de line protocol se añaden a
+segmentos de fichero en lugar de perderse. Al recuperarse, el escritor los
+reenvía en bloque y en el mismo orden en que entraron. Los segmentos ya
+reenviados se borran.
+
+Reenviar una línea dos veces (p. ej. tras un corte a mitad de segmento) es
+inocuo: en InfluxDB un punto con la misma serie y timestamp se sobrescribe.
+
+Política de fsync:
+    - "always":   fsync en cada append (máxima durabilidad)
+    - "interval": fsync como mucho cada `fsync_interval_s` segundos
+    - "never":    lo decide el sistema operativo
+"""
+
+import os
+import time
+
+
+class WriteAheadSpool:
+    """Spool segmentado; pensado para usarse desde un único hilo (el escritor)"""
+
+    POLITICAS_FSYNC = ("always", "interval", "never")
+
+    def __init__(self, directory="spool", segment_max_bytes=8 * 1024 * 1024,
+                 max_total_bytes=512 * 1024 * 1024, fsync_policy="interval", fsync_interval_s=1.0):
+        if fsync_policy not in self.POLITICAS_FSYNC:
+            raise ValueError(f"fsync_policy debe ser uno de {self.POLITICAS_FSYNC}")
+
+        self.directory = directory
+        self.segment_max_bytes = int(segment_max_bytes)
+        self.max_total_bytes = int(max_total_bytes)
+        self.fsync_policy = fsync_policy
+        self.fsync_interval_s = float(fsync_interval_s)
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Segmentos existentes (de una ejecución anterior) se conservan y reenvían
+        self._segmentos = sorted(n for n in os.listdir(self.directory) if n.endswith(".lp"))
+        self._seq = int(self._segmentos[-1][4:16]) + 1 if self._segmentos else 0
+        self._total_bytes = sum(os.path.getsize(self._ruta(n)) for n in self._segmentos)
+
+        self._actual = None          # fichero abierto para append
+        self._actual_nombre = None
+        self._actual_bytes = 0
+        self._ultimo_fsync = 0.0
+
+        self._lectura_nombre = None  # segmento en reenvío y posición confirmada
+        self._lectura_offset = 0
+
+        # Métricas
+        self.lines_spooled = 0
+        self.lines_replayed = 0
+        self.lines_dropped = 0
+        self.segments_dropped = 0
+
+    # ------------------------------------------------------------------
+    def _ruta(self, nombre):
+        return os.path.join(self.directory, nombre)
+
+    def _abrir_segmento(self):
+        self._actual_nombre = f"seg-{self._seq:012d}.lp"
+        self._seq += 1
+        self._actual = open(self._ruta(self._actual_nombre), "ab")
+        self._actual_bytes = 0
+        self._segmentos.append(self._actual_nombre)
+
+    def _cerrar_segmento(self):
+        if self._actual is not None:
+            self._actual.flush()
+            if self.fsync_policy != "never":
+                os.fsync(self._actual.fileno())
+            self._actual.close()
+            self._actual = None
+            self._actual_nombre = None
+
+    def _liberar_espacio(self, necesarios):
+        """Descarta los segmentos cerrados más antiguos hasta que quepan `necesarios` bytes"""
+        while self._total_bytes + necesarios > self.max_total_bytes:
+            candidatos = [n for n in self._segmentos if n != self._actual_nombre]
+            if not candidatos:
+                return False
+            nombre = candidatos[0]
+            ruta = self._ruta(nombre)
+            try:
+                with open(ruta, "rb") as f:
+                    if nombre == self._lectura_nombre:
+                        f.seek(self._lectura_offset)
+                    perdidas = f.read().count(b"\n")
+                tam = os.path.getsize(ruta)
+                os.remove(ruta)
+            except FileNotFoundError:
+                perdidas, tam = 0, 0
+            self._segmentos.remove(nombre)
+            self._total_bytes -= tam
+            self.lines_dropped += perdidas
+            self.segments_dropped += 1
+            if nombre == self._lectura_nombre:
+                self._lectura_nombre = None
+                self._lectura_offset = 0
+            print(f"[SPOOL] límite de {self.max_total_bytes} bytes: descartado {nombre} ({perdidas} líneas)")
+        return True
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+    def append(self, lines):
+        """
+        Añade líneas al final del spool.
+
+        Returns:
+            bool: False si no cupieron por el límite de tamaño
+        """
+        if not lines:
+            return True
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+
+        if not self._liberar_espacio(len(data)):
+            self.lines_dropped += len(lines)
+            return False
+
+        if self._actual is None or self._actual_bytes >= self.segment_max_bytes:
+            self._cerrar_segmento()
+            self._abrir_segmento()
+
+        self._actual.write(data)
+        self._actual_bytes += len(data)
+        self._total_bytes += len(data)
+        self.lines_spooled += len(lines)
+
+        if self.fsync_policy == "always":
+            self._actual.flush()
+            os.fsync(self._actual.fileno())
+        elif self.fsync_policy == "interval":
+            ahora = time.monotonic()
+            if ahora - self._ultimo_fsync >= self.fsync_interval_s:
+                self._actual.flush()
+                os.fsync(self._actual.fileno())
+                self._ultimo_fsync = ahora
+        return True
+
+    # ------------------------------------------------------------------
+    # Reenvío
+    # ------------------------------------------------------------------
+    def pendiente(self):
+        """True si hay líneas sin reenviar"""
+        return self._total_bytes > 0
+
+    def leer_lote(self, max_lines):
+        """
+        Lee las siguientes líneas pendientes (en orden) sin confirmarlas.
+
+        Returns:
+            tuple: (lines, token) — pasar token a confirmar() tras enviarlas;
+                lines vacío si no queda nada
+        """
+        if not self._segmentos:
+            return [], None
+
+        # Si solo queda el segmento en escritura, cerrarlo para poder leerlo
+        if self._segmentos[0] == self._actual_nombre:
+            self._cerrar_segmento()
+
+        nombre = self._segmentos[0]
+        if nombre != self._lectura_nombre:
+            self._lectura_nombre = nombre
+            self._lectura_offset = 0
+
+        lines = []
+        raw = b""
+        with open(self._ruta(nombre), "rb") as f:
+            f.seek(self._lectura_offset)
+            while len(lines) < max_lines:
+                raw = f.readline()
+                if not raw or not raw.endswith(b"\n"):
+                    # Fin del segmento, o línea truncada por un corte durante la escritura
+                    break
+                line = raw[:-1].decode("utf-8", "replace")
+                if line:
+                    lines.append(line)
+            offset = f.tell()
+            fin = offset >= os.fstat(f.fileno()).st_size
+
+        return lines, (nombre, offset, fin, len(lines))
+
+    def confirmar(self, token):
+        """Marca como enviadas las líneas devueltas por leer_lote()"""
+        if token is None:
+            return
+        nombre, offset, fin, n = token
+        if nombre != self._lectura_nombre:
+            return
+        self.lines_replayed += n
+        if fin:
+            ruta = self._ruta(nombre)
+            try:
+                tam = os.path.getsize(ruta)
+                os.remove(ruta)
+            except FileNotFoundError:
+                tam = 0
+            self._segmentos.remove(nombre)
+            self._total_bytes -= tam
+            self._lectura_nombre = None
+            self._lectura_offset = 0
+        else:
+            self._lectura_offset = offset
+
+    def close(self):
+        self._cerrar_segmento()
+
+    def get_stats(self):
+        """Retorna estadísticas actuales del spool (backpressure)"""
+        return {
+            'spool_segments': len(self._segmentos),
+            'spool_bytes': self._total_bytes,
+            'spool_max_bytes': self.max_total_bytes,
+            'spool_lines_spooled': self.lines_spooled,
+            'spool_lines_replayed': self.lines_replayed,
+            'spool_lines_dropped': self.lines_dropped,
+            'spool_segments_dropped': self.segments_dropped
+        }
@@ -0,0 +1,34 @@
+"""Rollups de un tracker que deja de enviar lecturas"""
+
+from aggregates import AgregadorTracker
+
+INICIO_MS = 1_700_000_040_000  # múltiplo de 60 s: inicio de una ventana de 1 minuto
+
+
+def _observar(agregador, ts_ms):
+    agregador.observar("tracker_01", ts_ms, 1200, 1180, 1150, 1160, 1.6,
+                       "SUNNY", False, False, 90, 45)
+
+
+def test_ventana_de_tracker_parado_se_emite_tras_la_gracia():
+    emitidas = []
+    agregador = AgregadorTracker(emitidas.extend, gracia_s=30)
+    for i in range(10):
+        _observar(agregador, INICIO_MS + i * 1000)
+    assert emitidas == []
+
+    # El tracker no vuelve a enviar: dentro de la gracia la ventana sigue abierta
+    agregador.cerrar_vencidas(INICIO_MS + 60_000 + 29_000)
+    assert emitidas == []
+
+    agregador.cerrar_vencidas(INICIO_MS + 60_000 + 30_000)
+    assert len(emitidas) == 1
+    assert emitidas[0].startswith("tracker_1m,device=tracker_01 ")
+    assert emitidas[0].endswith(f" {INICIO_MS}")
+    assert "samples=10i" in emitidas[0]
+
+    # Cada ventana se emite una sola vez; la de 1 hora, tras su propia gracia
+    agregador.cerrar_vencidas(INICIO_MS + 60_000 + 31_000)
+    assert len(emitidas) == 1
+    agregador.cerrar_vencidas(INICIO_MS - INICIO_MS % 3_600_000 + 3_600_000 + 30_000)
+    assert [linea.split(",")[0] for linea in emitidas] == ["tracker_1m", "tracker_1h"]
@@ -0,0 +1,120 @@
+"""Router de cluster.py: cada lectura llega al backend dueño de su dispositivo"""
+
+import io
+import json
+
+import binary_format
+from cluster import RouterApp, backend_para
+
+N_BACKENDS = 3
+
+
+class _Respuesta:
+    def __init__(self, cuerpo):
+        self.status_code = 200
+        self.reason = "OK"
+        self.content = json.dumps(cuerpo).encode("utf-8")
+        self.headers = {"Content-Type": "application/json"}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def _router():
+    """Router con backends falsos que anotan lo que reciben y responden como atender_lote"""
+    router = RouterApp([f"127.0.0.1:{6001 + i}" for i in range(N_BACKENDS)])
+    router.recibido = {}
+
+    def backend(idx):
+        def request(metodo, url, data=None, headers=None, timeout=None):
+            router.recibido[idx] = (data, headers.get("content-type"))
+            if headers.get("content-type") == binary_format.CONTENT_TYPE:
+                lecturas = binary_format.decodificar(data)
+            else:
+                lecturas = json.loads(data)
+            ultima = lecturas[-1]
+            return _Respuesta({"status": "ok", "device_id": ultima["device_id"], "processed": len(lecturas),
+                               "command": {"servo_h": ultima["servo_h"], "servo_v": ultima["servo_v"]}})
+        return request
+
+    for i, sesion in enumerate(router._sesiones):
+        sesion.request = backend(i)
+    return router
+
+
+def _llamar(router, ruta, cuerpo, content_type):
+    estado = {}
+
+    def start_response(status, cabeceras):
+        estado["status"] = status
+        estado["cabeceras"] = dict(cabeceras)
+
+    environ = {"REQUEST_METHOD": "POST", "PATH_INFO": ruta, "QUERY_STRING": "",
+               "CONTENT_TYPE": content_type, "CONTENT_LENGTH": str(len(cuerpo)),
+               "wsgi.input": io.BytesIO(cuerpo)}
+    contenido = b"".join(router(environ, start_response))
+    return estado, json.loads(contenido)
+
+
+def _dispositivos_de_backends_distintos():
+    duenos = {}
+    for i in range(100):
+        duenos.setdefault(backend_para(f"tracker_{i:02d}", N_BACKENDS), f"tracker_{i:02d}")
+        if len(duenos) == 2:
+            return [(idx, device_id) for idx, device_id in duenos.items()]
+    raise AssertionError("no hay dos dispositivos con backends distintos")
+
+
+def _lectura(device_id, servo_h):
+    return {"device_id": device_id, "ldr_tl": 1200, "ldr_tr": 1180, "ldr_bl": 1150, "ldr_br": 1160,
+            "servo_h": servo_h, "servo_v": 45, "panel_voltage": 1.6}
+
+
+def test_lote_con_dos_dispositivos_se_reparte_por_dueno():
+    (idx_a, dev_a), (idx_b, dev_b) = _dispositivos_de_backends_distintos()
+    router = _router()
+    lote = [_lectura(dev_a, 10), _lectura(dev_b, 20), _lectura(dev_a, 11), _lectura(dev_b, 21)]
+
+    estado, respuesta = _llamar(router, "/sensor_values/batch", json.dumps(lote).encode(), "application/json")
+
+    assert estado["status"].startswith("200")
+    assert set(router.recibido) == {idx_a, idx_b}
+    assert [l["servo_h"] for l in json.loads(router.recibido[idx_a][0])] == [10, 11]
+    assert [l["servo_h"] for l in json.loads(router.recibido[idx_b][0])] == [20, 21]
+    # Una sola respuesta: el comando del último dispositivo del lote y todas las lecturas contadas
+    assert respuesta["status"] == "ok"
+    assert respuesta["processed"] == 4
+    assert respuesta["device_id"] == dev_b
+    assert respuesta["command"]["servo_h"] == 21
+
+
+def test_lote_binario_y_objeto_con_device_id_por_defecto():
+    (idx_a, dev_a), (idx_b, dev_b) = _dispositivos_de_backends_distintos()
+
+    router = _router()
+    cuerpo = b"".join(binary_format.codificar_lectura(l)
+                      for l in [_lectura(dev_b, 20), _lectura(dev_a, 10)])
+    _, respuesta = _llamar(router, "/sensor_values/batch", cuerpo, binary_format.CONTENT_TYPE)
+    assert [l["device_id"] for l in binary_format.decodificar(router.recibido[idx_a][0])] == [dev_a]
+    assert [l["device_id"] for l in binary_format.decodificar(router.recibido[idx_b][0])] == [dev_b]
+    assert respuesta["device_id"] == dev_a and respuesta["processed"] == 2
+
+    router = _router()
+    sin_id = {k: v for k, v in _lectura(dev_a, 10).items() if k != "device_id"}
+    cuerpo = json.dumps({"device_id": dev_a, "readings": [sin_id, _lectura(dev_b, 20)]}).encode()
+    _llamar(router, "/sensor_values/batch", cuerpo, "application/json")
+    assert [l["device_id"] for l in json.loads(router.recibido[idx_a][0])] == [dev_a]
+    assert [l["device_id"] for l in json.loads(router.recibido[idx_b][0])] == [dev_b]
+
+
+def test_lectura_binaria_va_al_dueno_de_su_device_id():
+    (_, _), (idx_b, dev_b) = _dispositivos_de_backends_distintos()
+    router = _router()
+    # Sin X-Device-Id (el firmware no la envía): el id sale de la cabecera del registro
+    cuerpo = binary_format.codificar_lectura(_lectura(dev_b, 20))
+
+    estado, respuesta = _llamar(router, "/sensor_values", cuerpo, binary_format.CONTENT_TYPE)
+
+    assert list(router.recibido) == [idx_b]
+    assert estado["cabeceras"]["X-Backend"] == str(idx_b)
+    assert respuesta["device_id"] == dev_b
@@ -0,0 +1,54 @@
+"""Circuit breaker de los clientes de InfluxDB ante errores que no son de red"""
+
+import asyncio
+
+import pytest
+
+from influx_async import AsyncInfluxHTTPClient
+from influx_writer import CircuitBreaker, InfluxHTTPClient
+
+
+class _Respuesta:
+    status_code = 204
+    text = ""
+
+
+def _breaker_en_prueba():
+    """Breaker abierto con reset inmediato: el siguiente allow() es la prueba de HALF_OPEN"""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_s=0.0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_prueba_half_open_con_error_inesperado_reabre_el_breaker():
+    breaker = _breaker_en_prueba()
+    cliente = InfluxHTTPClient("http://influx.invalid/api/v2/write", {}, breaker=breaker)
+
+    def post_roto(*args, **kwargs):
+        raise ValueError("cuerpo no serializable")
+
+    cliente.session.post = post_roto
+    with pytest.raises(ValueError):
+        cliente.write("m v=1")
+    # Antes se quedaba en HALF_OPEN y allow() devolvía False para siempre
+    assert breaker.state == CircuitBreaker.OPEN
+
+    cliente.session.post = lambda *args, **kwargs: _Respuesta()
+    cliente.write("m v=1")
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_prueba_half_open_async_con_error_inesperado_reabre_el_breaker():
+    breaker = _breaker_en_prueba()
+    cliente = AsyncInfluxHTTPClient("http://influx.invalid/api/v2/write", {}, breaker=breaker)
+
+    class SesionRota:
+        def post(self, *args, **kwargs):
+            raise OSError("descriptor cerrado")
+
+    cliente.session = SesionRota()
+    with pytest.raises(OSError):
+        asyncio.run(cliente.write("m v=1"))
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow()
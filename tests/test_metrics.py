@@ -0,0 +1,32 @@
+"""Fragmentos por hilo de metrics.py con hilos de vida corta"""
+
+import threading
+
+import pytest
+
+from metrics import Counter, Histogram
+
+
+def _en_hilos(funcion, n):
+    for _ in range(n):
+        hilo = threading.Thread(target=funcion)
+        hilo.start()
+        hilo.join()
+
+
+def test_fragmentos_de_hilos_terminados_no_crecen_sin_scrapes():
+    contador = Counter("peticiones_total", "Peticiones")
+    histograma = Histogram("latencia_segundos", "Latencia")
+
+    def peticion():
+        contador.inc(labels=())
+        histograma.observe(0.01)
+
+    # Un hilo por petición (werkzeug) y ningún /metrics entre medias
+    _en_hilos(peticion, 2000)
+
+    assert len(contador._fragmentos) <= 2
+    assert len(histograma._fragmentos) <= 2
+    # Lo plegado no se pierde
+    assert contador.valor() == 2000
+    assert histograma._recoger()[()][-1] == pytest.approx(2000 * 0.01)
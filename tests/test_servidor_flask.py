@@ -0,0 +1,38 @@
+"""Validación de lecturas en /sensor_values y /sensor_values/batch"""
+
+import os
+
+# Antes de importar el servidor: sin snapshots ni spool en disco, InfluxDB inalcanzable
+os.environ.setdefault("SNAPSHOTS_ENABLED", "0")
+os.environ.setdefault("SPOOL_ENABLED", "0")
+os.environ.setdefault("INFLUX_PORT", "1")
+
+import pytest  # noqa: E402
+
+import servidor_flask  # noqa: E402
+
+LECTURA = '"ldr_tl": {ldr}, "ldr_tr": 1180, "ldr_bl": 1150, "ldr_br": 1160, "servo_h": 90, "servo_v": 45'
+
+
+@pytest.fixture
+def cliente():
+    return servidor_flask.app.test_client()
+
+
+@pytest.mark.parametrize("valor", ["Infinity", "-Infinity", "1e400"])
+def test_sensor_values_con_valor_no_finito_es_400(cliente, valor):
+    cuerpo = '{"device_id": "tracker_01", ' + LECTURA.format(ldr=valor) + '}'
+    r = cliente.post("/sensor_values", data=cuerpo, content_type="application/json")
+    assert r.status_code == 400
+    assert r.get_json()["status"] == "error"
+
+
+@pytest.mark.parametrize("campo", ["ldr", "ts_ms", "age_ms"])
+def test_lote_con_valor_no_finito_es_400(cliente, campo):
+    lectura = LECTURA.format(ldr="Infinity" if campo == "ldr" else 1200)
+    if campo != "ldr":
+        lectura += f', "{campo}": 1e400'
+    cuerpo = '[{"device_id": "tracker_01", ' + lectura + '}]'
+    r = cliente.post("/sensor_values/batch", data=cuerpo, content_type="application/json")
+    assert r.status_code == 400
+    assert r.get_json()["status"] == "error"
@@ -0,0 +1,56 @@
+"""Checkpoint de snapshots concurrente con la carga de un dispositivo expulsado"""
+
+import threading
+
+from snapshots import SnapshotStore
+
+
+def test_retenido_visible_para_cargar_mientras_se_escribe(tmp_path):
+    store = SnapshotStore(directory=str(tmp_path))
+    # Sin hilo periódico: el checkpoint se llama a mano
+    store._capturar = lambda device_id: None
+
+    store.guardar("tracker_01", {"pid": {"intErrH": 1.0}})
+    store.retener("tracker_01", {"pid": {"intErrH": 2.0}})
+
+    escribiendo = threading.Event()
+    seguir = threading.Event()
+    guardar_bytes = store.guardar_bytes
+
+    def guardar_lento(device_id, blob):
+        # El checkpoint ya tomó los retenidos y aún no ha renombrado el fichero
+        escribiendo.set()
+        seguir.wait(5)
+        guardar_bytes(device_id, blob)
+
+    store.guardar_bytes = guardar_lento
+    hilo = threading.Thread(target=store.checkpoint)
+    hilo.start()
+    assert escribiendo.wait(5)
+    # Antes se leía el fichero viejo (intErrH 1.0): el estado de la expulsión se perdía
+    assert store.cargar("tracker_01")["pid"]["intErrH"] == 2.0
+    seguir.set()
+    hilo.join(5)
+
+    assert store.cargar("tracker_01")["pid"]["intErrH"] == 2.0
+
+
+def test_retenido_se_olvida_tras_escribirse_salvo_si_se_sustituye(tmp_path):
+    store = SnapshotStore(directory=str(tmp_path))
+    store._capturar = lambda device_id: None
+
+    store.retener("tracker_01", {"pid": {"intErrH": 2.0}})
+    store.checkpoint()
+    assert store._retenidos == {}
+
+    guardar_bytes = store.guardar_bytes
+
+    def guardar_y_sustituir(device_id, blob):
+        guardar_bytes(device_id, blob)
+        # Nueva expulsión mientras se escribía la anterior
+        store.retener(device_id, {"pid": {"intErrH": 3.0}})
+
+    store.retener("tracker_01", {"pid": {"intErrH": 2.5}})
+    store.guardar_bytes = guardar_y_sustituir
+    store.checkpoint()
+    assert store._retenidos["tracker_01"]["pid"]["intErrH"] == 3.0
@@ -0,0 +1,16 @@
+"""
+Punto de entrada WSGI para servidores de producción (gunicorn).
+
+El estado por dispositivo vive en memoria del proceso, así que cada
+instancia debe ejecutarse con un único proceso y varios hilos:
+
+    gunicorn -w 1 --threads 16 -b 0.0.0.0:6000 wsgi:app
+
+Para usar varios núcleos, `python cluster.py serve --workers N` arranca N
+procesos como este detrás de un router que envía cada device_id siempre al
+mismo proceso.
+"""
+
+from servidor_flask import app
+
+__all__ = ["app"]